@@ -1,18 +1,27 @@
-import os, json
+import os, json, uuid
 import pandas as pd
 import streamlit as st
 
-from engine.config import APP_ROOT, KB_DIR
-from engine.orchestrator import run_aegis
+from engine.config import APP_ROOT, KB_DIR, PRELOAD_LLM_IDS
+from engine.llm_registry import preload_llms, REGISTRY
+from engine.evidence import load_evidence
+from engine.jobs import get_runner
+from engine import run_store
 
 st.set_page_config(page_title="AEGIS – Full Audit", layout="wide")
 st.title("AEGIS – AI Governance & Risk Platform (Full End-to-End)")
-st.caption("Runs ML + GenAI/RAG audits inside Streamlit using a LangGraph multi-agent workflow.")
+st.caption("Runs ML + GenAI/RAG audits as background jobs using a multi-agent workflow.")
+
+PAGE_SIZE = 20
 
 with st.sidebar:
     st.header("Run Settings")
     rebuild = st.checkbox("Rebuild VectorDB (fresh indexing)", value=False)
     strict = st.checkbox("Strict citation enforcement", value=True)
+    deterministic = st.checkbox("Deterministic decoding (reproducible answers)", value=False)
+    # the answer cache only holds deterministic decodes, so it is off with sampled decoding
+    use_cache = st.checkbox("Reuse cached RAG answers (deterministic decoding only)", value=True, disabled=not deterministic,
+                            help=None if deterministic else "Enable deterministic decoding to use the answer cache.") and deterministic
 
     st.divider()
     st.header("Local LLM")
@@ -29,51 +38,202 @@ with st.sidebar:
 
 @st.cache_resource
 def _warmup():
-    # Ensures Streamlit caches resources across reruns
-    return True
+    # Runs once per process: loads AEGIS_PRELOAD_LLMS into the shared model registry
+    return preload_llms(PRELOAD_LLM_IDS)
+
+@st.cache_resource
+def _runner():
+    # one job worker for every session of this server process; it shares the warm registry above
+    return get_runner()
 
 _warmup()
+runner = _runner()
 
-if run_btn:
-    with st.spinner("Running multi-agent workflow (ML + RAG + controls + risks + PDF)..."):
-        result = run_aegis(rebuild_vectordb=rebuild, strict_citations=strict, llm_id=llm_id)
-    st.session_state["last_run"] = result
+with st.sidebar:
+    loaded = REGISTRY.loaded()
+    if loaded:
+        st.caption("Warm models: " + ", ".join(f"{m['model_id']} ({m['mode']}, {m['mem_gb']} GB)" for m in loaded))
 
-res = st.session_state.get("last_run")
+session = st.session_state.setdefault("session_id", uuid.uuid4().hex[:8])
+if run_btn:
+    job_id = runner.submit({"rebuild_vectordb": rebuild, "strict_citations": strict, "llm_id": llm_id,
+                            "deterministic": deterministic, "use_answer_cache": use_cache}, submitted_by=session)
+    st.session_state["watch_job"] = job_id
+    st.toast(f"Audit queued as job {job_id}")
+
+# A finished run never changes, so everything below is cached per run_id.
+@st.cache_data(show_spinner=False)
+def _run_record(run_id: str):
+    run = run_store.load_run(run_id)
+    if not run:
+        raise KeyError(run_id)  # not stored yet; raising keeps the miss out of the cache
+    run["logs"] = json.loads(run.pop("logs_json") or "[]")
+    run["trace_summary"] = json.loads(run.pop("trace_summary_json") or "{}")
+    return run
+
+def _stored_run(run_id: str):
+    try:
+        return _run_record(run_id)
+    except KeyError:
+        return None
+
+@st.cache_data(show_spinner=False)
+def _evidence_index(run_id: str):
+    ev = load_evidence(_run_record(run_id)["evidence_dir"])
+    return {"documents": sorted(ev.docs), "tables": sorted(set(ev.tables) | set(ev.files))}
+
+@st.cache_data(show_spinner=False)
+def _evidence_table(run_id: str, name: str) -> pd.DataFrame:
+    return load_evidence(_run_record(run_id)["evidence_dir"]).table(name)
+
+@st.cache_data(show_spinner=False)
+def _file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _stage_rows(job):
+    planned = job["stages"].get("workflow", {}).get("nodes", [])
+    stages = {k: v for k, v in job["stages"].items() if k != "workflow"}
+    return [{"stage": s, **stages.get(s, {"status": "pending"})} for s in planned or stages]
+
+@st.fragment(run_every=2)
+def _jobs_panel():
+    # reruns on its own every 2 s; the rest of the page (and other sessions) are not blocked
+    jobs = run_store.list_jobs(limit=10)
+    if not jobs:
+        st.caption("No audit jobs yet.")
+        return
+    for job in jobs:
+        rows = _stage_rows(job)
+        done = sum(r["status"] in ("ok", "failed", "timeout", "skipped") for r in rows)
+        mine = " (you)" if job["submitted_by"] == session else ""
+        label = f"{job['job_id']}{mine} · {job['status']} · {job['run_id'] or 'not started'} · submitted {job['submitted_at'][:19]}"
+        with st.expander(label, expanded=job["job_id"] == st.session_state.get("watch_job") and job["status"] != "done"):
+            if job["status"] in ("queued", "running"):
+                st.progress(done / max(len(rows), 1), text=f"{done}/{len(rows)} stages")
+            if rows:
+                st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+            if job["error"]:
+                st.error(job["error"])
+            if job["logs"]:
+                st.caption("Workflow logs")
+                st.json(job["logs"], expanded=False)
+            if job["status"] == "done" and st.button("Open results", key=f"open-{job['job_id']}"):
+                st.session_state["selected_run"] = job["run_id"]
+                st.rerun()
+
+st.subheader("Audit Jobs")
+_jobs_panel()
+
+st.subheader("Run History")
+n_runs = run_store.count_runs()
+if n_runs:
+    n_pages = (n_runs + PAGE_SIZE - 1) // PAGE_SIZE
+    page = st.number_input(f"Page (of {n_pages})", 1, n_pages, 1)
+    hist = pd.DataFrame(run_store.list_runs(PAGE_SIZE, (page - 1) * PAGE_SIZE), columns=["run_id", "timestamp", "llm_mode"])
+    st.dataframe(hist, use_container_width=True, hide_index=True)
+    pick = st.selectbox("Show run", hist["run_id"], index=None, placeholder="select a run on this page")
+    if pick:
+        st.session_state["selected_run"] = pick
+else:
+    st.caption("No runs recorded yet.")
+
+with st.expander("Trends"):
+    # indexed run_store queries; no evidence files are opened here
+    models = run_store.list_models()
+    if not models:
+        st.caption("No runs recorded yet.")
+    else:
+        c1, c2, c3 = st.columns(3)
+        model = c1.selectbox("Model", models)
+        metric = c2.selectbox("Metric", ["di", "worst_di", "psi_max", "drift_score", "accuracy", "auc",
+                                         "citation_coverage", "faithfulness"])
+        n_last = c3.number_input("Last N runs", 10, 100_000, 1000, step=100)
+        trend = run_store.metric_history(metric, model, int(n_last))
+        if len(trend):
+            st.line_chart(trend.set_index("ts")["value"].sort_index())
+        st.dataframe(run_store.metric_daily(metric, model), use_container_width=True)
+        c1, c2 = st.columns(2)
+        control_id = c1.text_input("Control", "O-02")
+        to_status = c2.selectbox("Flipped to", ["REVIEW", "FAIL", "PASS"])
+        st.dataframe(run_store.control_flips(control_id, to_status, model), use_container_width=True)
+
+@st.cache_resource(show_spinner="Loading policy index...")
+def _retriever():
+    from engine.vectordb import build_retriever
+    return build_retriever(k=4)[0]
+
+@st.fragment
+def _ask_panel():
+    # answers stream in as they are generated; only this fragment reruns
+    from engine.llm_registry import get_llm
+    from engine.answer_cache import AnswerCache
+    from engine.rag_audit_agent import AnswerStream
+
+    query = st.text_input("Question", placeholder="What does the standard require for prompt injection resistance?")
+    if not st.button("Ask", disabled=not query):
+        return
+    gen, mode, _ = get_llm(llm_id)
+    stream = AnswerStream(_retriever(), gen, query, strict=strict, deterministic=deterministic,
+                          cache=AnswerCache() if use_cache else None)
+    st.write_stream(stream)
+    out = stream.result
+    if out["refused"]:
+        st.warning(f"Final answer: {out['answer']}")
+    g = out.get("generation", {})
+    if g.get("cached"):
+        st.caption(f"LLM mode: {mode} · answer from cache")
+    elif g:
+        st.caption(f"LLM mode: {mode} · first token {g['ttft_s']:.2f}s · {g['tokens_out']} tokens at {g['tokens_per_s']} tok/s"
+                   f" · stopped: {g['stop_reason']}")
+    if out["citations"]:
+        st.dataframe(pd.DataFrame(out["citations"]), use_container_width=True, hide_index=True)
+
+with st.expander("Ask the Policy Assistant"):
+    _ask_panel()
+
+run_id = st.session_state.get("selected_run")
+res = _stored_run(run_id) if run_id else None
 if not res:
-    st.info("Click **Run Full Audit** to generate evidence, risk register, and the PDF audit pack.")
+    st.info("Click **Run Full Audit** to queue an audit, then open its results from the job list or the run history.")
     st.stop()
 
-st.success(f"Run complete: {res['run_id']} | LLM mode: {res.get('llm_mode','')}")
+st.success(f"Run {res['run_id']} | LLM mode: {res.get('llm_mode','')}")
+incomplete = [e["node"] for e in res.get("logs", []) if e.get("status") in ("failed", "timeout", "skipped")]
+if incomplete:
+    st.warning(f"Partial run: {', '.join(incomplete)} did not complete; the audit pack marks them.")
 
 col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Control Results")
-    cpath = os.path.join(res["evidence_dir"], "control_results.csv")
-    cdf = pd.read_csv(cpath)
+    cdf = _evidence_table(run_id, "controls")
     st.dataframe(cdf, use_container_width=True)
     st.download_button("Download control_results.csv", data=cdf.to_csv(index=False).encode("utf-8"),
-                       file_name=f"control_results_{res['run_id']}.csv", mime="text/csv")
+                       file_name=f"control_results_{run_id}.csv", mime="text/csv")
 
 with col2:
     st.subheader("Risk Register")
-    rpath = os.path.join(res["evidence_dir"], "risk_register.csv")
-    rdf = pd.read_csv(rpath)
+    rdf = _evidence_table(run_id, "risks")
     st.dataframe(rdf, use_container_width=True)
     st.download_button("Download risk_register.csv", data=rdf.to_csv(index=False).encode("utf-8"),
-                       file_name=f"risk_register_{res['run_id']}.csv", mime="text/csv")
+                       file_name=f"risk_register_{run_id}.csv", mime="text/csv")
 
 st.subheader("Evidence Artifacts")
-st.code(res["evidence_dir"])
-ev_files = sorted([f for f in os.listdir(res["evidence_dir"]) if os.path.isfile(os.path.join(res["evidence_dir"], f))])
-st.write(ev_files)
+st.code(res.get("evidence_bundle") or res["evidence_dir"])
+st.write(_evidence_index(run_id))
+if st.button("Export evidence as CSV/JSON files"):
+    st.write(load_evidence(res["evidence_dir"]).export())
 
 st.subheader("Audit Pack PDF")
 pdf_path = res["audit_pdf"]
 pdf_name = os.path.basename(pdf_path)
-with open(pdf_path, "rb") as f:
-    st.download_button(f"Download {pdf_name}", data=f.read(), file_name=pdf_name, mime="application/pdf")
+st.download_button(f"Download {pdf_name}", data=_file_bytes(pdf_path), file_name=pdf_name, mime="application/pdf")
 
 st.subheader("Workflow Logs (multi-agent trace)")
 st.json(res.get("logs", []))
+
+if res.get("trace_summary"):
+    st.subheader("Stage Timings")
+    st.dataframe(pd.DataFrame(res["trace_summary"]).T.sort_values("wall_s", ascending=False), use_container_width=True)
+    st.caption(f"Chrome trace (open in chrome://tracing or Perfetto): {res.get('trace_path','')}")
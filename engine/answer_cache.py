@@ -0,0 +1,74 @@
+import os, json, time, sqlite3, hashlib, threading
+from .config import OUTPUTS_DIR, ANSWER_CACHE_MAX_ENTRIES
+
+CACHE_PATH = os.path.join(OUTPUTS_DIR, "answer_cache.db")
+
+def cache_key(model_id: str, decoding: dict, prompt: str, chunk_ids) -> str:
+    payload = json.dumps({"model": model_id, "decoding": decoding, "prompt": prompt, "chunks": list(chunk_ids)}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    On-disk RAG answer cache (SQLite) with LRU eviction once more than
+    max_entries answers are stored. hits/misses count lookups made through
+    this instance, so one instance per run gives per-run counters.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        con = sqlite3.connect(path)
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS answers (
+            key TEXT PRIMARY KEY,
+            answer TEXT,
+            model_id TEXT,
+            created REAL,
+            last_used REAL
+        )
+        """)
+        con.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers(last_used)")
+        con.commit()
+        con.close()
+
+    def get(self, key: str):
+        with self._lock:
+            con = sqlite3.connect(self.path)
+            row = con.execute("SELECT answer FROM answers WHERE key=?", (key,)).fetchone()
+            if row is not None:
+                con.execute("UPDATE answers SET last_used=? WHERE key=?", (time.time(), key))
+                con.commit()
+                self.hits += 1
+            else:
+                self.misses += 1
+            con.close()
+            return row[0] if row is not None else None
+
+    def put_many(self, items):
+        """items: iterable of (key, answer, model_id)."""
+        now = time.time()
+        rows = [(k, a, m, now, now) for k, a, m in items]
+        if not rows:
+            return
+        with self._lock:
+            con = sqlite3.connect(self.path)
+            con.executemany("INSERT OR REPLACE INTO answers VALUES (?,?,?,?,?)", rows)
+            n = con.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if n > self.max_entries:
+                cur = con.execute("""
+                DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY last_used ASC LIMIT ?
+                )""", (n - self.max_entries,))
+                self.evicted += cur.rowcount
+            con.commit()
+            con.close()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
@@ -3,13 +3,98 @@ import os
 APP_ROOT = r"/content/aegis/aegis_streamlit_full"
 DATA_DIR = os.path.join(APP_ROOT, "data")
 KB_DIR = os.path.join(DATA_DIR, "kb")
+# the catalog ships with the code (data/ next to engine/), not under APP_ROOT
+PACKAGED_CONTROLS_CATALOG = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data", "controls_catalog.json"))
+CONTROLS_CATALOG_PATH = os.environ.get("AEGIS_CONTROLS_CATALOG", PACKAGED_CONTROLS_CATALOG)
+GUARDRAILS_PATH = os.environ.get("AEGIS_GUARDRAILS", os.path.join(DATA_DIR, "guardrails.json"))  # optional rule overrides
 
 OUTPUTS_DIR = os.path.join(APP_ROOT, "outputs")
 RUNS_DIR = os.path.join(OUTPUTS_DIR, "runs")
+POLICY_INDEX_DIR = os.path.join(OUTPUTS_DIR, "policy_index")  # shared across runs
+FLAT_INDEX_DIR = os.path.join(OUTPUTS_DIR, "policy_index_npy")  # same KB as a memory-mapped .npy matrix
+FLEETS_DIR = os.path.join(OUTPUTS_DIR, "fleets")
+DRIFT_PROFILE_DIR = os.path.join(OUTPUTS_DIR, "drift_profiles")  # reference profiles reused across runs of the same data
 
 DEFAULT_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# policy retriever: "chroma" (vector store) or "npy" (flat normalized matrix, batched exact search)
+VECTOR_BACKEND = os.environ.get("AEGIS_VECTOR_BACKEND", "chroma")
 DEFAULT_LLM_ID = "Qwen/Qwen2.5-1.5B-Instruct"  # open-weights (free)
 
+# LLM registry: warm models are kept for the life of the process, LRU-evicted above this budget
+LLM_RAM_BUDGET_GB = float(os.environ.get("AEGIS_LLM_RAM_BUDGET_GB", "12"))
+# llm.load_local_llm on CPU-only hosts: weights in AEGIS_LLM_CPU_DTYPE ("auto": bf16 where the CPU has a native bf16
+# path, else fp32), optionally with dynamic int8 linear layers; AEGIS_LLM_THREADS=0 keeps torch's intra-op default
+LLM_CPU_DTYPE = os.environ.get("AEGIS_LLM_CPU_DTYPE", "auto")
+LLM_CPU_INT8 = os.environ.get("AEGIS_LLM_CPU_INT8", "0") == "1"
+LLM_THREADS = int(os.environ.get("AEGIS_LLM_THREADS", "0"))
+LLM_BENCH_MODEL_ID = os.environ.get("AEGIS_LLM_BENCH_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")
+GEN_BATCH_SIZE = int(os.environ.get("AEGIS_GEN_BATCH_SIZE", "8"))
+GEN_MAX_NEW_TOKENS = int(os.environ.get("AEGIS_GEN_MAX_NEW_TOKENS", "220"))
+# the constant build_prompt preamble is prefilled once per loaded model and its KV cache reused by every query
+PREFIX_KV_CACHE = os.environ.get("AEGIS_PREFIX_KV_CACHE", "1") == "1"
+# Early stopping (llm.TextStop): checks run every GEN_STOP_CHECK_EVERY decode steps; in strict mode an answer with
+# GEN_STOP_UNCITED_SENTENCES sentences and no citation is cut off (it would be rejected); 0 disables early stopping
+GEN_EARLY_STOP = os.environ.get("AEGIS_GEN_EARLY_STOP", "1") == "1"
+GEN_STOP_CHECK_EVERY = int(os.environ.get("AEGIS_GEN_STOP_CHECK_EVERY", "4"))
+GEN_STOP_UNCITED_SENTENCES = int(os.environ.get("AEGIS_GEN_STOP_UNCITED_SENTENCES", "3"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("AEGIS_ANSWER_CACHE_MAX_ENTRIES", "50000"))
+# Streaming (out-of-core) ML audit: used for datasets larger than STREAM_AUTO_BYTES
+STREAM_AUTO_BYTES = int(os.environ.get("AEGIS_STREAM_AUTO_BYTES", str(512 * 1024 * 1024)))
+STREAM_MEMORY_BUDGET_MB = int(os.environ.get("AEGIS_STREAM_MEMORY_BUDGET_MB", "1024"))
+STREAM_RESERVOIR_MAX_ROWS = int(os.environ.get("AEGIS_STREAM_RESERVOIR_MAX_ROWS", "200000"))
+
+# Fairness engine: groups smaller than this are reported but excluded from DI
+FAIRNESS_MIN_GROUP_SIZE = int(os.environ.get("AEGIS_FAIRNESS_MIN_GROUP_SIZE", "30"))
+FAIRNESS_MAX_ORDER = int(os.environ.get("AEGIS_FAIRNESS_MAX_ORDER", "2"))  # 2 = pairwise intersections
+FAIRNESS_CONTINUOUS_BINS = 4
+
+# ML preprocessing: one-hot levels seen fewer than ML_RARE_MIN_COUNT times share one "infrequent" column
+# (0 = off, one column per level; enabling it changes the model's features and metrics);
+# categoricals with more than ML_HASH_CARDINALITY levels are hashed into ML_HASH_FEATURES columns (0 = never hash)
+ML_RARE_MIN_COUNT = int(os.environ.get("AEGIS_ML_RARE_MIN_COUNT", "0"))
+ML_HASH_CARDINALITY = int(os.environ.get("AEGIS_ML_HASH_CARDINALITY", "0"))
+ML_HASH_FEATURES = int(os.environ.get("AEGIS_ML_HASH_FEATURES", "1024"))
+ML_SPARSE_THRESHOLD = float(os.environ.get("AEGIS_ML_SPARSE_THRESHOLD", "0.3"))  # design matrix kept CSR below this density
+
+# Evidence bundle: tables with at least this many rows are stored uncompressed and memory-mapped on read;
+# EVIDENCE_EXPORT_FILES also writes the per-file CSV/JSON layout (control_csv/risk_csv in run records) for every run
+EVIDENCE_MMAP_MIN_ROWS = int(os.environ.get("AEGIS_EVIDENCE_MMAP_MIN_ROWS", "50000"))
+EVIDENCE_EXPORT_FILES = os.environ.get("AEGIS_EVIDENCE_EXPORT_FILES", "1") == "1"
+
+# Workflow scheduler (run_aegis)
+WORKFLOW_MAX_WORKERS = int(os.environ.get("AEGIS_WORKFLOW_MAX_WORKERS", "4"))
+WORKFLOW_ML_POOL = os.environ.get("AEGIS_WORKFLOW_ML_POOL", "process")  # "process" or "thread"
+WORKFLOW_NODE_TIMEOUT_S = float(os.environ.get("AEGIS_WORKFLOW_NODE_TIMEOUT_S", "3600"))
+# spawned processes shared by the process nodes (ML audits) of every concurrent run in this process
+PROCESS_WORKERS = int(os.environ.get("AEGIS_PROCESS_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+
+# Run store (outputs/runs.db): connections kept open per process, shared by the UI and workers
+RUN_STORE_POOL_SIZE = int(os.environ.get("AEGIS_RUN_STORE_POOL_SIZE", "4"))
+
+# Background audit jobs (engine.jobs): worker threads per process and queue poll interval
+JOB_WORKERS = int(os.environ.get("AEGIS_JOB_WORKERS", "1"))
+JOB_POLL_S = float(os.environ.get("AEGIS_JOB_POLL_S", "2"))
+
+# HTTP audit service (python -m engine.service); LLM_CONCURRENCY bounds simultaneous generate calls per process
+SERVICE_HOST = os.environ.get("AEGIS_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("AEGIS_SERVICE_PORT", "8765"))
+SERVICE_WORKERS = int(os.environ.get("AEGIS_SERVICE_WORKERS", "4"))
+LLM_CONCURRENCY = int(os.environ.get("AEGIS_LLM_CONCURRENCY", "1"))
+
+# Report rendering: processes laying out run sections of fleet packs
+REPORT_WORKERS = int(os.environ.get("AEGIS_REPORT_WORKERS", str(max(1, min(8, (os.cpu_count() or 2) - 1)))))
+
+# Red-team suites (engine.redteam): JSONL/CSV prompt suite used by run_rag_audit instead of the built-in
+# prompts, prompts generated per checkpointed shard, and scoring processes overlapping generation
+REDTEAM_SUITE = os.environ.get("AEGIS_REDTEAM_SUITE", "")
+REDTEAM_DIR = os.path.join(OUTPUTS_DIR, "redteam")  # one resumable checkpoint per suite x model x decoding
+REDTEAM_SHARD_SIZE = int(os.environ.get("AEGIS_REDTEAM_SHARD_SIZE", "64"))
+REDTEAM_SCORE_WORKERS = int(os.environ.get("AEGIS_REDTEAM_SCORE_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+
+FLEET_WORKERS = int(os.environ.get("AEGIS_FLEET_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+PRELOAD_LLM_IDS = [m.strip() for m in os.environ.get("AEGIS_PRELOAD_LLMS", "").split(",") if m.strip()]
+
 def ensure_base_dirs():
     os.makedirs(KB_DIR, exist_ok=True)
     os.makedirs(RUNS_DIR, exist_ok=True)
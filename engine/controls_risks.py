@@ -1,59 +1,216 @@
-import os, json
+import os, json, string, argparse, operator
+from datetime import datetime
+import numpy as np
 import pandas as pd
 
-def eval_controls(evidence_dir: str):
-    fair = json.load(open(os.path.join(evidence_dir, "fairness.json")))
-    di = float(fair["disparate_impact_selection_rate"])
+from .config import CONTROLS_CATALOG_PATH, OUTPUTS_DIR
 
-    drift = json.load(open(os.path.join(evidence_dir, "drift.json")))
-    dscore = float(drift["drift_score_mean_top10"])
+OPS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt, "==": operator.eq, "!=": operator.ne}
+CONTROL_COLUMNS = ["control_id", "status", "evidence", "notes"]
+RISK_COLUMNS = ["risk_id", "title", "domain", "impact", "likelihood", "score", "level", "controls", "recommendation"]
 
-    qm = json.load(open(os.path.join(evidence_dir, "rag_quality_metrics.json")))
-    cov = float(qm["citation_coverage"])
-    faith = float(qm["faithfulness_overlap"])
+def load_catalog(path: str = CONTROLS_CATALOG_PATH) -> dict:
+    """Control/risk catalog from JSON (or YAML when PyYAML is installed)."""
+    with open(path) as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
 
-    ctrl = []
-    ctrl.append(("F-01", "PASS" if di >= 0.8 else "FAIL", "fairness.json", f"DI(selection rate)={di:.3f} target>=0.8"))
-    ctrl.append(("O-02", "PASS" if dscore < 0.35 else "REVIEW", "drift.json", f"Drift score={dscore:.3f} target<0.35"))
-    ctrl.append(("E-01", "PASS", "shap_global_importance.csv", "SHAP global importance generated."))
-    ctrl.append(("E-04", "PASS" if cov >= 0.7 else "REVIEW", "rag_quality_metrics.json", f"Citation coverage={cov:.2f} target>=0.70"))
-    ctrl.append(("E-05", "PASS" if faith >= 0.12 else "REVIEW", "rag_quality_metrics.json", f"Faithfulness overlap={faith:.3f} heuristic>=0.12"))
+def _lookup(doc, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
 
-    df = pd.DataFrame(ctrl, columns=["control_id","status","evidence","notes"])
-    df.to_csv(os.path.join(evidence_dir, "control_results.csv"), index=False)
-    return df
+class ControlCatalog:
+    """
+    Compiled control catalog. Each control names an evidence metric, a comparator,
+    a threshold (overridable through its threshold_key), the status on failure and
+    an optional fallback rule used where the metric is missing; a control without a
+    metric is an attestation that always passes with its note. Risk rules fire when
+    any of their controls has one of the listed statuses.
+
+    Evaluation works on a metrics table (one row per run, one column per metric):
+    every rule is one vectorized comparison over all runs.
+    """
+
+    def __init__(self, catalog: dict):
+        self.catalog = catalog
+        self.metrics = catalog["metrics"]
+        self.controls = catalog["controls"]
+        self.risks = catalog.get("risks", [])
+        for c in self.controls:
+            for rule in (c, c.get("fallback")):
+                if not rule or "metric" not in rule:
+                    continue
+                if rule.get("op") not in OPS:
+                    raise ValueError(f"control {c['id']}: unknown comparator {rule['op']!r}")
+                if rule["metric"] not in self.metrics:
+                    raise ValueError(f"control {c['id']}: unknown metric {rule['metric']!r}")
+
+    @classmethod
+    def load(cls, path: str = CONTROLS_CATALOG_PATH) -> "ControlCatalog":
+        return cls(load_catalog(path))
+
+    def default_thresholds(self) -> dict:
+        out = {}
+        for c in self.controls:
+            for rule in (c, c.get("fallback")):
+                if rule and rule.get("threshold_key"):
+                    out[rule["threshold_key"]] = rule["threshold"]
+        return out
+
+    def extract(self, docs: dict) -> dict:
+        """Flat metrics of one run from its evidence documents."""
+        return {name: _lookup(docs, path) for name, path in self.metrics.items()}
+
+    def metrics_table(self, runs: dict) -> pd.DataFrame:
+        """run_id -> evidence documents  =>  one row per run."""
+        rows = {run_id: self.extract(docs) for run_id, docs in runs.items()}
+        return pd.DataFrame.from_dict(rows, orient="index", columns=list(self.metrics)).apply(pd.to_numeric, errors="coerce")
+
+    @staticmethod
+    def _threshold(rule, thresholds, index):
+        key = rule.get("threshold_key") or ""
+        if isinstance(thresholds, pd.DataFrame) and key in thresholds.columns:
+            return thresholds[key].reindex(index).fillna(rule["threshold"]).to_numpy(dtype=np.float64)
+        if isinstance(thresholds, dict) and key in thresholds:
+            return np.full(len(index), float(thresholds[key]))
+        return np.full(len(index), float(rule["threshold"]))
+
+    @staticmethod
+    def _notes(template, m: pd.DataFrame, value, threshold):
+        # only the columns the template references are zipped, so formatting stays cheap for many runs
+        fields = {f for _, f, _, _ in string.Formatter().parse(template) if f} - {"value", "threshold"}
+        cols = {f: m[f].to_numpy() for f in fields}
+        names = list(cols)
+        return [template.format_map({"value": v, "threshold": t, **dict(zip(names, row))})
+                for v, t, *row in zip(value, threshold, *cols.values())]
+
+    def evaluate(self, m: pd.DataFrame, thresholds=None) -> pd.DataFrame:
+        """
+        Control results for every run in m (index = run_id) in long form:
+        run_id, control_id, status, evidence, notes. thresholds is a dict of
+        threshold_key -> value, or a DataFrame of per-run overrides.
+        """
+        parts = []
+        for c in self.controls:
+            if "metric" not in c:
+                parts.append(pd.DataFrame({"run_id": m.index, "control_id": c["id"], "status": "PASS",
+                                           "evidence": c.get("evidence", ""), "notes": c.get("note", "")}))
+                continue
+            value = m[c["metric"]].to_numpy(dtype=np.float64)
+            thr = self._threshold(c, thresholds, m.index)
+            missing = np.isnan(value)
+            ok = OPS[c["op"]](value, thr)
+            notes = np.array(self._notes(c["note"], m, value, thr), dtype=object)
+
+            fb = c.get("fallback")
+            if fb is not None and missing.any():
+                fv = m[fb["metric"]].to_numpy(dtype=np.float64)
+                ft = self._threshold(fb, thresholds, m.index)
+                ok = np.where(missing, OPS[fb["op"]](fv, ft), ok)
+                notes = np.where(missing, np.array(self._notes(fb["note"], m, fv, ft), dtype=object), notes)
+                missing = missing & np.isnan(fv)
+
+            status = np.where(missing, "REVIEW", np.where(ok, "PASS", c.get("on_fail", "FAIL")))
+            notes = np.where(missing, f"{c['metric']} missing from evidence", notes)
+            parts.append(pd.DataFrame({"run_id": m.index, "control_id": c["id"], "status": status,
+                                       "evidence": c.get("evidence", ""), "notes": notes}))
+        if not parts:
+            return pd.DataFrame(columns=["run_id"] + CONTROL_COLUMNS)
+        return pd.concat(parts, ignore_index=True)
+
+    def risk_register(self, controls: pd.DataFrame) -> pd.DataFrame:
+        """Risks fired by long-form control results (any number of runs), sorted by score within each run."""
+        status = controls.pivot(index="run_id", columns="control_id", values="status")
+        parts = []
+        for r in self.risks:
+            cols = [c for c in r["controls"] if c in status.columns]
+            if not cols:
+                continue
+            fired = status[cols].isin(r.get("when", ["FAIL", "REVIEW"])).any(axis=1)
+            run_ids = status.index[fired.to_numpy()]
+            if len(run_ids) == 0:
+                continue
+            score = int(r["impact"] * r["likelihood"])
+            parts.append(pd.DataFrame({
+                "run_id": run_ids, "risk_id": r["id"], "title": r["title"], "domain": r["domain"],
+                "impact": r["impact"], "likelihood": r["likelihood"], "score": score, "level": risk_level(score),
+                "controls": ";".join(r["controls"]), "recommendation": r["recommendation"],
+            }))
+        if not parts:
+            return pd.DataFrame(columns=["run_id"] + RISK_COLUMNS)
+        df = pd.concat(parts, ignore_index=True)
+        return df.sort_values(["run_id", "score"], ascending=[True, False], kind="stable").reset_index(drop=True)
+
+_CATALOGS = {}
+
+def get_catalog(path: str = CONTROLS_CATALOG_PATH) -> ControlCatalog:
+    """Compiled catalog, reloaded when the file changes."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"controls catalog not found: {path} (set AEGIS_CONTROLS_CATALOG)")
+    mtime = os.path.getmtime(path)
+    hit = _CATALOGS.get(path)
+    if hit is None or hit[0] != mtime:
+        hit = _CATALOGS[path] = (mtime, ControlCatalog.load(path))
+    return hit[1]
+
+def eval_controls(bundle, thresholds: dict | None = None, catalog: ControlCatalog | None = None):
+    cat = catalog or get_catalog()
+    m = cat.metrics_table({"run": bundle.docs})
+    df = cat.evaluate(m, thresholds)[CONTROL_COLUMNS]
+    return bundle.put("controls", df.reset_index(drop=True))
 
 def risk_level(score: int) -> str:
     if score >= 21: return "HIGH"
     if score >= 11: return "MEDIUM"
     return "LOW"
 
-def build_risk_register(evidence_dir: str):
-    import pandas as pd
-    cr = pd.read_csv(os.path.join(evidence_dir, "control_results.csv"))
-    risks = []
-
-    def add(risk_id, title, domain, impact, likelihood, controls, recommendation):
-        score = int(impact * likelihood)
-        risks.append({
-            "risk_id": risk_id, "title": title, "domain": domain,
-            "impact": impact, "likelihood": likelihood, "score": score, "level": risk_level(score),
-            "controls": ";".join(controls),
-            "recommendation": recommendation
-        })
-
-    status = dict(zip(cr["control_id"], cr["status"]))
-
-    if status.get("F-01") in ["FAIL","REVIEW"]:
-        add("R-ML-01","Fairness risk: group disparity","Fairness",4,3,["F-01"],
-            "Mitigate bias (reweighting/threshold tuning), re-test, document business acceptance criteria.")
-
-    if status.get("E-04") in ["FAIL","REVIEW"]:
-        add("R-RAG-02","Explainability risk: insufficient citations","Explainability",3,3,["E-04"],
-            "Enforce citations per sentence or refuse policy answers without citations; re-evaluate coverage.")
-
-    df = pd.DataFrame(risks).sort_values("score", ascending=False) if risks else pd.DataFrame(columns=[
-        "risk_id","title","domain","impact","likelihood","score","level","controls","recommendation"
-    ])
-    df.to_csv(os.path.join(evidence_dir, "risk_register.csv"), index=False)
-    return df
+def build_risk_register(bundle, catalog: ControlCatalog | None = None):
+    cat = catalog or get_catalog()
+    cr = bundle.table("controls").assign(run_id="run")
+    df = cat.risk_register(cr)[RISK_COLUMNS].reset_index(drop=True)
+    return bundle.put("risks", df)
+
+def rescore_runs(thresholds=None, catalog: ControlCatalog | None = None, runs=None):
+    """
+    Re-applies the catalog to stored evidence of past runs without re-running
+    audits. runs maps run_id -> evidence_dir (default: every run in the run store).
+    Only bundle manifests are read. Returns (metrics, controls, risks) in long form.
+    """
+    from .evidence import load_evidence
+    from .run_store import list_evidence_dirs
+
+    cat = catalog or get_catalog()
+    runs = runs if runs is not None else dict(list_evidence_dirs())
+    docs = {}
+    for run_id, evidence_dir in runs.items():
+        if evidence_dir and os.path.isdir(evidence_dir):
+            docs[run_id] = load_evidence(evidence_dir).docs
+    m = cat.metrics_table(docs)
+    controls = cat.evaluate(m, thresholds)
+    return m, controls, cat.risk_register(controls)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Re-score stored runs against the control catalog.")
+    ap.add_argument("--catalog", default=CONTROLS_CATALOG_PATH)
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="threshold override, e.g. di_min=0.9")
+    ap.add_argument("--out", default=None, help="output directory (default: outputs/rescore-<timestamp>)")
+    args = ap.parse_args(argv)
+
+    thresholds = {k: float(v) for k, v in (s.split("=", 1) for s in args.set)}
+    m, controls, risks = rescore_runs(thresholds, ControlCatalog.load(args.catalog))
+    out = args.out or os.path.join(OUTPUTS_DIR, f"rescore-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}")
+    os.makedirs(out, exist_ok=True)
+    m.rename_axis("run_id").to_csv(os.path.join(out, "metrics.csv"))
+    controls.to_csv(os.path.join(out, "control_results.csv"), index=False)
+    risks.to_csv(os.path.join(out, "risk_register.csv"), index=False)
+    summary = controls.pivot(index="run_id", columns="control_id", values="status")
+    summary.to_csv(os.path.join(out, "control_matrix.csv"))
+    print(json.dumps({"runs": len(m), "out": out, "status_counts": controls["status"].value_counts().to_dict()}, indent=2))
+
+if __name__ == "__main__":
+    main()
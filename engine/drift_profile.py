@@ -0,0 +1,203 @@
+import os, json, hashlib
+import numpy as np
+import pandas as pd
+
+from .config import DRIFT_PROFILE_DIR, EVIDENCE_EXPORT_FILES
+from .evidence import load_evidence
+
+PROFILE_NAME = "drift_reference_profile.json"
+PROFILE_VERSION = 2  # 2: numeric columns carry their mean
+N_BINS = 10
+N_QUANTILES = 100
+TOP_LEVELS = 50
+OTHER = "__other__"
+EPS = 1e-6
+
+def build_reference_profile(X: pd.DataFrame, num_cols, cat_cols, bins: int = N_BINS, quantiles: int = N_QUANTILES):
+    """
+    Compact reference profile of the training data:
+      numeric -> quantile sketch, reference CDF at the sketch points, binned histogram, mean
+      categorical -> frequency table of the top levels (rest folded into __other__)
+    """
+    prof = {"version": PROFILE_VERSION, "n_rows": int(len(X)), "numeric": {}, "categorical": {}}
+    for c in num_cols:
+        v = pd.to_numeric(X[c], errors="coerce").to_numpy(dtype=np.float64)
+        ok = v[~np.isnan(v)]
+        if len(ok) == 0:
+            continue
+        q = np.unique(np.quantile(ok, np.linspace(0, 1, quantiles + 1)[1:-1]))
+        edges = np.unique(np.quantile(ok, np.linspace(0, 1, bins + 1)[1:-1]))
+        ok.sort()
+        cdf = np.searchsorted(ok, q, side="right") / len(ok)
+        hist = np.bincount(np.searchsorted(edges, ok, side="right"), minlength=len(edges) + 1)
+        prof["numeric"][c] = {
+            "quantiles": q.tolist(),
+            "cdf": cdf.tolist(),
+            "edges": edges.tolist(),
+            "hist": (hist / hist.sum()).tolist(),
+            "missing_rate": float(1 - len(ok) / max(1, len(v))),
+            "mean": float(ok.mean()),
+        }
+    for c in cat_cols:
+        vc = X[c].astype(str).value_counts(normalize=True)
+        top = vc.head(TOP_LEVELS)
+        prof["categorical"][c] = {"levels": top.index.tolist() + [OTHER], "freq": top.tolist() + [float(max(0.0, 1 - top.sum()))]}
+    return prof
+
+def save_profile(path: str, prof: dict):
+    with open(path, "w") as f:
+        json.dump(prof, f)
+
+def load_profile(path: str):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def dataset_fingerprint(path: str, probe_bytes: int = 1 << 20) -> str:
+    """Path, size, mtime and the first/last MiB of the file: cheap even for multi-GB inputs."""
+    st = os.stat(path)
+    h = hashlib.sha256(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8"))
+    with open(path, "rb") as f:
+        h.update(f.read(probe_bytes))
+        if st.st_size > probe_bytes:
+            f.seek(max(probe_bytes, st.st_size - probe_bytes))
+            h.update(f.read(probe_bytes))
+    return h.hexdigest()
+
+def reference_profile(key: dict, build, root: str = DRIFT_PROFILE_DIR):
+    """
+    The reference profile for key (dataset fingerprint, columns, split settings),
+    built once with build() and reused from root afterwards. Returns (profile, reused).
+    """
+    name = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(root, f"{name}.json")
+    try:
+        return load_profile(path), True
+    except (OSError, ValueError):
+        pass
+    prof = build()
+    os.makedirs(root, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    save_profile(tmp, prof)
+    os.replace(tmp, path)
+    return prof, False
+
+def psi(expected, actual):
+    e, a = np.maximum(expected, EPS), np.maximum(actual, EPS)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+def js_distance(p, q):
+    p, q = np.maximum(p, EPS), np.maximum(q, EPS)
+    p, q = p / p.sum(), q / q.sum()
+    m = 0.5 * (p + q)
+    jsd = 0.5 * np.sum(p * np.log2(p / m)) + 0.5 * np.sum(q * np.log2(q / m))
+    return float(np.sqrt(max(jsd, 0.0)))
+
+class DriftAccumulator:
+    """
+    Scores batches against a reference profile. Only bin counts, counts at the
+    sketch points and sums are kept, so batches can be added chunk by chunk and
+    the training data is never needed again. KS is evaluated at the sketch points
+    only, so it can understate the exact statistic by up to the reference mass
+    between neighbouring sketch points (about 1 / N_QUANTILES).
+    """
+
+    def __init__(self, prof: dict):
+        self.prof = prof
+        self.hist = {c: np.zeros(len(p["hist"])) for c, p in prof["numeric"].items()}
+        self.le_q = {c: np.zeros(len(p["quantiles"])) for c, p in prof["numeric"].items()}
+        self.n_num = {c: 0 for c in prof["numeric"]}
+        self.sum = {c: 0.0 for c in prof["numeric"]}
+        self.cat = {c: np.zeros(len(p["levels"])) for c, p in prof["categorical"].items()}
+        self._cat_index = {c: {lv: i for i, lv in enumerate(p["levels"])} for c, p in prof["categorical"].items()}
+
+    def add(self, X: pd.DataFrame):
+        for c, p in self.prof["numeric"].items():
+            if c not in X.columns:
+                continue
+            v = pd.to_numeric(X[c], errors="coerce").to_numpy(dtype=np.float64)
+            v = np.sort(v[~np.isnan(v)])
+            if len(v) == 0:
+                continue
+            self.hist[c] += np.diff(np.searchsorted(v, p["edges"], side="left"), prepend=0, append=len(v))
+            self.le_q[c] += np.searchsorted(v, p["quantiles"], side="right")
+            self.n_num[c] += len(v)
+            self.sum[c] += float(v.sum())
+        for c, idx in self._cat_index.items():
+            if c not in X.columns:
+                continue
+            codes = X[c].astype(str).map(idx).fillna(len(idx) - 1).to_numpy(dtype=np.int64)
+            self.cat[c] += np.bincount(codes, minlength=len(idx))
+
+    def scores(self) -> dict:
+        out = {}
+        for c, p in self.prof["numeric"].items():
+            n = self.n_num[c]
+            if n == 0:
+                continue
+            act = self.hist[c] / n
+            ks = float(np.max(np.abs(self.le_q[c] / n - np.asarray(p["cdf"])))) if len(p["cdf"]) else 0.0
+            out[c] = {"type": "numeric", "psi": psi(np.asarray(p["hist"]), act), "ks": ks, "js": js_distance(np.asarray(p["hist"]), act)}
+            if "mean" in p:  # profiles before version 2 have no mean
+                out[c]["mean_shift"] = abs(self.sum[c] / n - p["mean"]) / (abs(p["mean"]) + 1e-6)
+        for c, p in self.prof["categorical"].items():
+            tot = self.cat[c].sum()
+            if tot == 0:
+                continue
+            act = self.cat[c] / tot
+            exp = np.asarray(p["freq"])
+            out[c] = {"type": "categorical", "psi": psi(exp, act), "ks": None, "js": js_distance(exp, act)}
+        return out
+
+def summarize(col_scores: dict) -> dict:
+    """
+    drift.json fields derived from per-column scores. drift_score_mean_top10 (mean
+    relative mean shift of the ten most shifted numeric columns) and its "top"
+    columns are included when the profile has column means.
+    """
+    if not col_scores:
+        return {"psi_max": 0.0, "ks_max": 0.0, "js_max": 0.0, "top_psi": {}, "columns": {}}
+    psis = pd.Series({c: s["psi"] for c, s in col_scores.items()}).sort_values(ascending=False)
+    ks = [s["ks"] for s in col_scores.values() if s["ks"] is not None]
+    out = {
+        "psi_max": float(psis.iloc[0]),
+        "ks_max": float(max(ks)) if ks else 0.0,
+        "js_max": float(max(s["js"] for s in col_scores.values())),
+        "top_psi": psis.head(10).to_dict(),
+        "columns": col_scores,
+    }
+    shifts = pd.Series({c: s["mean_shift"] for c, s in col_scores.items() if "mean_shift" in s}, dtype=np.float64)
+    if len(shifts):
+        top10 = shifts.sort_values(ascending=False).head(10)
+        out.update({"drift_score_mean_top10": float(top10.mean()), "top": top10.to_dict()})
+    return out
+
+def score_batch(prof: dict, X: pd.DataFrame) -> dict:
+    acc = DriftAccumulator(prof)
+    acc.add(X)
+    return summarize(acc.scores())
+
+def check_drift(evidence_dir: str, batch: pd.DataFrame | str, profile_path: str | None = None, chunksize: int = 200_000,
+                bundle=None):
+    """
+    Scores a fresh batch (DataFrame or CSV path) against a persisted profile and
+    stores the result as the "drift" document of the run's evidence bundle, with
+    the fields the controls read. A passed bundle is only updated; otherwise the
+    run's bundle is loaded and saved again (drift.json is exported as well when
+    AEGIS_EVIDENCE_EXPORT_FILES is on).
+    """
+    prof = load_profile(profile_path or os.path.join(evidence_dir, PROFILE_NAME))
+    acc = DriftAccumulator(prof)
+    if isinstance(batch, str):
+        for chunk in pd.read_csv(batch, chunksize=chunksize):
+            acc.add(chunk)
+    else:
+        acc.add(batch)
+    out = {"method": "reference_profile", **summarize(acc.scores())}
+    if bundle is not None:
+        return bundle.put("drift", out)
+    bundle = load_evidence(evidence_dir)
+    bundle.put("drift", out)
+    bundle.save(bundle.run_id)
+    if EVIDENCE_EXPORT_FILES:
+        bundle.export(names=["drift"])
+    return out
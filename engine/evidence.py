@@ -0,0 +1,213 @@
+import os, json, argparse, threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from .config import EVIDENCE_MMAP_MIN_ROWS
+
+BUNDLE_DIR = "evidence_bundle"
+MANIFEST = "manifest.json"
+
+# per-file layout of earlier releases; export() writes it for auditors, from_files() reads old runs
+FILES = {
+    "ml_metrics": "ml_metrics.json",
+    "fairness": "fairness.json",
+    "drift": "drift.json",
+    "fairness_mitigation": "fairness_mitigation.json",
+    "rag_quality": "rag_quality_metrics.json",
+    "eval_scores": "ml_eval_scores.csv",
+    "shap_global": "shap_global_importance.csv",
+    "shap_group": "shap_group_importance.csv",
+    "redteam": "redteam_results_llm.csv",
+    "controls": "control_results.csv",
+    "risks": "risk_register.csv",
+}
+
+class EvidenceBundle:
+    """
+    Evidence of one run, passed between stages in memory: JSON-able docs
+    (metrics, fairness, drift, ...) and DataFrame tables (eval scores, SHAP,
+    red-team results, controls, risks).
+
+    save() persists it once as <evidence_dir>/evidence_bundle: a manifest.json
+    holding the docs plus one Arrow IPC file per table. Tables with at least
+    EVIDENCE_MMAP_MIN_ROWS rows are stored uncompressed so table() memory-maps
+    them instead of reading them; smaller ones are zstd-compressed.
+    """
+
+    def __init__(self, evidence_dir: str | None = None):
+        self.evidence_dir = evidence_dir
+        self.run_id = None  # from the manifest of an opened bundle
+        self.docs = {}
+        self.tables = {}  # name -> DataFrame held in memory
+        self.files = {}  # name -> Arrow file already on disk (read lazily)
+        self._writers = {}  # name -> (sink, writer, schema) for append()
+        self._lock = threading.RLock()  # workflow steps in threads put/update concurrently
+
+    @property
+    def bundle_dir(self) -> str:
+        return os.path.join(self.evidence_dir, BUNDLE_DIR)
+
+    def __contains__(self, name):
+        return name in self.docs or name in self.tables or name in self.files
+
+    def __getstate__(self):
+        # bundles come back from process-pool stages; open writers cannot be pickled
+        self.flush()
+        return {k: v for k, v in self.__dict__.items() if k not in ("_writers", "_lock")}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._writers = {}
+        self._lock = threading.RLock()
+
+    def put(self, name: str, obj):
+        with self._lock:
+            if isinstance(obj, pd.DataFrame):
+                self.tables[name] = obj
+                self.files.pop(name, None)
+            else:
+                self.docs[name] = obj
+        return obj
+
+    def get(self, name: str, default=None):
+        return self.docs.get(name, default)
+
+    def update(self, other: "EvidenceBundle"):
+        other.flush()
+        with self._lock:
+            self.docs.update(other.docs)
+            for name, df in other.tables.items():
+                self.put(name, df)
+            for name, path in other.files.items():
+                self.tables.pop(name, None)
+                self.files[name] = path
+        return self
+
+    def table(self, name: str, columns=None) -> pd.DataFrame:
+        if name in self.tables:
+            df = self.tables[name]
+            return df[columns] if columns else df
+        if name not in self.files:
+            raise KeyError(f"evidence table '{name}' not in bundle")
+        with pa.memory_map(self.files[name]) as src:
+            t = ipc.open_file(src).read_all()
+        if columns:
+            t = t.select(columns)
+        return t.to_pandas()
+
+    def append(self, name: str, df: pd.DataFrame):
+        """Streams a table to disk batch by batch (chunked audits); the table is never held in memory."""
+        with self._lock:
+            if name not in self._writers:
+                os.makedirs(self.bundle_dir, exist_ok=True)
+                path = os.path.join(self.bundle_dir, f"{name}.arrow")
+                sink = pa.OSFile(path, "wb")
+                batch = pa.RecordBatch.from_pandas(df, preserve_index=False)
+                self._writers[name] = (sink, ipc.new_file(sink, batch.schema), batch.schema)
+                self.tables.pop(name, None)
+                self.files[name] = path
+            else:
+                # later chunks are cast to the first chunk's schema (e.g. an all-null column stays typed)
+                batch = pa.RecordBatch.from_pandas(df, preserve_index=False, schema=self._writers[name][2])
+            self._writers[name][1].write_batch(batch)
+
+    def flush(self):
+        with self._lock:
+            for sink, writer, _ in self._writers.values():
+                writer.close()
+                sink.close()
+            self._writers = {}
+
+    def _write_table(self, name: str, df: pd.DataFrame) -> str:
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        path = os.path.join(self.bundle_dir, f"{name}.arrow")
+        t = pa.Table.from_pandas(df, preserve_index=False)
+        opts = ipc.IpcWriteOptions(compression=None if len(df) >= EVIDENCE_MMAP_MIN_ROWS else "zstd")
+        with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, t.schema, options=opts) as writer:
+            writer.write_table(t)
+        return path
+
+    def spill(self, min_rows: int = EVIDENCE_MMAP_MIN_ROWS):
+        """Moves large in-memory tables to disk (e.g. before returning from a worker process)."""
+        for name, df in list(self.tables.items()):
+            if len(df) >= min_rows:
+                self.files[name] = self._write_table(name, df)
+                del self.tables[name]
+        return self
+
+    def save(self, run_id: str | None = None) -> str:
+        """Writes every table and the manifest; returns the manifest path."""
+        self.flush()
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        for name, df in self.tables.items():
+            self.files[name] = self._write_table(name, df)
+        tables = {}
+        for name, path in self.files.items():
+            with pa.memory_map(path) as src:
+                r = ipc.open_file(src)
+                tables[name] = {"file": os.path.basename(path), "rows": sum(r.get_batch(i).num_rows for i in range(r.num_record_batches)),
+                                "columns": r.schema.names}
+        manifest = {"version": 1, "run_id": run_id, "docs": self.docs, "tables": tables}
+        path = os.path.join(self.bundle_dir, MANIFEST)
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        return path
+
+    @classmethod
+    def open(cls, evidence_dir: str) -> "EvidenceBundle":
+        """Loads the manifest only; tables are memory-mapped when first read."""
+        b = cls(evidence_dir)
+        with open(os.path.join(b.bundle_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+        b.run_id, b.docs = manifest.get("run_id"), manifest["docs"]
+        b.files = {name: os.path.join(b.bundle_dir, t["file"]) for name, t in manifest["tables"].items()}
+        return b
+
+    @classmethod
+    def from_files(cls, evidence_dir: str) -> "EvidenceBundle":
+        """Bundle view of a run written with the per-file layout."""
+        b = cls(evidence_dir)
+        for name, fn in FILES.items():
+            path = os.path.join(evidence_dir, fn)
+            if not os.path.exists(path):
+                continue
+            if fn.endswith(".json"):
+                with open(path) as f:
+                    b.docs[name] = json.load(f)
+            else:
+                b.tables[name] = pd.read_csv(path)
+        return b
+
+    def export(self, out_dir: str | None = None, names=None) -> list:
+        """Writes the per-file CSV/JSON layout (all known names by default); returns the written paths."""
+        out_dir = out_dir or self.evidence_dir
+        os.makedirs(out_dir, exist_ok=True)
+        written = []
+        for name in names or FILES:
+            if name not in self:
+                continue
+            path = os.path.join(out_dir, FILES.get(name, f"{name}.json" if name in self.docs else f"{name}.csv"))
+            if name in self.docs:
+                with open(path, "w") as f:
+                    json.dump(self.docs[name], f, indent=2, default=str)
+            else:
+                self.table(name).to_csv(path, index=False)
+            written.append(path)
+        return written
+
+def load_evidence(evidence_dir: str) -> EvidenceBundle:
+    if os.path.exists(os.path.join(evidence_dir, BUNDLE_DIR, MANIFEST)):
+        return EvidenceBundle.open(evidence_dir)
+    return EvidenceBundle.from_files(evidence_dir)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export a run's evidence bundle as CSV/JSON files.")
+    ap.add_argument("evidence_dir")
+    ap.add_argument("--out", default=None, help="output directory (default: the evidence dir)")
+    args = ap.parse_args(argv)
+    for path in load_evidence(args.evidence_dir).export(args.out):
+        print(path)
+
+if __name__ == "__main__":
+    main()
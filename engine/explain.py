@@ -0,0 +1,141 @@
+import weakref
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+BLOCK_ROWS = 65536  # rows per vectorized block; bounds the |phi| temporary, not the rows explained
+FALLBACK_EXPLAIN_ROWS = 200
+FALLBACK_BACKGROUND_ROWS = 100
+
+_EXPLAINERS = weakref.WeakKeyDictionary()  # fitted pipeline -> explainer
+
+def feature_names(pre) -> list:
+    """Output feature names of a fitted ColumnTransformer, without the transformer prefix (city_NY, not cat__city_NY)."""
+    return [n.split("__", 1)[1] if "__" in n else n for n in pre.get_feature_names_out()]
+
+def _dense(Xt) -> np.ndarray:
+    return np.asarray(Xt.toarray() if hasattr(Xt, "toarray") else Xt, dtype=np.float64)
+
+def _group_sum(codes: np.ndarray, n_groups: int, a) -> np.ndarray:
+    G = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))), shape=(n_groups, len(codes)))
+    out = G @ a
+    return out.toarray() if sparse.issparse(out) else np.asarray(out)
+
+class LinearShap:
+    """
+    Exact interventional SHAP for a linear model on the preprocessed features:
+    phi_ij = coef_j * (x_ij - E_bg[x_j]), base value = logit at the background mean.
+    Works on the whole test set in blocks; no sampling, no refitting of the preprocessor,
+    and CSR design matrices are never densified.
+    """
+
+    method = "linear_exact"
+
+    def __init__(self, model, X_background: pd.DataFrame):
+        self.pre, clf = model.named_steps["pre"], model.named_steps["clf"]
+        self.coef = np.asarray(clf.coef_, dtype=np.float64)[0]
+        self.names = feature_names(self.pre)
+        self.mu = np.zeros(len(self.coef))
+        n = 0
+        for i in range(0, len(X_background), BLOCK_ROWS):
+            Xt = self.pre.transform(X_background.iloc[i:i + BLOCK_ROWS])
+            self.mu += np.asarray(Xt.sum(axis=0), dtype=np.float64).ravel()
+            n += Xt.shape[0]
+        self.mu /= max(n, 1)
+        self.base_value = float(np.asarray(clf.intercept_)[0] + self.mu @ self.coef)
+
+    def values(self, X: pd.DataFrame) -> np.ndarray:
+        """Per-row attributions (rows x features); prefer abs_sums for large X."""
+        return (_dense(self.pre.transform(X)) - self.mu) * self.coef
+
+    def abs_sums(self, X: pd.DataFrame, codes: np.ndarray, n_groups: int):
+        """(sum of |phi| per group x feature, rows per group); codes are group ids in [0, n_groups)."""
+        out = np.zeros((n_groups, len(self.coef)))
+        counts = np.bincount(codes, minlength=n_groups)
+        abs_mu = np.abs(self.mu)
+        for i in range(0, len(X), BLOCK_ROWS):
+            Xt, c = self.pre.transform(X.iloc[i:i + BLOCK_ROWS]), codes[i:i + BLOCK_ROWS]
+            if sparse.issparse(Xt):
+                # never densify: zeros contribute |mu_j|, stored entries |x_ij - mu_j|
+                Xt = sparse.csr_matrix(Xt)
+                dev, nz = Xt.copy(), Xt.copy()
+                dev.data = np.abs(Xt.data - self.mu[Xt.indices])
+                nz.data = np.ones_like(Xt.data)
+                n_g = np.bincount(c, minlength=n_groups)[:, None]
+                out += _group_sum(c, n_groups, dev) + (n_g - _group_sum(c, n_groups, nz)) * abs_mu
+            else:
+                out += _group_sum(c, n_groups, np.abs(_dense(Xt) - self.mu))
+        return out * np.abs(self.coef), counts
+
+class KernelShapFallback:
+    """shap.Explainer on a sample, for pipelines whose classifier has no linear coef_."""
+
+    method = "shap_sampled"
+
+    def __init__(self, model, X_background: pd.DataFrame):
+        import shap  # optional: only needed for non-linear models
+
+        self.pre, clf = model.named_steps["pre"], model.named_steps["clf"]
+        self.names = feature_names(self.pre)
+        bg = _dense(self.pre.transform(X_background.sample(min(FALLBACK_BACKGROUND_ROWS, len(X_background)), random_state=42)))
+        self.explainer = shap.Explainer(lambda Z: clf.predict_proba(Z)[:, 1], shap.maskers.Independent(bg))
+        self.base_value = None
+
+    def abs_sums(self, X: pd.DataFrame, codes: np.ndarray, n_groups: int):
+        idx = np.sort(np.random.default_rng(42).permutation(len(X))[:FALLBACK_EXPLAIN_ROWS])
+        sv = np.abs(self.explainer(_dense(self.pre.transform(X.iloc[idx]))).values)
+        return _group_sum(codes[idx], n_groups, sv), np.bincount(codes[idx], minlength=n_groups)
+
+def get_explainer(model, X_background: pd.DataFrame):
+    """One explainer per fitted pipeline (cached); exact for linear classifiers, sampled shap otherwise."""
+    exp = _EXPLAINERS.get(model)
+    if exp is None:
+        clf = model.named_steps["clf"]
+        coef = getattr(clf, "coef_", None)
+        exp = LinearShap(model, X_background) if coef is not None and np.asarray(coef).shape[0] == 1 else KernelShapFallback(model, X_background)
+        _EXPLAINERS[model] = exp
+    return exp
+
+class ShapAccumulator:
+    """Mean |SHAP| overall and per sensitive group, accumulated over chunks of the explained rows."""
+
+    def __init__(self, explainer):
+        self.explainer = explainer
+        self.levels = {}  # group label -> code
+        self.sums = np.zeros((0, len(explainer.names)))
+        self.counts = np.zeros(0)
+
+    def add(self, X: pd.DataFrame, s):
+        local, uniq = pd.factorize(pd.Series(np.asarray(s)), use_na_sentinel=False)
+        glob = np.array([self.levels.setdefault(u, len(self.levels)) for u in uniq], dtype=np.int64)
+        codes = glob[local] if len(glob) else np.zeros(len(X), dtype=np.int64)
+        k = len(self.levels)
+        if k > len(self.counts):
+            self.sums = np.vstack([self.sums, np.zeros((k - len(self.counts), self.sums.shape[1]))])
+            self.counts = np.concatenate([self.counts, np.zeros(k - len(self.counts))])
+        sums, counts = self.explainer.abs_sums(X.reset_index(drop=True), codes, k)
+        self.sums += sums
+        self.counts += counts
+
+    def global_importance(self) -> pd.Series:
+        return pd.Series(self.sums.sum(axis=0) / max(self.counts.sum(), 1), index=self.explainer.names).sort_values(ascending=False)
+
+    def group_importance(self) -> pd.DataFrame:
+        labels = sorted(self.levels, key=self.levels.get)
+        df = pd.DataFrame((self.sums / np.maximum(self.counts, 1)[:, None]).T, index=self.explainer.names,
+                          columns=[f"group={g}" for g in labels])
+        return df.loc[self.global_importance().index]
+
+    def info(self) -> dict:
+        return {"method": self.explainer.method, "rows_explained": int(self.counts.sum()), "features": len(self.explainer.names)}
+
+    def put(self, bundle) -> dict:
+        """Adds shap_global and shap_group (mean |SHAP| per sensitive group) tables to an EvidenceBundle."""
+        bundle.put("shap_global", self.global_importance().rename("mean_abs_shap").rename_axis("feature").reset_index())
+        bundle.put("shap_group", self.group_importance().rename_axis("feature").reset_index())
+        return self.info()
+
+def explain_model(bundle, model, X_background: pd.DataFrame, X_explain: pd.DataFrame, s) -> dict:
+    acc = ShapAccumulator(get_explainer(model, X_background))
+    acc.add(X_explain, s)
+    return acc.put(bundle)
@@ -0,0 +1,151 @@
+from itertools import combinations
+import numpy as np
+import pandas as pd
+
+from .config import FAIRNESS_MIN_GROUP_SIZE, FAIRNESS_MAX_ORDER, FAIRNESS_CONTINUOUS_BINS
+
+RADIX_BITS = 20  # per-attribute level codes are packed into one int64 key (up to 3 attributes)
+MAX_PACKED = 3
+
+def fit_bins(df: pd.DataFrame, cols, n_bins: int = FAIRNESS_CONTINUOUS_BINS):
+    """Quantile edges for continuous sensitive columns (numeric with > 10 levels)."""
+    edges = {}
+    for c in cols:
+        if pd.api.types.is_numeric_dtype(df[c]) and df[c].nunique() > 10:
+            q = np.unique(np.nanquantile(df[c].to_numpy(dtype=np.float64), np.linspace(0, 1, n_bins + 1)[1:-1]))
+            edges[c] = q.tolist()
+    return edges
+
+def _bin_labels(edges):
+    bounds = ["-inf"] + [f"{e:.4g}" for e in edges] + ["inf"]
+    return [f"[{bounds[i]}, {bounds[i + 1]})" for i in range(len(bounds) - 1)]
+
+class FairnessAccumulator:
+    """
+    Per-group confusion counts for many sensitive attributes and their
+    intersections, accumulated chunk by chunk.
+
+    Each attribute's levels get stable integer codes; intersections pack the
+    codes of their attributes into one int64 key, and every (group, cell)
+    count comes from a single np.bincount per attribute set.
+    """
+
+    def __init__(self, attrs, edges=None, max_order: int = FAIRNESS_MAX_ORDER, min_group_size: int = FAIRNESS_MIN_GROUP_SIZE):
+        self.attrs = list(attrs)
+        self.edges = edges or {}
+        self.min_group_size = min_group_size
+        order = max(1, min(max_order, MAX_PACKED, len(self.attrs)))
+        self.sets = [combo for k in range(1, order + 1) for combo in combinations(range(len(self.attrs)), k)]
+        self.levels = [dict() for _ in self.attrs]  # label -> code
+        self.counts = {combo: {} for combo in self.sets}  # packed key -> [tp, fp, tn, fn]
+
+    def _codes(self, i, col: pd.Series) -> np.ndarray:
+        c = self.attrs[i]
+        if c in self.edges:
+            labels = _bin_labels(self.edges[c])
+            v = pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64)
+            b = np.searchsorted(np.asarray(self.edges[c]), v, side="right")
+            col = pd.Series(np.where(np.isnan(v), "missing", np.asarray(labels, dtype=object)[np.minimum(b, len(labels) - 1)]))
+        local, uniq = pd.factorize(col, use_na_sentinel=False)
+        lv = self.levels[i]
+        glob = np.array([lv.setdefault("missing" if pd.isna(u) else str(u), len(lv)) for u in uniq], dtype=np.int64)
+        if len(lv) >= (1 << RADIX_BITS):
+            raise ValueError(f"sensitive column '{c}' has too many levels for intersectional grouping")
+        return glob[local] if len(glob) else np.zeros(len(col), dtype=np.int64)
+
+    def add(self, y_true, y_pred, groups: pd.DataFrame):
+        y_true, y_pred = np.asarray(y_true).astype(int), np.asarray(y_pred).astype(int)
+        cell = np.where(y_pred == 1, np.where(y_true == 1, 0, 1), np.where(y_true == 0, 2, 3))
+        codes = [self._codes(i, groups[c].reset_index(drop=True)) for i, c in enumerate(self.attrs)]
+        for combo in self.sets:
+            key = np.zeros(len(cell), dtype=np.int64)
+            for i in combo:
+                key = (key << RADIX_BITS) | codes[i]
+            uniq, inv = np.unique(key, return_inverse=True)
+            cnt = np.bincount(inv * 4 + cell, minlength=len(uniq) * 4).reshape(len(uniq), 4)
+            store = self.counts[combo]
+            for k, c in zip(uniq.tolist(), cnt):
+                store[k] = store.get(k, 0) + c
+
+    def _labels(self, combo, keys):
+        inv = {i: {v: k for k, v in self.levels[i].items()} for i in combo}
+        mask = (1 << RADIX_BITS) - 1
+        out = []
+        for key in keys:
+            parts = []
+            for i in reversed(combo):  # last attribute sits in the low bits
+                parts.append(f"{self.attrs[i]}={inv[i][key & mask]}")
+                key >>= RADIX_BITS
+            out.append(" & ".join(reversed(parts)))
+        return out
+
+    def _report(self, combo) -> dict:
+        store = self.counts[combo]
+        if not store:
+            return {"groups": {}, "di": None, "n_groups": 0, "n_suppressed": 0}
+        keys = list(store.keys())
+        m = np.array([store[k] for k in keys], dtype=np.float64)
+        tp, fp, tn, fn = m[:, 0], m[:, 1], m[:, 2], m[:, 3]
+        n = m.sum(axis=1)
+        sr = (tp + fp) / np.maximum(n, 1)
+        keep = n >= self.min_group_size
+        hi = sr[keep].max() if keep.any() else 0.0
+
+        groups = {}
+        for j, label in enumerate(self._labels(combo, keys)):
+            g = {"n": int(n[j]), "suppressed": bool(not keep[j])}
+            if keep[j]:
+                g.update({
+                    "selection_rate": float(sr[j]),
+                    "tpr": float(tp[j] / (tp[j] + fn[j])) if (tp[j] + fn[j]) else 0.0,
+                    "fpr": float(fp[j] / (fp[j] + tn[j])) if (fp[j] + tn[j]) else 0.0,
+                    "accuracy": float((tp[j] + tn[j]) / max(n[j], 1)),
+                    "di_vs_max": float(sr[j] / hi) if hi > 0 else 0.0,
+                })
+            groups[label] = g
+        di = None
+        if keep.sum() >= 2:
+            di = float(sr[keep].min() / hi) if hi > 0 else 0.0
+        return {"groups": groups, "di": di, "n_groups": int(keep.sum()), "n_suppressed": int((~keep).sum())}
+
+    def report(self) -> dict:
+        attributes, intersections = {}, {}
+        for combo in self.sets:
+            name = " & ".join(self.attrs[i] for i in combo)
+            (attributes if len(combo) == 1 else intersections)[name] = self._report(combo)
+        dis = [r["di"] for r in list(attributes.values()) + list(intersections.values()) if r["di"] is not None]
+        return {
+            "attributes": attributes,
+            "intersections": intersections,
+            "min_group_size": self.min_group_size,
+            "worst_di": float(min(dis)) if dis else None,
+        }
+
+def group_metrics(y_true, y_pred, s):
+    """Single-attribute by-group metrics ({metric: {group: value}}) and DI, from one bincount."""
+    y_true, y_pred = np.asarray(y_true).astype(int), np.asarray(y_pred).astype(int)
+    codes, inv = np.unique(np.asarray(s), return_inverse=True)
+    cell = np.where(y_pred == 1, np.where(y_true == 1, 0, 1), np.where(y_true == 0, 2, 3))
+    m = np.bincount(inv * 4 + cell, minlength=len(codes) * 4).reshape(len(codes), 4).astype(np.float64)
+    tp, fp, tn, fn = m[:, 0], m[:, 1], m[:, 2], m[:, 3]
+    n = np.maximum(m.sum(axis=1), 1)
+    sr = (tp + fp) / n
+    by = {
+        "accuracy": (tp + tn) / n,
+        "selection_rate": sr,
+        "tpr": np.divide(tp, tp + fn, out=np.zeros_like(tp), where=(tp + fn) > 0),
+        "fpr": np.divide(fp, fp + tn, out=np.zeros_like(fp), where=(fp + tn) > 0),
+    }
+    keys = codes.tolist()
+    by = {k: {g: float(v) for g, v in zip(keys, arr)} for k, arr in by.items()}
+    di = float(sr.min() / sr.max()) if len(sr) and float(sr.max()) > 0 else 0.0
+    return by, di
+
+def fairness_report(y_true, y_pred, groups: pd.DataFrame, attrs=None, max_order: int = FAIRNESS_MAX_ORDER,
+                    min_group_size: int = FAIRNESS_MIN_GROUP_SIZE, edges=None) -> dict:
+    """One-shot fairness metrics for every attribute in groups and their intersections up to max_order."""
+    attrs = list(attrs or groups.columns)
+    edges = fit_bins(groups, attrs) if edges is None else edges
+    acc = FairnessAccumulator(attrs, edges=edges, max_order=max_order, min_group_size=min_group_size)
+    acc.add(y_true, y_pred, groups)
+    return acc.report()
@@ -0,0 +1,253 @@
+import os, json, argparse, traceback, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import pandas as pd
+
+from .ml_audit_agent import run_ml_audit_to_bundle
+from .remediation_agent import run_fairness_remediation
+from .controls_risks import eval_controls, build_risk_register, get_catalog
+from .report_writer import write_audit_pack, write_fleet_pack
+from .run_paths import get_run_dirs, new_run_id
+from .utils import now_utc
+from .run_store import upsert_runs
+from .evidence import EvidenceBundle
+from .config import DEFAULT_LLM_ID, FLEETS_DIR, FLEET_WORKERS, EVIDENCE_EXPORT_FILES
+
+def _slug(text: str) -> str:
+    keep = "".join(ch if ch.isalnum() or ch in "-_" else "-" for ch in str(text))
+    return keep.strip("-")[:40] or "model"
+
+def load_manifest(path: str):
+    """
+    CSV or JSON/JSONL manifest, one model per row:
+      dataset_path, target_col, sensitive_col, [model], [sensitive_cols],
+      thresholds (dict in JSON; in CSV any threshold_key of the controls catalog as a column)
+    """
+    if path.lower().endswith(".csv"):
+        rows = pd.read_csv(path).to_dict(orient="records")
+    elif path.lower().endswith(".jsonl"):
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path) as f:
+            rows = json.load(f)
+
+    keys = get_catalog().default_thresholds()
+    specs = []
+    for i, r in enumerate(rows):
+        r = {k: v for k, v in r.items() if not (isinstance(v, float) and pd.isna(v))}
+        thresholds = dict(r.get("thresholds") or {})
+        thresholds.update({k: float(r[k]) for k in keys if k in r})
+        sens = r.get("sensitive_cols") or []
+        if isinstance(sens, str):
+            sens = [c.strip() for c in sens.split(";") if c.strip()]
+        specs.append({
+            "model": str(r.get("model") or os.path.splitext(os.path.basename(r["dataset_path"]))[0]),
+            "dataset_path": r["dataset_path"],
+            "target_col": r["target_col"],
+            "sensitive_col": r["sensitive_col"],
+            "sensitive_cols": sens,
+            "thresholds": thresholds,
+        })
+    return specs
+
+def _ml_worker(spec: dict, evidence_dir: str):
+    """Process-pool worker: ML audit + remediation for one model (no LLM/retriever needed)."""
+    ml_summary, bundle = run_ml_audit_to_bundle(
+        evidence_dir,
+        dataset_csv_path=spec["dataset_path"],
+        target_col=spec["target_col"],
+        sensitive_col=spec["sensitive_col"],
+        sensitive_cols=spec.get("sensitive_cols"),
+    )
+    target_di = float(spec.get("thresholds", {}).get("di_min", get_catalog().default_thresholds()["di_min"]))
+    mitigation = None
+    if float(ml_summary.get("di", 1.0)) < target_di:
+        mitigation = run_fairness_remediation(bundle, target_di=target_di)
+    return ml_summary, mitigation, bundle
+
+def _submit_ml(pool, runs, worker=_ml_worker):
+    futs, lost = {}, []
+    for r in runs:
+        try:
+            futs[pool.submit(worker, r["spec"], r["evidence_dir"])] = r
+        except BrokenProcessPool:
+            lost.append(r)
+    return futs, lost
+
+def _collect_ml(futs):
+    """Stores each model's result or error on its run dict; returns the runs lost to a broken pool."""
+    lost = []
+    for fut in as_completed(futs):
+        r = futs[fut]
+        try:
+            r["ml_summary"], r["mitigation"], r["bundle"] = fut.result()
+        except BrokenProcessPool:
+            lost.append(r)
+        except Exception as e:
+            r["error"] = f"ml_audit: {type(e).__name__}: {e}"
+            r["traceback"] = traceback.format_exc()
+    return lost
+
+def _retry_isolated(runs, worker=_ml_worker):
+    # a dying worker process breaks the whole pool; rerun each affected model alone so only the culprit fails
+    ctx = multiprocessing.get_context("spawn")
+    for r in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            futs, lost = _submit_ml(pool, [r], worker)
+            lost += _collect_ml(futs)
+        if lost:
+            r["error"] = "ml_audit: worker process crashed (BrokenProcessPool)"
+
+def run_fleet(
+    manifest,
+    workers: int = FLEET_WORKERS,
+    llm_id: Optional[str] = None,
+    strict_citations: bool = True,
+    deterministic: bool = True,
+    rebuild_vectordb: bool = False,
+    use_answer_cache: bool = True,
+    redteam_suite: Optional[str] = None,
+):
+    """
+    Audits every model in a manifest (path or list of specs) in one invocation.
+    The retriever, LLM and RAG audit are shared (the RAG audit does not depend on
+    the model under audit); ML audits fan out over a process pool. Each model
+    gets its own run dir and run record; a failing model (even one that crashes
+    its worker process) is recorded and the batch continues. If the shared RAG
+    audit fails, models are still scored on their ML evidence and marked
+    "partial". Writes fleet_summary.csv (one row per model, one column per
+    control) under FLEETS_DIR/<fleet_id>.
+    """
+    # imported here so spawned ML workers (which import this module) don't pull in torch/chroma
+    from .rag_audit_agent import run_rag_audit
+    from .llm_registry import get_llm
+    from .answer_cache import AnswerCache
+    from .vectordb import build_retriever
+
+    specs = load_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+    llm_id = llm_id or DEFAULT_LLM_ID
+    fleet_id = new_run_id("AEGIS-FLEET")
+    fleet_dir = os.path.join(FLEETS_DIR, fleet_id)
+    os.makedirs(fleet_dir, exist_ok=True)
+
+    logs = []
+
+    # Shared GenAI side: built once for the whole fleet
+    retriever, index_stats = build_retriever(rebuild=rebuild_vectordb, k=4)
+    gen, mode, llm_info = get_llm(llm_id)
+    logs.append({"node": "policy_index", **index_stats})
+    logs.append({"node": "llm_load", "llm_id": llm_id, "llm_mode": mode, **llm_info})
+
+    runs = []
+    for i, spec in enumerate(specs):
+        run_id = f"{fleet_id}-{i:04d}-{_slug(spec['model'])}"
+        run_dir, evidence_dir, reports_dir = get_run_dirs(run_id)
+        runs.append({"spec": spec, "run_id": run_id, "run_dir": run_dir, "evidence_dir": evidence_dir, "reports_dir": reports_dir})
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx) as pool:
+        futs, lost = _submit_ml(pool, runs)
+
+        # RAG audit overlaps with the ML fan-out
+        cache = AnswerCache() if use_answer_cache and deterministic else None  # sampled answers are never reused
+        rag_error, rag_failed = None, None
+        shared = EvidenceBundle()
+        try:
+            rag_summary = run_rag_audit(shared, retriever, gen, strict=strict_citations, deterministic=deterministic, cache=cache,
+                                        suite=redteam_suite)
+            logs.append({"node": "rag_audit", "strict": strict_citations, "answer_cache": cache is not None, "summary": rag_summary})
+        except Exception as e:
+            rag_failed = {"rag_audit": f"{type(e).__name__}: {e}"}
+            rag_error = f"rag_audit: {rag_failed['rag_audit']}"
+            logs.append({"node": "rag_audit", "status": "failed", "error": rag_error})
+
+        lost += _collect_ml(futs)
+    _retry_isolated(lost)
+
+    summary_rows, metas = [], []
+    for r in runs:
+        spec, ts = r["spec"], now_utc()
+        row = {"model": spec["model"], "run_id": r["run_id"], "dataset_path": spec["dataset_path"]}
+        run_logs = [{"node": "fleet", "fleet_id": fleet_id}] + logs
+        if "error" not in r:
+            try:
+                bundle = r["bundle"].update(shared)
+                cdf = eval_controls(bundle, thresholds=spec.get("thresholds"))
+                rdf = build_risk_register(bundle)
+                pdf, report_stats = write_audit_pack(r["reports_dir"], r["run_id"], ts, cdf, rdf, r["mitigation"], failed=rag_failed)
+                bundle.put("report", report_stats)
+                run_logs += [
+                    {"node": "ml_audit", "summary": r["ml_summary"]},
+                    {"node": "remediation", "mitigation": r["mitigation"]} if r["mitigation"] else {"node": "remediation", "skipped": True},
+                    {"node": "controls", "counts": cdf["status"].value_counts().to_dict()},
+                    {"node": "risks", "count": int(len(rdf))},
+                    {"node": "report", **report_stats},
+                ]
+                manifest = bundle.save(r["run_id"])
+                exported = bundle.export() if EVIDENCE_EXPORT_FILES else []
+                row.update({"status": "partial" if rag_error else "ok", "di": r["ml_summary"].get("di"), "risks": int(len(rdf))})
+                if rag_error:
+                    row["error"] = rag_error
+                row.update(dict(zip(cdf["control_id"], cdf["status"])))
+                metas.append({
+                    "run_id": r["run_id"], "timestamp": ts, "llm_id": llm_id, "llm_mode": mode, "model": spec["model"],
+                    "evidence_dir": r["evidence_dir"], "reports_dir": r["reports_dir"], "evidence_bundle": manifest,
+                    "control_csv": os.path.join(r["evidence_dir"], "control_results.csv") if exported else "",
+                    "risk_csv": os.path.join(r["evidence_dir"], "risk_register.csv") if exported else "",
+                    "audit_pdf": pdf, "logs": run_logs,
+                    "metrics": get_catalog().extract(bundle.docs), "controls": dict(zip(cdf["control_id"], cdf["status"])),
+                })
+            except Exception as e:
+                r["error"] = f"controls/report: {type(e).__name__}: {e}"
+        if "error" in r:
+            row.update({"status": "error", "error": r["error"]})
+            with open(os.path.join(r["run_dir"], "error.txt"), "w") as f:
+                f.write(r.get("traceback") or r["error"])
+        summary_rows.append(row)
+    upsert_runs(metas)  # one transaction for the whole fleet
+
+    ok = [{"run_id": m["run_id"], "evidence_dir": m["evidence_dir"], "model": m["model"]} for m in metas]
+    fleet_pdf, pack_stats = "", {}
+    if ok:
+        try:
+            fleet_pdf, pack_stats = write_fleet_pack(fleet_dir, fleet_id, ok)  # REPORT_WORKERS, not the ML fan-out width
+        except Exception as e:
+            pack_stats = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    logs.append({"node": "fleet_pack", **pack_stats})
+
+    summary = pd.DataFrame(summary_rows)
+    summary_csv = os.path.join(fleet_dir, "fleet_summary.csv")
+    summary.to_csv(summary_csv, index=False)
+    with open(os.path.join(fleet_dir, "fleet_logs.json"), "w") as f:
+        json.dump(logs, f, indent=2, default=str)
+
+    return {
+        "fleet_id": fleet_id,
+        "fleet_dir": fleet_dir,
+        "summary_csv": summary_csv,
+        "fleet_pdf": fleet_pdf,
+        "n_models": len(runs),
+        "n_failed": int((summary["status"] == "error").sum()) if len(summary) else 0,
+        "n_partial": int((summary["status"] == "partial").sum()) if len(summary) else 0,
+        "llm_mode": mode,
+        "logs": logs,
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="AEGIS fleet audit: audit every model in a manifest.")
+    ap.add_argument("manifest", help="CSV/JSON/JSONL with dataset_path,target_col,sensitive_col[,model,thresholds]")
+    ap.add_argument("--workers", type=int, default=FLEET_WORKERS)
+    ap.add_argument("--llm-id", default=None)
+    ap.add_argument("--no-strict", action="store_true")
+    ap.add_argument("--sampled", action="store_true", help="sampled decoding instead of deterministic")
+    ap.add_argument("--redteam-suite", default=None, help="JSONL/CSV prompt suite for the shared RAG audit")
+    args = ap.parse_args(argv)
+    out = run_fleet(args.manifest, workers=args.workers, llm_id=args.llm_id,
+                    strict_citations=not args.no_strict, deterministic=not args.sampled, redteam_suite=args.redteam_suite)
+    print(json.dumps({k: v for k, v in out.items() if k != "logs"}, indent=2))
+
+if __name__ == "__main__":
+    main()
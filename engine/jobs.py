@@ -0,0 +1,110 @@
+import os, json, socket, threading, traceback, uuid
+
+from . import run_store
+from .run_paths import new_run_id
+from .utils import now_utc
+from .config import JOB_WORKERS, JOB_POLL_S
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+_AUDIT_PARAMS = None
+
+def audit_params() -> set:
+    """Keyword arguments a job may pass to run_aegis."""
+    global _AUDIT_PARAMS
+    if _AUDIT_PARAMS is None:
+        import inspect
+        from .orchestrator import run_aegis
+        _AUDIT_PARAMS = set(inspect.signature(run_aegis).parameters) - {"run_id", "on_event"}
+    return _AUDIT_PARAMS
+
+class JobRunner:
+    """
+    Background audit worker. Jobs are rows of run_store's jobs table, so any
+    session or process can submit and watch them; this runner's threads claim
+    queued jobs and execute run_aegis in-process, which keeps models warm in
+    the LLM registry from one job to the next. Stage progress is written to the
+    job row as the workflow reports it.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.requeued = self._requeue_orphans()
+        self._threads = [threading.Thread(target=self._loop, name=f"aegis-job-{i}", daemon=True) for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def _requeue_orphans(self) -> int:
+        # running jobs of workers on this host whose process is gone were interrupted
+        host = socket.gethostname()
+        dead = []
+        for w in run_store.running_workers():
+            h, _, pid = (w or "").rpartition(":")
+            if h == host and pid.isdigit() and not _pid_alive(int(pid)):
+                dead.append(w)
+        return run_store.requeue_jobs(dead)
+
+    def submit(self, params: dict, submitted_by: str = "") -> str:
+        """Queues run_aegis(**params); returns the job id immediately."""
+        unknown = set(params) - audit_params()
+        if unknown:
+            raise ValueError(f"unknown audit parameters {sorted(unknown)}")
+        job_id = uuid.uuid4().hex[:12]
+        run_store.insert_job(job_id, params, now_utc(), submitted_by)
+        self._wake.set()
+        return job_id
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            job = run_store.claim_job(self.worker_id, now_utc())
+            if job is None:
+                self._wake.wait(JOB_POLL_S)
+                self._wake.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        from .orchestrator import run_aegis  # loads torch & co. only once a job actually runs
+        from .workflow import WorkflowError
+
+        job_id = job["job_id"]
+        run_id = new_run_id()
+        run_store.update_job(job_id, run_id=run_id)
+
+        def on_event(stage, status, entry):
+            info = {"status": status, **{k: entry[k] for k in ("start", "end", "duration_s", "error", "reason", "nodes") if k in entry}}
+            run_store.set_job_stage(job_id, stage, info)
+
+        try:
+            run_aegis(run_id=run_id, on_event=on_event, **json.loads(job["params_json"] or "{}"))
+            run_store.update_job(job_id, status="done", finished_at=now_utc())
+        except WorkflowError as e:
+            run_store.update_job(job_id, status="failed", finished_at=now_utc(), error=str(e),
+                                 logs_json=json.dumps(e.logs, default=str))
+        except Exception as e:
+            run_store.update_job(job_id, status="failed", finished_at=now_utc(),
+                                 error=f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+
+_RUNNER = None
+_RUNNER_LOCK = threading.Lock()
+
+def get_runner(workers: int = JOB_WORKERS) -> JobRunner:
+    """The process-wide runner (started on first use)."""
+    global _RUNNER
+    with _RUNNER_LOCK:
+        if _RUNNER is None:
+            _RUNNER = JobRunner(workers)
+    return _RUNNER
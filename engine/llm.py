@@ -1,30 +1,414 @@
+import os, re, json, time, hashlib, argparse, threading, weakref, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (AutoTokenizer, AutoModelForCausalLM, pipeline, StoppingCriteria, StoppingCriteriaList,
+                          TextIteratorStreamer)
 
-def load_local_llm(model_id: str):
-    tok = AutoTokenizer.from_pretrained(model_id, use_fast=True)
-    mode = "fp16"
+try:
+    from transformers import DynamicCache
+except ImportError:  # releases before Cache classes take the legacy tuple format
+    DynamicCache = None
 
-    # Try 4-bit (fast on GPU); fallback to fp16
+from .config import (GEN_BATCH_SIZE, GEN_MAX_NEW_TOKENS, LLM_CONCURRENCY, GEN_STOP_CHECK_EVERY, PREFIX_KV_CACHE,
+                     LLM_CPU_DTYPE, LLM_CPU_INT8, LLM_THREADS, LLM_BENCH_MODEL_ID)
+from .tracing import span, traced, Tracer, use_tracer, RssSampler, process_peak_rss_mb
+from .utils import REFUSAL_RE, has_citations
+
+CPU_MODES = ("bf16", "fp32", "int8")
+
+def cpu_bf16_supported() -> bool:
     try:
-        mdl = AutoModelForCausalLM.from_pretrained(
-            model_id,
-            device_map="auto",
-            load_in_4bit=True,
-            torch_dtype=torch.float16
-        )
-        mode = "4bit"
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
     except Exception:
+        return False
+
+def resolve_mode(quant: str = "auto", device: str = "auto") -> tuple:
+    """
+    (device kind, mode) that load_local_llm will use: "cuda" with "4bit"/"fp16",
+    or "cpu" with "bf16"/"fp32"/"int8" (fp32 weights, dynamic int8 linear layers).
+    """
+    cuda = device != "cpu" and torch.cuda.is_available()
+    if device not in ("auto", "cpu") and not cuda:
+        raise ValueError(f"device {device!r} requested but CUDA is not available")
+    if cuda:
+        if quant not in ("auto", "4bit", "fp16"):
+            raise ValueError(f"quant {quant!r} is a CPU mode; use 4bit or fp16 on CUDA")
+        return "cuda", quant
+    if quant == "auto":
+        if LLM_CPU_INT8:
+            return "cpu", "int8"
+        dtype = LLM_CPU_DTYPE if LLM_CPU_DTYPE != "auto" else ("bf16" if cpu_bf16_supported() else "fp32")
+        if dtype not in ("bf16", "fp32"):
+            raise ValueError(f"AEGIS_LLM_CPU_DTYPE must be auto, bf16 or fp32, not {dtype!r}")
+        return "cpu", dtype
+    if quant not in CPU_MODES:
+        raise ValueError(f"quant {quant!r} needs CUDA; CPU modes are {', '.join(CPU_MODES)}")
+    return "cpu", quant
+
+@traced("llm.load")
+def load_local_llm(model_id: str, quant: str = "auto", device: str = "auto"):
+    """
+    quant: "auto", or "4bit"/"fp16" (CUDA), or "bf16"/"fp32"/"int8" (CPU).
+    "auto" tries 4bit then fp16 on CUDA; on CPU it follows AEGIS_LLM_CPU_INT8 and
+    AEGIS_LLM_CPU_DTYPE. device: passed through as device_map on CUDA.
+    Returns (gen, mode), mode being e.g. "cuda-4bit" or "cpu-bf16".
+    """
+    kind, mode = resolve_mode(quant, device)
+    tok = AutoTokenizer.from_pretrained(model_id, use_fast=True)
+
+    if kind == "cpu":
+        if LLM_THREADS > 0:
+            torch.set_num_threads(LLM_THREADS)
+        dtype = torch.bfloat16 if mode == "bf16" else torch.float32
+        mdl = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=dtype, low_cpu_mem_usage=True).eval()
+        if mode == "int8":
+            mdl = torch.ao.quantization.quantize_dynamic(mdl, {torch.nn.Linear}, dtype=torch.qint8)
+        gen = pipeline("text-generation", model=mdl, tokenizer=tok, device="cpu")
+        return gen, f"cpu-{mode}"
+
+    # Try 4-bit (fast on GPU); fallback to fp16
+    mdl = None
+    if mode in ("auto", "4bit"):
+        try:
+            mdl = AutoModelForCausalLM.from_pretrained(
+                model_id,
+                device_map=device,
+                load_in_4bit=True,
+                torch_dtype=torch.float16
+            )
+            mode = "4bit"
+        except Exception:
+            if mode == "4bit":
+                raise
+    if mdl is None:
         mdl = AutoModelForCausalLM.from_pretrained(
             model_id,
-            device_map="auto",
+            device_map=device,
             torch_dtype=torch.float16
         )
         mode = "fp16"
 
-    gen = pipeline("text-generation", model=mdl, tokenizer=tok, device_map="auto")
-    return gen, mode
+    gen = pipeline("text-generation", model=mdl, tokenizer=tok, device_map=device)
+    return gen, f"cuda-{mode}"
+
+# concurrent runs (jobs, service workers) share loaded models; at most LLM_CONCURRENCY forward passes at a time
+GEN_SLOTS = threading.BoundedSemaphore(max(1, LLM_CONCURRENCY))
+
+SAMPLED_DECODING = {"do_sample": True, "temperature": 0.2, "top_p": 0.9, "repetition_penalty": 1.1}
+DETERMINISTIC_DECODING = {"do_sample": False, "repetition_penalty": 1.1}  # greedy: same input -> same answer
+
+def decoding_params(deterministic: bool = False) -> dict:
+    return dict(DETERMINISTIC_DECODING if deterministic else SAMPLED_DECODING)
+
+def model_id_of(gen) -> str:
+    return getattr(gen.model, "name_or_path", "") or getattr(gen.model.config, "_name_or_path", "")
+
+# --- prefix KV cache: a prompt preamble shared by every query is prefilled once per loaded model ---
+
+_PREFIXES = weakref.WeakKeyDictionary()  # model -> {"sha", "ids", "kv", "prefill_s"}; dropped with the model
+_PREFIX_LOCK = threading.Lock()
+
+def _legacy_kv(kv):
+    """((key, value) per layer) from whatever cache object the installed transformers returns."""
+    if hasattr(kv, "to_legacy_cache"):
+        return kv.to_legacy_cache()
+    if hasattr(kv, "layers"):  # releases that dropped the legacy format
+        return tuple((layer.keys, layer.values) for layer in kv.layers)
+    return tuple(kv)
+
+def _batch_cache(kv, rows: int):
+    """The prefix cache expanded to rows, in the form generate() of the installed transformers expects."""
+    layers = tuple((k.expand(rows, -1, -1, -1), v.expand(rows, -1, -1, -1)) for k, v in kv)
+    if DynamicCache is None:
+        return layers
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(layers)
+    cache = DynamicCache()
+    for i, (k, v) in enumerate(layers):
+        cache.update(k, v, i)
+    return cache
+
+def prefix_kv(gen, prefix: str):
+    """
+    The key/value cache of prefix for gen's model, prefilled on first use and
+    recomputed when the prefix text changes. Returns None when prefix caching is
+    off or the model cannot return a cache.
+    """
+    if not PREFIX_KV_CACHE or not prefix:
+        return None
+    tok, mdl = gen.tokenizer, gen.model
+    sha = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+    with _PREFIX_LOCK:
+        ent = _PREFIXES.get(mdl)
+        if ent is None or ent["sha"] != sha:
+            ids = tok(prefix, return_tensors="pt")["input_ids"].to(mdl.device)
+            with span("llm.prefix_prefill", prefix_tokens=int(ids.shape[1])) as sp, torch.inference_mode():
+                t0 = time.perf_counter()
+                try:
+                    kv = _legacy_kv(mdl(input_ids=ids, use_cache=True).past_key_values)
+                except Exception as e:
+                    kv = None
+                    sp.set(error=f"{type(e).__name__}: {e}")
+            ent = {"sha": sha, "ids": ids, "kv": kv, "prefill_s": time.perf_counter() - t0}
+            _PREFIXES[mdl] = ent
+    return ent if ent["kv"] is not None else None
+
+def _encode(tok, prompts, device, prefix=None, ent=None):
+    """
+    Batch encoding: left-padded, or with a cached prefix shared by every prompt,
+    prefix ids + padding + suffix ids (position ids follow the attention mask, so
+    the padding in the middle is skipped). Returns (enc, the prefix entry used or None).
+    """
+    if ent is None or not all(p.startswith(prefix) for p in prompts):
+        return tok(list(prompts), return_tensors="pt", padding=True).to(device), None
+    try:
+        # generate extends the cache in place of the batch; the stored prefix tensors are never modified
+        cache = _batch_cache(ent["kv"], len(prompts))
+    except Exception:  # cache API this code does not know: encode without the prefix
+        return tok(list(prompts), return_tensors="pt", padding=True).to(device), None
+    n = len(prefix)
+    suffixes = tok([p[n:] for p in prompts], add_special_tokens=False)["input_ids"]
+    width = max(len(s) for s in suffixes)
+    pre = ent["ids"][0].tolist()
+    ids = [pre + [tok.pad_token_id] * (width - len(s)) + s for s in suffixes]
+    mask = [[1] * len(pre) + [0] * (width - len(s)) + [1] * len(s) for s in suffixes]
+    enc = {"input_ids": torch.tensor(ids, device=device), "attention_mask": torch.tensor(mask, device=device),
+           "past_key_values": cache}
+    return enc, ent
+
+def _prefix_attrs(ent, rows: int) -> dict:
+    # an estimate, not a measurement: the one-row prefix prefill time once per row that skipped it
+    # (prefilling the prefix for a whole batch at once would have cost less than rows x that)
+    if ent is None:
+        return {}
+    return {"prefix_tokens_reused": int(ent["ids"].shape[1]) * rows, "prefill_saved_est_s": round(ent["prefill_s"] * rows, 4)}
+
+# --- early stopping: a check takes the text generated so far and returns a stop reason or None ---
+
+_SENTENCE_END_RE = re.compile(r"[.!?](?:\s|$)|\n")
+
+def stop_on_refusal():
+    """Stops once the answer opens with a refusal and that sentence is complete."""
+    def check(text):
+        m = REFUSAL_RE.match(text)
+        return "refusal" if m and _SENTENCE_END_RE.search(text, m.end()) else None
+    return check
+
+def stop_on_guardrail(categories=("credentials",)):
+    """Stops at the first guardrail hit in categories: an answer that starts leaking keys is not worth finishing."""
+    from .guardrails import get_guardrails
+    guard, categories = get_guardrails(), set(categories)
+
+    def check(text):
+        return "guardrail" if guard.matches(text, categories) else None
+    return check
+
+def stop_uncited(max_sentences: int):
+    """Strict mode: an answer with max_sentences complete sentences and no [n] citation will be rejected, so stop."""
+    def check(text):
+        if len(_SENTENCE_END_RE.findall(text)) >= max_sentences and not has_citations(text):
+            return "uncited"
+        return None
+    return check
+
+class TextStop(StoppingCriteria):
+    """
+    Per-row stopping criteria: decodes each row's new tokens every `every` steps
+    and runs that row's checks on it. Also timestamps the first decode step,
+    which is the time to first token of the call.
+    """
+
+    def __init__(self, tok, prompt_len: int, checks, every: int = GEN_STOP_CHECK_EVERY):
+        self.tok, self.prompt_len, self.checks, self.every = tok, prompt_len, checks, max(1, every)
+        self.reasons = [None] * len(checks)
+        self.steps = 0
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.steps += 1
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.steps % self.every == 0:
+            for row, checks in enumerate(self.checks):
+                if self.reasons[row] is None and checks:
+                    text = self.tok.decode(input_ids[row, self.prompt_len:], skip_special_tokens=True)
+                    self.reasons[row] = next((r for r in (c(text) for c in checks) if r), None)
+        return torch.tensor([r is not None for r in self.reasons], dtype=torch.bool, device=input_ids.device)
+
+def generate(gen, prompt: str, max_new_tokens: int = GEN_MAX_NEW_TOKENS, deterministic: bool = False, checks=(),
+             prefix: str | None = None):
+    return generate_batch(gen, [prompt], max_new_tokens=max_new_tokens, deterministic=deterministic,
+                          checks=[list(checks)], prefix=prefix)[0]
+
+class GenerationStream:
+    """
+    Streaming generate for one prompt: iterating yields text pieces as tokens are
+    decoded (generation runs in a background thread). checks and prefix are as
+    for generate_batch. Afterwards .text holds the answer and .stats
+    ttft_s, tokens_out, tokens_per_s, total_s and stop_reason.
+    """
+
+    def __init__(self, gen, prompt: str, max_new_tokens: int = GEN_MAX_NEW_TOKENS, deterministic: bool = False, checks=(),
+                 prefix: str | None = None):
+        self.gen, self.prompt, self.max_new_tokens, self.deterministic = gen, prompt, max_new_tokens, deterministic
+        self.checks, self.prefix = list(checks), prefix
+        self.text, self.stats = "", {}
+
+    def __iter__(self):
+        tok, mdl = self.gen.tokenizer, self.gen.model
+        if tok.pad_token is None:
+            tok.pad_token = tok.eos_token
+        streamer = TextIteratorStreamer(tok, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def run():
+            try:
+                with torch.inference_mode():
+                    mdl.generate(**enc, max_new_tokens=self.max_new_tokens, **decoding_params(self.deterministic),
+                                 pad_token_id=tok.pad_token_id, streamer=streamer,
+                                 stopping_criteria=StoppingCriteriaList([stop]))
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+            finally:
+                GEN_SLOTS.release()
+
+        with span("llm.wait"):
+            GEN_SLOTS.acquire()
+        try:
+            enc, ent = _encode(tok, [self.prompt], mdl.device, self.prefix, prefix_kv(self.gen, self.prefix))
+        except Exception:
+            GEN_SLOTS.release()
+            raise
+        stop = TextStop(tok, enc["input_ids"].shape[1], [self.checks])
+        with span("llm.stream") as sp:
+            t0 = time.perf_counter()
+            worker = threading.Thread(target=run, name="llm-stream", daemon=True)
+            worker.start()
+            first = None
+            for piece in streamer:
+                if piece and first is None:
+                    first = time.perf_counter()
+                self.text += piece
+                yield piece
+            worker.join()
+            if errors:
+                raise errors[0]
+            total = time.perf_counter() - t0
+            n_out = stop.steps
+            self.stats = {"ttft_s": round((first or time.perf_counter()) - t0, 4), "tokens_out": n_out,
+                          "tokens_per_s": round(n_out / total, 2) if total > 0 else 0.0, "total_s": round(total, 4),
+                          "stop_reason": stop.reasons[0] or ("max_tokens" if n_out >= self.max_new_tokens else "eos")}
+            sp.set(tokens_in=int(enc["input_ids"].shape[1]), tokens_out=n_out, ttft_s=self.stats["ttft_s"],
+                   stop_reason=self.stats["stop_reason"], **_prefix_attrs(ent, 1))
+        self.text = self.text.strip()
+
+def generate_batch(gen, prompts, batch_size: int = GEN_BATCH_SIZE, max_new_tokens: int = GEN_MAX_NEW_TOKENS, deterministic: bool = False,
+                   checks=None, prefix: str | None = None):
+    """
+    Generates completions for a list of prompts, returned in input order.
+    Prompts are sorted by token length and left-padded within each batch so
+    similar-length prompts share a forward pass with little padding waste.
+    checks: per prompt, a list of early-stop checks (stop_on_refusal(), ...);
+    a row stops as soon as one fires and the batch ends when every row has stopped.
+    prefix: text every prompt starts with (the build_prompt preamble); its KV
+    cache is computed once per model and each batch continues from it.
+    """
+    if not prompts:
+        return []
+    tok, mdl = gen.tokenizer, gen.model
+    if tok.pad_token is None:
+        tok.pad_token = tok.eos_token
+    tok.padding_side = "left"  # decoder-only: new tokens must follow the prompt directly
+
+    lengths = [len(ids) for ids in tok(list(prompts), add_special_tokens=False)["input_ids"]]
+    order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+
+    outs = [None] * len(prompts)
+    for b in range(0, len(order), max(1, batch_size)):
+        idx = order[b:b + batch_size]
+        with span("llm.wait"):
+            GEN_SLOTS.acquire()
+        try:
+            enc, ent = _encode(tok, [prompts[i] for i in idx], mdl.device, prefix, prefix_kv(gen, prefix))
+            stop = TextStop(tok, enc["input_ids"].shape[1], [list(checks[i]) if checks else [] for i in idx])
+            with span("llm.generate", batch=len(idx)) as sp, torch.inference_mode():
+                t0 = time.perf_counter()
+                seq = mdl.generate(
+                    **enc,
+                    max_new_tokens=max_new_tokens,
+                    **decoding_params(deterministic),
+                    pad_token_id=tok.pad_token_id,
+                    stopping_criteria=StoppingCriteriaList([stop]),
+                )
+                new_tokens = seq[:, enc["input_ids"].shape[1]:]
+                reasons = [r for r in stop.reasons if r]
+                sp.set(tokens_in=int(enc["attention_mask"].sum()), tokens_out=int((new_tokens != tok.pad_token_id).sum()),
+                       ttft_s=round(stop.first_token_at - t0, 4) if stop.first_token_at else None,
+                       steps=stop.steps, stopped_early=len(reasons),
+                       stop_reasons={r: reasons.count(r) for r in set(reasons)}, **_prefix_attrs(ent, len(idx)))
+        finally:
+            GEN_SLOTS.release()
+        for i, text in zip(idx, tok.batch_decode(new_tokens, skip_special_tokens=True)):
+            outs[i] = text.strip()
+    return outs
+
+# --- benchmark: python -m engine.llm --bench [--model-id ID] [--modes bf16,fp32,int8] ---
+
+BENCH_PROMPTS = [
+    "Summarize the purpose of a model risk register in two sentences.",
+    "What should a drift monitoring policy for production models require?",
+    "Explain disparate impact to a compliance officer.",
+    "List three controls against prompt injection in a RAG assistant.",
+]
+
+def _bench_mode(model_id: str, mode: str, max_new_tokens: int) -> dict:
+    # runs in a fresh process per mode so load memory is not masked by an earlier model
+    # get_memory_footprint() misses dynamically quantized int8 weights, so memory is the RSS over the load
+    t0 = time.perf_counter()
+    with RssSampler() as mem:
+        gen, label = load_local_llm(model_id, quant=mode, device="cpu")
+    row = {"llm_mode": label, "threads": torch.get_num_threads(), "load_s": round(time.perf_counter() - t0, 2),
+           "load_rss_delta_mb": mem.delta_mb, "load_peak_rss_mb": mem.peak_mb}
+    generate_batch(gen, BENCH_PROMPTS[:1], max_new_tokens=4, deterministic=True)  # warm-up
+    tracer = Tracer()
+    with use_tracer(tracer):
+        for p in BENCH_PROMPTS:  # one at a time: interactive latency, not batch throughput
+            generate(gen, p, max_new_tokens=max_new_tokens, deterministic=True)
+    s = tracer.summary()["llm.generate"]
+    row.update({"tokens_out": s.get("tokens_out", 0), "gen_s": s["wall_s"], "tokens_per_s": s.get("tokens_per_s", 0.0),
+                "ttft_mean_s": s.get("ttft_mean_s"), "process_peak_rss_mb": round(process_peak_rss_mb() or 0.0, 1)})
+    return row
+
+def benchmark(model_id: str = LLM_BENCH_MODEL_ID, modes=CPU_MODES, max_new_tokens: int = 64) -> dict:
+    """Load time, memory and tokens/s of each CPU mode on the same prompts (greedy decoding)."""
+    out = {"model_id": model_id, "cpus": os.cpu_count(), "bf16_native": cpu_bf16_supported(), "modes": {}}
+    ctx = multiprocessing.get_context("spawn")
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                out["modes"][mode] = pool.submit(_bench_mode, model_id, mode, max_new_tokens).result()
+            except Exception as e:
+                out["modes"][mode] = {"error": f"{type(e).__name__}: {e}"}
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local LLM backends: resolve the load mode or benchmark CPU modes.")
+    ap.add_argument("--bench", action="store_true")
+    ap.add_argument("--model-id", default=LLM_BENCH_MODEL_ID)
+    ap.add_argument("--modes", default=",".join(CPU_MODES))
+    ap.add_argument("--max-new-tokens", type=int, default=64)
+    ap.add_argument("--threads", type=int, default=None, help="intra-op threads (AEGIS_LLM_THREADS) for every mode")
+    args = ap.parse_args(argv)
+    if args.threads is not None:
+        os.environ["AEGIS_LLM_THREADS"] = str(args.threads)  # read by the spawned benchmark processes
+    if args.bench:
+        print(json.dumps(benchmark(args.model_id, [m.strip() for m in args.modes.split(",") if m.strip()],
+                                   args.max_new_tokens), indent=2))
+    else:
+        kind, mode = resolve_mode()
+        print(json.dumps({"llm_mode": f"{kind}-{mode}", "cuda": torch.cuda.is_available(),
+                          "bf16_native": cpu_bf16_supported(), "threads": LLM_THREADS or torch.get_num_threads()}, indent=2))
 
-def generate(gen, prompt: str, max_new_tokens: int = 220):
-    out = gen(prompt, max_new_tokens=max_new_tokens, do_sample=True, temperature=0.2, top_p=0.9, repetition_penalty=1.1)[0]["generated_text"]
-    return out[len(prompt):].strip()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import gc, time, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from .config import LLM_RAM_BUDGET_GB
+from .llm import load_local_llm, resolve_mode
+from .tracing import RssSampler
+
+def _footprint_gb(gen, rss_delta_mb=None) -> float:
+    # on CPU the RSS growth over the load is the real cost: get_memory_footprint()
+    # does not count dynamically quantized int8 weights
+    if rss_delta_mb is not None and getattr(getattr(gen.model, "device", None), "type", "cpu") == "cpu":
+        return max(float(rss_delta_mb), 0.0) / 1024
+    try:
+        return float(gen.model.get_memory_footprint()) / 1024**3
+    except Exception:
+        return 0.0
+
+class LLMRegistry:
+    """
+    Process-wide cache of loaded text-generation pipelines keyed by model id and
+    the (device kind, mode) resolve_mode picks, so "auto" and an explicit
+    equivalent share one load. Least-recently-used models are evicted once the
+    summed footprint exceeds budget_gb; the model just requested is never
+    evicted. Lookups never wait on a cold load of another model: loads run
+    outside the cache lock, callers asking for a model already being loaded
+    wait for that load, and cold loads run one at a time so each one's RSS
+    delta is its own.
+    """
+
+    def __init__(self, budget_gb: float = LLM_RAM_BUDGET_GB):
+        self.budget_gb = budget_gb
+        self._models = OrderedDict()  # key -> {"gen", "mode", "mem_gb", "load_s"}
+        self._loading = {}            # key -> Future of the entry being loaded
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self, model_id: str, quant: str = "auto", device: str = "auto"):
+        """Returns (gen, mode, info); info has load_s (0 when warm), warm, mem_gb."""
+        key = (model_id, *resolve_mode(quant, device))
+        t0 = time.perf_counter()
+        with self._lock:
+            ent = self._models.get(key)
+            if ent is not None:
+                self._models.move_to_end(key)
+                info = {"warm": True, "load_s": round(time.perf_counter() - t0, 4), "mem_gb": round(ent["mem_gb"], 3)}
+                return ent["gen"], ent["mode"], info
+            fut = self._loading.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._loading[key] = Future()
+
+        if not owner:  # another caller is loading this model
+            ent = fut.result()
+            info = {"warm": True, "load_s": round(time.perf_counter() - t0, 4), "mem_gb": round(ent["mem_gb"], 3)}
+            return ent["gen"], ent["mode"], info
+
+        try:
+            with self._load_lock, RssSampler() as mem:
+                gen, mode = load_local_llm(model_id, quant=quant, device=device)
+            ent = {"gen": gen, "mode": mode, "mem_gb": _footprint_gb(gen, mem.delta_mb), "load_s": time.perf_counter() - t0}
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._models[key] = ent
+            self._loading.pop(key, None)
+            evicted = self._evict(keep=key)
+        fut.set_result(ent)
+        if evicted:
+            _release_memory()
+        info = {"warm": False, "load_s": round(ent["load_s"], 3), "mem_gb": round(ent["mem_gb"], 3), "evicted": evicted}
+        return gen, mode, info
+
+    def preload(self, model_ids, quant: str = "auto", device: str = "auto"):
+        return {m: self.get(m, quant=quant, device=device)[2] for m in model_ids}
+
+    def loaded(self):
+        with self._lock:
+            return [{"model_id": k[0], "device": k[1], "quant": k[2], "mode": v["mode"], "mem_gb": round(v["mem_gb"], 3)}
+                    for k, v in self._models.items()]
+
+    def total_gb(self) -> float:
+        with self._lock:
+            return self._total_gb()
+
+    def _total_gb(self) -> float:
+        return sum(v["mem_gb"] for v in self._models.values())
+
+    def _evict(self, keep):
+        # caller holds _lock
+        evicted = []
+        while self._total_gb() > self.budget_gb and len(self._models) > 1:
+            key = next(k for k in self._models if k != keep)
+            self._models.pop(key)
+            evicted.append(key[0])
+        return evicted
+
+def _release_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
+
+REGISTRY = LLMRegistry()
+
+def get_llm(model_id: str, quant: str = "auto", device: str = "auto"):
+    return REGISTRY.get(model_id, quant=quant, device=device)
+
+def preload_llms(model_ids, quant: str = "auto", device: str = "auto"):
+    return REGISTRY.preload(model_ids, quant=quant, device=device)
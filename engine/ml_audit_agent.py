@@ -1,21 +1,122 @@
-import os, json
+import os, time
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from sklearn.model_selection import train_test_split
+from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import FeatureHasher
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.impute import SimpleImputer
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, roc_auc_score
-from fairlearn.metrics import MetricFrame, selection_rate, true_positive_rate, false_positive_rate
 
-import shap
+from .tracing import span, traced, RssSampler
+from .config import (STREAM_AUTO_BYTES, STREAM_MEMORY_BUDGET_MB, ML_RARE_MIN_COUNT, ML_HASH_CARDINALITY,
+                     ML_HASH_FEATURES, ML_SPARSE_THRESHOLD)
+from .fairness_engine import group_metrics, fairness_report
+from .drift_profile import (PROFILE_NAME, PROFILE_VERSION, N_BINS, N_QUANTILES, build_reference_profile, save_profile, load_profile,
+                            score_batch, reference_profile, dataset_fingerprint)
+from .explain import explain_model
+from .evidence import EvidenceBundle
 
-def _save_json(path, obj):
-    with open(path, "w") as f:
-        json.dump(obj, f, indent=2, default=str)
+def _is_cat(col: pd.Series) -> bool:
+    return col.dtype == "O" or pd.api.types.is_string_dtype(col) or str(col.dtype).startswith("category")
+
+def _split_columns(X: pd.DataFrame):
+    cat_cols = [c for c in X.columns if _is_cat(X[c])]
+    num_cols = [c for c in X.columns if c not in cat_cols]
+    return cat_cols, num_cols
+
+class HashingEncoder(BaseEstimator, TransformerMixin):
+    """Hashes "col=value" tokens of very high-cardinality categoricals into n_features sparse columns."""
+
+    def __init__(self, n_features: int = ML_HASH_FEATURES):
+        self.n_features = n_features
+
+    def fit(self, X, y=None):
+        self.columns_ = list(X.columns)
+        self.n_features_in_ = len(self.columns_)
+        return self
+
+    def transform(self, X):
+        X = pd.DataFrame(X, columns=self.columns_)
+        tokens = [(c + "=" + X[c].astype(str)).tolist() for c in self.columns_]
+        hasher = FeatureHasher(n_features=self.n_features, input_type="string", alternate_sign=False)
+        return hasher.transform(zip(*tokens)).tocsr()
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array([f"hashed_{i}" for i in range(self.n_features)], dtype=object)
+
+def _build_model(num_cols, cat_cols, cardinality: dict | None = None):
+    """
+    Dense scaled numerics + sparse (CSR) one-hot categoricals, rare levels bucketed when ML_RARE_MIN_COUNT > 0;
+    categoricals above ML_HASH_CARDINALITY levels are hashed. The design matrix stays
+    CSR when its density is below ML_SPARSE_THRESHOLD, and lbfgs trains on it directly.
+    """
+    cardinality = cardinality or {}
+    hash_cols = [c for c in cat_cols if ML_HASH_CARDINALITY and cardinality.get(c, 0) > ML_HASH_CARDINALITY]
+    ohe_cols = [c for c in cat_cols if c not in hash_cols]
+
+    num_pipe = Pipeline([
+        ("imputer", SimpleImputer(strategy="median")),
+        ("scaler", StandardScaler())
+    ])
+    cat_pipe = Pipeline([
+        ("imputer", SimpleImputer(strategy="most_frequent")),
+        ("onehot", _onehot())
+    ])
+
+    transformers = [("num", num_pipe, num_cols), ("cat", cat_pipe, ohe_cols)]
+    if hash_cols:
+        transformers.append(("hash", HashingEncoder(), hash_cols))
+    pre = ColumnTransformer(transformers, remainder="drop", sparse_threshold=ML_SPARSE_THRESHOLD)
+
+    clf = LogisticRegression(max_iter=4000)
+    return Pipeline([("pre", pre), ("clf", clf)])
+
+def _onehot():
+    # ML_RARE_MIN_COUNT=0 keeps one column per level (the original features); > 0 buckets rare levels
+    if ML_RARE_MIN_COUNT > 0:
+        return OneHotEncoder(handle_unknown="infrequent_if_exist", min_frequency=ML_RARE_MIN_COUNT, sparse_output=True)
+    return OneHotEncoder(handle_unknown="ignore", sparse_output=True)
+
+def _fit_model(model, X_train, y_train) -> dict:
+    """Fits the pipeline step by step so the design matrix can be measured; returns stats for ml_metrics.json."""
+    pre, clf = model.named_steps["pre"], model.named_steps["clf"]
+    with RssSampler() as mem:
+        t0 = time.perf_counter()
+        Xt = pre.fit_transform(X_train, y_train)
+        t1 = time.perf_counter()
+        clf.fit(Xt, y_train)
+        t2 = time.perf_counter()
+
+    is_sparse = sparse.issparse(Xt)
+    n_rows, n_features = Xt.shape
+    nbytes = (Xt.data.nbytes + Xt.indices.nbytes + Xt.indptr.nbytes) if is_sparse else Xt.nbytes
+    nnz = int(Xt.nnz) if is_sparse else int(np.count_nonzero(Xt))
+    infrequent, hash_cols = 0, []
+    for name, est, cols in pre.transformers_:
+        if name == "cat" and len(cols) and est.named_steps["onehot"].min_frequency is not None:
+            infrequent = sum(len(c) for c in est.named_steps["onehot"].infrequent_categories_ if c is not None)
+        elif name == "hash":
+            hash_cols = list(cols)
+    return {
+        "sparse": bool(is_sparse),
+        "n_features": int(n_features),
+        "nnz": nnz,
+        "density": round(nnz / max(n_rows * n_features, 1), 6),
+        "design_matrix_mb": round(nbytes / 1024**2, 3),
+        "dense_equivalent_mb": round(n_rows * n_features * 8 / 1024**2, 3),
+        "rare_levels_bucketed": int(infrequent),
+        "hashed_cols": hash_cols,
+        "preprocess_fit_s": round(t1 - t0, 4),
+        "model_fit_s": round(t2 - t1, 4),
+        "fit_rss_delta_mb": mem.delta_mb,
+        "fit_sampled_peak_rss_mb": mem.peak_mb,
+    }
 
 def _prep_dataset(df: pd.DataFrame, target_col: str, sensitive_col: str):
     assert target_col in df.columns, f"target_col '{target_col}' not in columns"
@@ -25,7 +126,7 @@ def _prep_dataset(df: pd.DataFrame, target_col: str, sensitive_col: str):
     X = df.drop(columns=[target_col]).copy()
 
     # map y to {0,1} if needed
-    if y_raw.dtype == "O" or str(y_raw.dtype).startswith("category"):
+    if _is_cat(y_raw):
         y = y_raw.astype("category").cat.codes
     else:
         y = y_raw.copy()
@@ -41,7 +142,7 @@ def _prep_dataset(df: pd.DataFrame, target_col: str, sensitive_col: str):
 
     # sensitive to binary codes (0/1/...); if >2 groups we keep codes (fairlearn supports multi-group)
     s_raw = df[sensitive_col]
-    if s_raw.dtype == "O" or str(s_raw.dtype).startswith("category"):
+    if _is_cat(s_raw):
         s = s_raw.astype("category").cat.codes
     else:
         s = pd.Series(s_raw).fillna(0).astype(int)
@@ -49,27 +150,51 @@ def _prep_dataset(df: pd.DataFrame, target_col: str, sensitive_col: str):
     # ensure sensitive column exists in X too (it will, unless removed) - keep it by default for now
     return X, y, s
 
-def run_ml_audit(evidence_dir: str, dataset_csv_path: str | None = None, target_col: str | None = None, sensitive_col: str | None = None):
+@traced("ml.audit")
+def run_ml_audit(evidence_dir: str, dataset_csv_path: str | None = None, target_col: str | None = None, sensitive_col: str | None = None,
+                 streaming: bool | None = None, memory_budget_mb: int = STREAM_MEMORY_BUDGET_MB,
+                 reference_profile_path: str | None = None, sensitive_cols: list | None = None,
+                 bundle: EvidenceBundle | None = None):
     """
-    Writes:
-      - ml_metrics.json
-      - fairness.json
-      - drift.json
-      - shap_global_importance.csv
-      - ml_eval_scores.csv (y_true, y_score, sensitive)
+    Adds to the evidence bundle:
+      - ml_metrics
+      - fairness (primary attribute + every sensitive_cols attribute and their intersections)
+      - drift (mean shift + PSI/KS/JS vs the reference profile)
+      - shap_global (exact linear SHAP over the full test set), shap_group (mean |SHAP| per sensitive group)
+      - eval_scores (y_true, y_score, sensitive)
+    and writes drift_reference_profile.json next to it for later drift checks.
+
+    Without a bundle, a new one is created and saved to evidence_dir.
+    streaming=None picks the chunked out-of-core audit for files above STREAM_AUTO_BYTES.
     """
     os.makedirs(evidence_dir, exist_ok=True)
+    ev = bundle if bundle is not None else EvidenceBundle(evidence_dir)
 
-    # Load dataset
     if dataset_csv_path and target_col and sensitive_col:
-        df = pd.read_csv(dataset_csv_path)
-    else:
-        # fallback demo dataset (small)
-        from sklearn.datasets import load_breast_cancer
-        data = load_breast_cancer(as_frame=True)
-        df = data.frame
-        target_col = "target"
-        sensitive_col = "mean radius"  # will exist as feature, used as mock sensitive
+        if streaming is None:
+            streaming = os.path.getsize(dataset_csv_path) > STREAM_AUTO_BYTES
+        if streaming:
+            from .ml_stream_audit import run_ml_audit_streaming
+            out = run_ml_audit_streaming(evidence_dir, dataset_csv_path, target_col, sensitive_col, memory_budget_mb=memory_budget_mb,
+                                         reference_profile_path=reference_profile_path, sensitive_cols=sensitive_cols, bundle=ev)
+            if bundle is None:
+                ev.save()
+            return out
+
+    # Load dataset
+    with span("ml.load"):
+        if dataset_csv_path and target_col and sensitive_col:
+            if dataset_csv_path.lower().endswith((".parquet", ".pq")):
+                df = pd.read_parquet(dataset_csv_path)
+            else:
+                df = pd.read_csv(dataset_csv_path)
+        else:
+            # fallback demo dataset (small)
+            from sklearn.datasets import load_breast_cancer
+            data = load_breast_cancer(as_frame=True)
+            df = data.frame
+            target_col = "target"
+            sensitive_col = "mean radius"  # will exist as feature, used as mock sensitive
 
     # if sensitive col is continuous -> binarize for DI style check
     if pd.api.types.is_numeric_dtype(df[sensitive_col]) and df[sensitive_col].nunique() > 10:
@@ -83,26 +208,10 @@ def run_ml_audit(evidence_dir: str, dataset_csv_path: str | None = None, target_
     )
 
     # Preprocess
-    cat_cols = [c for c in X.columns if X[c].dtype == "O" or str(X[c].dtype).startswith("category")]
-    num_cols = [c for c in X.columns if c not in cat_cols]
-
-    num_pipe = Pipeline([
-        ("imputer", SimpleImputer(strategy="median")),
-        ("scaler", StandardScaler())
-    ])
-    cat_pipe = Pipeline([
-        ("imputer", SimpleImputer(strategy="most_frequent")),
-        ("onehot", OneHotEncoder(handle_unknown="ignore", sparse_output=False))
-    ])
-
-    pre = ColumnTransformer([
-        ("num", num_pipe, num_cols),
-        ("cat", cat_pipe, cat_cols)
-    ], remainder="drop")
-
-    clf = LogisticRegression(max_iter=4000)
-    model = Pipeline([("pre", pre), ("clf", clf)])
-    model.fit(X_train, y_train)
+    cat_cols, num_cols = _split_columns(X)
+    model = _build_model(num_cols, cat_cols, X_train[cat_cols].nunique().to_dict())
+    with span("ml.fit", rows=int(len(X_train)), features=int(X.shape[1])):
+        fit_stats = _fit_model(model, X_train, y_train)
 
     pred = model.predict(X_test)
     proba = model.predict_proba(X_test)[:, 1] if len(np.unique(y_train)) > 1 else np.zeros(len(y_test))
@@ -112,76 +221,86 @@ def run_ml_audit(evidence_dir: str, dataset_csv_path: str | None = None, target_
         "auc": float(roc_auc_score(y_test, proba)) if len(np.unique(y_test)) > 1 else None,
         "n_test": int(len(y_test)),
         "target_col": target_col,
-        "sensitive_col": sensitive_col
+        "sensitive_col": sensitive_col,
+        "preprocessing": fit_stats,
     }
-    _save_json(os.path.join(evidence_dir, "ml_metrics.json"), metrics)
 
-    # Save eval scores for remediation
-    pd.DataFrame({
+    # Eval scores for remediation
+    ev.put("eval_scores", pd.DataFrame({
         "y_true": y_test.astype(int).values,
         "y_score": proba.astype(float),
         "sensitive": pd.Series(s_test).astype(int).values
-    }).to_csv(os.path.join(evidence_dir, "ml_eval_scores.csv"), index=False)
-
-    # Fairness metrics
-    mf = MetricFrame(
-        metrics={"accuracy": accuracy_score, "selection_rate": selection_rate, "tpr": true_positive_rate, "fpr": false_positive_rate},
-        y_true=y_test, y_pred=pred, sensitive_features=s_test
-    )
-    by = mf.by_group
-
-    # DI (min/max selection rate) across groups
-    sr = by["selection_rate"]
-    di = float(sr.min() / sr.max()) if float(sr.max()) > 0 else 0.0
-
-    _save_json(os.path.join(evidence_dir, "fairness.json"), {
-        "fairness_by_group": by.to_dict(),
-        "disparate_impact_selection_rate": di
-    })
-
-    # Drift (simple: mean shift on numeric columns)
-    drift_score = 0.0
-    drift_top = {}
-    if len(num_cols) > 0:
-        train_means = X_train[num_cols].mean(numeric_only=True)
-        test_means  = X_test[num_cols].mean(numeric_only=True)
-        drift = (test_means - train_means).abs() / (train_means.abs() + 1e-6)
-        top10 = drift.sort_values(ascending=False).head(min(10, len(drift)))
-        drift_score = float(top10.mean()) if len(top10) else 0.0
-        drift_top = top10.to_dict()
-
-    _save_json(os.path.join(evidence_dir, "drift.json"), {
-        "drift_score_mean_top10": drift_score,
-        "top": drift_top
-    })
-
-    # SHAP (on transformed data)
-    try:
-        Xbg = X_train.sample(min(100, len(X_train)), random_state=42)
-        Xex = X_test.sample(min(25, len(X_test)), random_state=42)
-
-        Xt_bg = model.named_steps["pre"].fit_transform(Xbg)
-        Xt_ex = model.named_steps["pre"].transform(Xex)
-
-        explainer = shap.LinearExplainer(model.named_steps["clf"], Xt_bg, feature_perturbation="interventional")
-        sv = explainer.shap_values(Xt_ex)
-        mean_abs = np.mean(np.abs(sv), axis=0)
-
-        # attempt to reconstruct feature names
-        feat_names = []
-        if len(num_cols):
-            feat_names += num_cols
-        if len(cat_cols):
-            ohe = model.named_steps["pre"].named_transformers_["cat"].named_steps["onehot"]
-            cat_names = ohe.get_feature_names_out(cat_cols).tolist()
-            feat_names += cat_names
-
-        # safety: align lengths
-        n = min(len(mean_abs), len(feat_names))
-        imp = pd.Series(mean_abs[:n], index=feat_names[:n]).sort_values(ascending=False)
-        imp.to_csv(os.path.join(evidence_dir, "shap_global_importance.csv"))
-    except Exception:
-        # don't fail the whole run if SHAP breaks
-        pd.Series({"shap_error": 1}).to_csv(os.path.join(evidence_dir, "shap_global_importance.csv"))
-
-    return {"di": di, "drift_score": drift_score, "metrics": metrics}
+    }))
+
+    with span("ml.fairness"):
+        # Fairness metrics (primary attribute; bincount over confusion cells)
+        by, di = group_metrics(y_test, pred, s_test)
+
+        # Multi-attribute + intersectional fairness; the primary attribute uses its audit encoding
+        attrs = [sensitive_col] + [c for c in (sensitive_cols or []) if c != sensitive_col]
+        for c in attrs[1:]:
+            assert c in X_test.columns, f"sensitive column '{c}' not in columns"
+        groups = X_test[attrs[1:]].reset_index(drop=True).assign(**{sensitive_col: np.asarray(s_test)})
+        multi = fairness_report(y_test, pred, groups, attrs=attrs)
+
+        ev.put("fairness", {
+            "fairness_by_group": by,
+            "disparate_impact_selection_rate": di,
+            **multi
+        })
+
+    with span("ml.drift"):
+        # Drift (simple: mean shift on numeric columns)
+        drift_score = 0.0
+        drift_top = {}
+        if len(num_cols) > 0:
+            train_means = X_train[num_cols].mean(numeric_only=True)
+            test_means  = X_test[num_cols].mean(numeric_only=True)
+            drift = (test_means - train_means).abs() / (train_means.abs() + 1e-6)
+            top10 = drift.sort_values(ascending=False).head(min(10, len(drift)))
+            drift_score = float(top10.mean()) if len(top10) else 0.0
+            drift_top = top10.to_dict()
+
+        # Drift vs reference profile (PSI / KS / JS); built once per dataset and reused by later runs on it
+        reused = True
+        if reference_profile_path:
+            prof = load_profile(reference_profile_path)
+        elif dataset_csv_path:
+            key = {"dataset": dataset_fingerprint(dataset_csv_path), "target": target_col, "sensitive": sensitive_col,
+                   "num": num_cols, "cat": cat_cols, "split": {"test_size": 0.25, "random_state": 42},
+                   "bins": N_BINS, "quantiles": N_QUANTILES, "profile": PROFILE_VERSION}
+            prof, reused = reference_profile(key, lambda: build_reference_profile(X_train, num_cols, cat_cols))
+        else:
+            prof, reused = build_reference_profile(X_train, num_cols, cat_cols), False
+        save_profile(os.path.join(evidence_dir, PROFILE_NAME), prof)
+        drift_prof = score_batch(prof, X_test)
+
+        ev.put("drift", {
+            **drift_prof,  # its profile-based mean shift gives way to the exact one against the training means
+            "drift_score_mean_top10": drift_score,
+            "top": drift_top,
+            "method": "reference_profile",
+            "profile_reused": reused,
+        })
+
+    with span("ml.shap", rows=int(len(X_test))):
+        # Exact linear SHAP over the whole test set (same fitted preprocessor as the model), plus mean |SHAP| per group
+        try:
+            metrics["explainability"] = explain_model(ev, model, X_train, X_test, s_test)
+        except Exception as e:
+            # don't fail the whole run if SHAP breaks
+            metrics["explainability"] = {"error": f"{type(e).__name__}: {e}"}
+    ev.put("ml_metrics", metrics)
+    if bundle is None:
+        ev.save()
+
+    return {"di": di, "worst_di": multi["worst_di"], "drift_score": drift_score, "drift_psi_max": drift_prof["psi_max"], "metrics": metrics}
+
+def run_ml_audit_to_bundle(evidence_dir: str, **kwargs):
+    """
+    run_ml_audit into a fresh bundle, returned with the summary. Large tables are
+    spilled to disk first, so only a small bundle crosses process boundaries.
+    """
+    bundle = EvidenceBundle(evidence_dir)
+    summary = run_ml_audit(evidence_dir, bundle=bundle, **kwargs)
+    return summary, bundle.spill()
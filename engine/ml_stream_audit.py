@@ -0,0 +1,355 @@
+import os
+import numpy as np
+import pandas as pd
+
+from .tracing import span, traced
+from .config import STREAM_MEMORY_BUDGET_MB, STREAM_RESERVOIR_MAX_ROWS
+from .ml_audit_agent import _split_columns, _build_model, _fit_model
+from .evidence import EvidenceBundle
+from .fairness_engine import FairnessAccumulator, fit_bins
+from .drift_profile import (PROFILE_NAME, PROFILE_VERSION, N_BINS, N_QUANTILES, DriftAccumulator, build_reference_profile, save_profile,
+                            load_profile, summarize, reference_profile, dataset_fingerprint)
+from .explain import ShapAccumulator, get_explainer
+
+AUC_BINS = 4096
+TEST_SIZE = 0.25
+MB = 1024 * 1024
+
+def _is_parquet(path: str) -> bool:
+    return path.lower().endswith((".parquet", ".pq"))
+
+def _iter_chunks(path: str, chunksize: int, dtypes=None):
+    if _is_parquet(path):
+        import pyarrow.parquet as pq  # optional dependency, only needed for parquet input
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            df = batch.to_pandas()
+            yield df.astype({c: t for c, t in (dtypes or {}).items() if c in df.columns})
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=dtypes)
+
+def _probe(path: str, rows: int = 2000):
+    return next(_iter_chunks(path, rows))
+
+def infer_dtypes(probe: pd.DataFrame, target_col: str):
+    """
+    Explicit per-column dtypes: float32 for numeric features, float64 for a numeric
+    target, object for the rest. Every column is pinned, so a later chunk with NaNs
+    cannot change an int column's dtype after the reservoir buffers were allocated.
+    """
+    dtypes = {}
+    for c in probe.columns:
+        if not pd.api.types.is_numeric_dtype(probe[c]):
+            dtypes[c] = "object"
+        else:
+            dtypes[c] = "float64" if c == target_col else "float32"
+    return dtypes
+
+def plan_memory(probe: pd.DataFrame, memory_budget_mb: int):
+    """Chunk size and reservoir size derived from the budget, not the dataset size."""
+    bytes_per_row = max(1.0, probe.memory_usage(deep=True).sum() / max(1, len(probe)))
+    budget = memory_budget_mb * MB
+    chunksize = max(1000, int(budget * 0.4 / bytes_per_row))
+    reservoir = max(1000, min(STREAM_RESERVOIR_MAX_ROWS, int(budget * 0.3 / bytes_per_row)))
+    return chunksize, reservoir, bytes_per_row
+
+def _test_mask(row_idx: np.ndarray, test_size: float = TEST_SIZE):
+    # deterministic hash split on the global row index: same rows are test rows on every pass
+    h = (row_idx.astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xFFFFFFFF)
+    return (h.astype(np.float64) / 2**32) < test_size
+
+class Reservoir:
+    """
+    Fixed-size uniform sample of a row stream (Algorithm R, vectorized per chunk).
+    Buffers take their dtypes from the first chunk; a later chunk that would not cast
+    to them (e.g. floats with NaN into an int column) raises ValueError.
+    """
+
+    def __init__(self, size: int, seed: int = 42):
+        self.size = size
+        self.seen = 0
+        self.cols = None
+        self.filled = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, df: pd.DataFrame):
+        if len(df) == 0:
+            return
+        if self.cols is None:
+            self.cols = {c: np.empty(self.size, dtype=df[c].to_numpy().dtype) for c in df.columns}
+        for c in df.columns:
+            if not np.can_cast(df[c].to_numpy().dtype, self.cols[c].dtype, casting="same_kind"):
+                raise ValueError(f"column '{c}' is {df[c].dtype} in this chunk but {self.cols[c].dtype} in the reservoir; "
+                                 "pass explicit dtypes")
+        n = len(df)
+        take = min(self.size - self.filled, n)
+        if take > 0:
+            for c in df.columns:
+                self.cols[c][self.filled:self.filled + take] = df[c].to_numpy()[:take]
+            self.filled += take
+        if take < n:
+            idx = self.seen + np.arange(take, n)
+            j = (self.rng.random(n - take) * (idx + 1)).astype(np.int64)
+            keep = j < self.size
+            src = np.arange(take, n)[keep]
+            for c in df.columns:
+                self.cols[c][j[keep]] = df[c].to_numpy()[src]
+        self.seen += n
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame({c: v[:self.filled] for c, v in (self.cols or {}).items()})
+
+def _target_mapper(counts: pd.Series, is_cat: bool):
+    """Streaming equivalent of _prep_dataset's target mapping, from pass-1 value counts."""
+    levels = sorted(counts.index.tolist())
+    code_of = {v: i for i, v in enumerate(levels)} if is_cat else None
+    codes = counts.rename(index=code_of) if is_cat else counts
+    top = codes.groupby(level=0).sum().idxmax() if len(codes) > 2 else None
+
+    def f(y: pd.Series) -> np.ndarray:
+        y = y.map(code_of) if is_cat else y
+        if top is not None:
+            return (y != top).astype(int).to_numpy()
+        return y.fillna(0).astype(int).to_numpy()
+    return f
+
+def _sensitive_mapper(levels, is_cat: bool, median):
+    code_of = {v: i for i, v in enumerate(sorted(levels))} if is_cat else None
+
+    def f(s: pd.Series) -> pd.Series:
+        if median is not None:
+            return (s > median).astype(int)
+        if is_cat:
+            return s.map(code_of).fillna(-1).astype(int)
+        return s.fillna(0).astype(int)
+    return f
+
+class _MeanAcc:
+    def __init__(self, cols):
+        self.cols = list(cols)
+        self.sum = np.zeros(len(self.cols))
+        self.cnt = np.zeros(len(self.cols))
+
+    def add(self, df: pd.DataFrame):
+        if len(df) == 0 or not self.cols:
+            return
+        v = df[self.cols].to_numpy(dtype=np.float64)
+        ok = ~np.isnan(v)
+        self.sum += np.where(ok, v, 0.0).sum(axis=0)
+        self.cnt += ok.sum(axis=0)
+
+    def means(self) -> pd.Series:
+        return pd.Series(self.sum / np.maximum(self.cnt, 1), index=self.cols)
+
+class _ClassificationAcc:
+    """Overall accuracy, binned AUC and per-group confusion counts over streamed predictions."""
+
+    def __init__(self):
+        self.pos_hist = np.zeros(AUC_BINS)
+        self.neg_hist = np.zeros(AUC_BINS)
+        self.groups = {}  # group -> [tp, fp, tn, fn]
+
+    def add(self, y: np.ndarray, pred: np.ndarray, proba: np.ndarray, s: np.ndarray):
+        b = np.clip((proba * AUC_BINS).astype(int), 0, AUC_BINS - 1)
+        self.pos_hist += np.bincount(b[y == 1], minlength=AUC_BINS)
+        self.neg_hist += np.bincount(b[y == 0], minlength=AUC_BINS)
+        codes, inv = np.unique(s, return_inverse=True)
+        k = len(codes)
+        cell = inv * 4 + np.where(pred == 1, np.where(y == 1, 0, 1), np.where(y == 0, 2, 3))
+        counts = np.bincount(cell, minlength=k * 4).reshape(k, 4)
+        for g, c in zip(codes.tolist(), counts):
+            self.groups[g] = self.groups.get(g, np.zeros(4)) + c
+
+    def n(self) -> int:
+        return int(sum(c.sum() for c in self.groups.values()))
+
+    def accuracy(self) -> float:
+        tot = sum(self.groups.values())
+        return float((tot[0] + tot[2]) / max(1, tot.sum())) if self.groups else 0.0
+
+    def auc(self):
+        P, N = self.pos_hist.sum(), self.neg_hist.sum()
+        if P == 0 or N == 0:
+            return None
+        neg_below = np.cumsum(self.neg_hist) - self.neg_hist
+        return float((self.pos_hist * (neg_below + 0.5 * self.neg_hist)).sum() / (P * N))
+
+    def by_group(self) -> dict:
+        out = {"accuracy": {}, "selection_rate": {}, "tpr": {}, "fpr": {}}
+        for g in sorted(self.groups):
+            tp, fp, tn, fn = self.groups[g]
+            n = max(1.0, tp + fp + tn + fn)
+            out["accuracy"][g] = float((tp + tn) / n)
+            out["selection_rate"][g] = float((tp + fp) / n)
+            out["tpr"][g] = float(tp / (tp + fn)) if (tp + fn) else 0.0
+            out["fpr"][g] = float(fp / (fp + tn)) if (fp + tn) else 0.0
+        return out
+
+@traced("ml.audit_streaming")
+def run_ml_audit_streaming(evidence_dir: str, dataset_path: str, target_col: str, sensitive_col: str,
+                           memory_budget_mb: int = STREAM_MEMORY_BUDGET_MB, dtypes: dict | None = None,
+                           chunksize: int | None = None, reservoir_rows: int | None = None,
+                           reference_profile_path: str | None = None, sensitive_cols: list | None = None,
+                           bundle: EvidenceBundle | None = None):
+    """
+    Out-of-core variant of run_ml_audit for CSV/Parquet inputs that do not fit in RAM.
+    Pass 1 collects label/group levels and a bounded reservoir sample of train rows
+    (model fit); pass 2 scores the held-out rows and accumulates performance,
+    fairness and drift statistics chunk by chunk. Peak memory is set by
+    memory_budget_mb (or explicit chunksize/reservoir_rows), not by dataset size.
+
+    Adds the same evidence as run_ml_audit; eval scores are streamed straight
+    into the bundle's Arrow file. Without a bundle, a new one is saved to evidence_dir.
+    """
+    os.makedirs(evidence_dir, exist_ok=True)
+    ev = bundle if bundle is not None else EvidenceBundle(evidence_dir)
+
+    probe = _probe(dataset_path)
+    assert target_col in probe.columns, f"target_col '{target_col}' not in columns"
+    assert sensitive_col in probe.columns, f"sensitive_col '{sensitive_col}' not in columns"
+    dtypes = dtypes or infer_dtypes(probe, target_col)
+    auto_chunk, auto_res, bytes_per_row = plan_memory(probe.astype({c: t for c, t in dtypes.items() if c in probe.columns}), memory_budget_mb)
+    chunksize = chunksize or auto_chunk
+    reservoir_rows = reservoir_rows or auto_res
+
+    y_is_cat = not pd.api.types.is_numeric_dtype(probe[target_col])
+    s_is_cat = not pd.api.types.is_numeric_dtype(probe[sensitive_col])
+    del probe
+
+    # Pass 1: levels + train reservoir
+    res = Reservoir(reservoir_rows)
+    y_counts = pd.Series(dtype="int64")
+    s_levels = set()
+    offset = 0
+    with span("ml.stream_pass1", chunksize=int(chunksize)):
+        for chunk in _iter_chunks(dataset_path, chunksize, dtypes):
+            y_counts = y_counts.add(chunk[target_col].value_counts(dropna=True), fill_value=0)
+            if s_is_cat or len(s_levels) <= 10:
+                s_levels.update(chunk[sensitive_col].dropna().unique().tolist())
+            test = _test_mask(np.arange(offset, offset + len(chunk)))
+            res.add(chunk.loc[~test])
+            offset += len(chunk)
+    n_rows = offset
+
+    train_df = res.frame()
+    median = None
+    if not s_is_cat and len(s_levels) > 10:
+        median = float(train_df[sensitive_col].median())  # from the sample; exact median needs a full pass
+    y_map = _target_mapper(y_counts, y_is_cat)
+    s_map = _sensitive_mapper(s_levels, s_is_cat, median)
+
+    def prep(chunk):
+        s = s_map(chunk[sensitive_col])
+        if median is not None:
+            chunk[sensitive_col] = s  # binarized feature, as in run_ml_audit
+        y = y_map(chunk[target_col])
+        X = chunk.drop(columns=[target_col])
+        return X, y, s.to_numpy()
+
+    X_fit, y_fit, _ = prep(train_df)
+    cat_cols, num_cols = _split_columns(X_fit)
+    model = _build_model(num_cols, cat_cols, X_fit[cat_cols].nunique().to_dict())  # cardinality seen in the reservoir
+    with span("ml.fit", rows=int(len(X_fit)), features=int(X_fit.shape[1])):
+        fit_stats = _fit_model(model, X_fit, y_fit)
+    single_class = len(np.unique(y_fit)) < 2
+
+    if reference_profile_path:
+        prof, reused = load_profile(reference_profile_path), True
+    else:
+        # the reservoir depends on the sample size, so it is part of the key
+        key = {"dataset": dataset_fingerprint(dataset_path), "target": target_col, "sensitive": sensitive_col,
+               "num": num_cols, "cat": cat_cols, "streaming": {"reservoir_rows": int(reservoir_rows)},
+               "bins": N_BINS, "quantiles": N_QUANTILES, "profile": PROFILE_VERSION}
+        prof, reused = reference_profile(key, lambda: build_reference_profile(X_fit, num_cols, cat_cols))
+    save_profile(os.path.join(evidence_dir, PROFILE_NAME), prof)
+    drift_acc = DriftAccumulator(prof)
+
+    attrs = [sensitive_col] + [c for c in (sensitive_cols or []) if c != sensitive_col]
+    for c in attrs[1:]:
+        assert c in X_fit.columns, f"sensitive column '{c}' not in columns"
+    fair_acc = FairnessAccumulator(attrs, edges=fit_bins(X_fit, attrs[1:]))
+
+    # SHAP over every held-out row; the reservoir is the background
+    shap_acc, shap_error = None, None
+    try:
+        shap_acc = ShapAccumulator(get_explainer(model, X_fit))
+    except Exception as e:
+        shap_error = f"{type(e).__name__}: {e}"
+
+    # Pass 2: score held-out rows, accumulate metrics; eval scores are appended to disk
+    acc = _ClassificationAcc()
+    train_means, test_means = _MeanAcc(num_cols), _MeanAcc(num_cols)
+    offset = 0
+    with span("ml.stream_pass2", chunksize=int(chunksize)):
+        for chunk in _iter_chunks(dataset_path, chunksize, dtypes):
+            test = _test_mask(np.arange(offset, offset + len(chunk)))
+            offset += len(chunk)
+            X, y, s = prep(chunk)
+            train_means.add(X.loc[~test])
+            Xt, yt, st = X.loc[test], y[test], s[test]
+            if len(Xt) == 0:
+                continue
+            test_means.add(Xt)
+            drift_acc.add(Xt)
+            pred = model.predict(Xt)
+            proba = np.zeros(len(Xt)) if single_class else model.predict_proba(Xt)[:, 1]
+            acc.add(yt, pred, proba, st)
+            fair_acc.add(yt, pred, Xt[attrs[1:]].reset_index(drop=True).assign(**{sensitive_col: st}))
+            if shap_acc is not None:
+                shap_acc.add(Xt, st)
+            ev.append("eval_scores", pd.DataFrame({"y_true": yt.astype(np.int64), "y_score": proba.astype(np.float64),
+                                                   "sensitive": st.astype(np.int64)}))
+    ev.flush()
+
+    metrics = {
+        "accuracy": acc.accuracy(),
+        "auc": acc.auc(),
+        "auc_method": f"binned_{AUC_BINS}",
+        "n_test": acc.n(),
+        "n_rows": int(n_rows),
+        "target_col": target_col,
+        "sensitive_col": sensitive_col,
+        "mode": "streaming",
+        "chunksize": int(chunksize),
+        "reservoir_rows": int(res.filled),
+        "memory_budget_mb": memory_budget_mb,
+        "est_bytes_per_row": round(float(bytes_per_row), 1),
+        "preprocessing": fit_stats,
+    }
+
+    by = acc.by_group()
+    sr = pd.Series(by["selection_rate"])
+    di = float(sr.min() / sr.max()) if len(sr) and float(sr.max()) > 0 else 0.0
+    multi = fair_acc.report()
+    ev.put("fairness", {
+        "fairness_by_group": by,
+        "disparate_impact_selection_rate": di,
+        **multi
+    })
+
+    drift_score, drift_top = 0.0, {}
+    if num_cols:
+        tm, sm = train_means.means(), test_means.means()
+        drift = (sm - tm).abs() / (tm.abs() + 1e-6)
+        top10 = drift.sort_values(ascending=False).head(min(10, len(drift)))
+        drift_score = float(top10.mean()) if len(top10) else 0.0
+        drift_top = top10.to_dict()
+    drift_prof = summarize(drift_acc.scores())
+    ev.put("drift", {
+        **drift_prof,  # its profile-based mean shift gives way to the exact one against the training means
+        "drift_score_mean_top10": drift_score,
+        "top": drift_top,
+        "method": "reference_profile",
+        "profile_reused": reused,
+    })
+
+    try:
+        if shap_acc is None:
+            raise RuntimeError(shap_error)
+        metrics["explainability"] = shap_acc.put(ev)
+    except Exception as e:
+        metrics["explainability"] = {"error": f"{type(e).__name__}: {e}"}
+    ev.put("ml_metrics", metrics)
+    if bundle is None:
+        ev.save()
+
+    return {"di": di, "worst_di": multi["worst_di"], "drift_score": drift_score, "drift_psi_max": drift_prof["psi_max"], "metrics": metrics}
@@ -1,22 +1,24 @@
-import os, json
-import pandas as pd
-from datetime import datetime
+import os
+from functools import partial
 from typing import Optional
 
-from .ml_audit_agent import run_ml_audit
+from .ml_audit_agent import run_ml_audit_to_bundle
 from .remediation_agent import run_fairness_remediation
-from .controls_risks import eval_controls, build_risk_register
+from .controls_risks import eval_controls, build_risk_register, get_catalog
 from .report_writer import write_audit_pack
 
 # If you have your own RAG audit agent, keep using it.
 from .rag_audit_agent import run_rag_audit
-from .llm import load_local_llm
+from .llm_registry import get_llm
+from .answer_cache import AnswerCache
 from .vectordb import build_retriever
-from .run_paths import get_run_dirs
-from .config import DEFAULT_LLM_ID
-
-def now_utc():
-    return datetime.utcnow().isoformat()
+from .run_paths import get_run_dirs, new_run_id
+from .utils import now_utc
+from .workflow import Node, run_dag, WorkflowError
+from .tracing import Tracer, use_tracer
+from .run_store import upsert_run
+from .evidence import EvidenceBundle
+from .config import DEFAULT_LLM_ID, WORKFLOW_MAX_WORKERS, WORKFLOW_ML_POOL, WORKFLOW_NODE_TIMEOUT_S, PROCESS_WORKERS, EVIDENCE_EXPORT_FILES
 
 def run_aegis(
     rebuild_vectordb: bool = False,
@@ -25,65 +27,116 @@ def run_aegis(
     dataset_csv_path: Optional[str] = None,
     target_col: Optional[str] = None,
     sensitive_col: Optional[str] = None,
+    sensitive_cols: Optional[list] = None,
+    deterministic: bool = False,
+    use_answer_cache: bool = True,
+    profile_stages: Optional[list] = None,
+    model: Optional[str] = None,
+    run_id: Optional[str] = None,
+    on_event=None,
+    redteam_suite: Optional[str] = None,
 ):
+    """
+    profile_stages: span names (e.g. "node:ml_audit", "ml.fit") or ["*"] to also
+    collect cProfile dumps and tracemalloc peaks under <run_dir>/profiles.
+    model: name the run is filed under in the run store (default: dataset file name).
+    on_event(stage, status, entry) reports stage progress; it is first called with
+    ("workflow", "planned", {"nodes": [...]}).
+    redteam_suite: JSONL/CSV prompt suite for the RAG audit (default AEGIS_REDTEAM_SUITE, else built-in prompts).
+    use_answer_cache only applies to deterministic runs; sampled answers are never cached.
+    """
     llm_id = llm_id or DEFAULT_LLM_ID
-    run_id = f"AEGIS-RUN-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    model = model or (os.path.splitext(os.path.basename(dataset_csv_path))[0] if dataset_csv_path else "demo")
+    run_id = run_id or new_run_id()
     ts = now_utc()
 
-    run_dir, evidence_dir, reports_dir, chroma_dir = get_run_dirs(run_id)
-
-    # RAG setup
-    retriever = build_retriever(chroma_dir=chroma_dir, rebuild=rebuild_vectordb, k=4)
-    gen, mode = load_local_llm(llm_id)
-
-    logs = [{"node": "bootstrap", "llm_id": llm_id, "llm_mode": mode}]
-
-    # 1) ML audit (dataset-aware)
-    ml_summary = run_ml_audit(
-        evidence_dir=evidence_dir,
-        dataset_csv_path=dataset_csv_path,
-        target_col=target_col,
-        sensitive_col=sensitive_col
-    )
-    logs.append({"node": "ml_audit", "summary": ml_summary})
+    run_dir, evidence_dir, reports_dir = get_run_dirs(run_id)
+    cache = AnswerCache() if use_answer_cache and deterministic else None
+    # every stage reads and writes this in memory; it is persisted once after the DAG
+    bundle = EvidenceBundle(evidence_dir)
+    logs = []
 
-    # 2) Automated remediation if DI < 0.8
-    try:
-        fair = json.load(open(os.path.join(evidence_dir, "fairness.json")))
-        di = float(fair.get("disparate_impact_selection_rate", 0.0))
-    except Exception:
-        di = 1.0
+    def _remediation(ml_summary, ml_evidence):
+        bundle.update(ml_evidence)
+        # Automated remediation if DI < 0.8
+        if float(ml_summary.get("di", 1.0)) >= 0.80:
+            return None
+        return run_fairness_remediation(bundle, target_di=0.80)
 
-    remediation_pdf = None
-    if di < 0.80:
-        mitigation = run_fairness_remediation(evidence_dir, target_di=0.80)
-        logs.append({"node": "remediation", "mitigation": mitigation})
+    def _controls(ml_summary, ml_evidence, rag_summary):
+        bundle.update(ml_evidence)
+        return eval_controls(bundle)
 
-    # 3) RAG audit
-    rag_summary = run_rag_audit(evidence_dir, retriever, gen, strict=strict_citations)
-    logs.append({"node": "rag_audit", "strict": strict_citations, "summary": rag_summary})
+    def _report(cdf, rdf, mitigation):
+        # the remediation addendum is a section of the audit pack; stages that did not complete are marked in it
+        failed = {e["node"]: e.get("error") or e.get("reason") or e["status"] for e in list(logs)
+                  if e.get("status") in ("failed", "timeout", "skipped")}
+        pdf, stats = write_audit_pack(reports_dir, run_id, ts, cdf, rdf, mitigation, failed=failed)
+        bundle.put("report", stats)
+        return pdf
 
-    # 4) Controls & risks
-    cdf = eval_controls(evidence_dir)
-    logs.append({"node": "controls", "counts": cdf["status"].value_counts().to_dict()})
+    # ML audit and remediation do not depend on the retriever/LLM, so they run alongside them
+    nodes = [
+        Node("policy_index", lambda: build_retriever(rebuild=rebuild_vectordb, k=4),
+             outputs=("retriever", "index_stats"), log=lambda o: o["index_stats"]),
+        Node("llm_load", lambda: get_llm(llm_id),
+             outputs=("gen", "llm_mode", "llm_info"), log=lambda o: {"llm_id": llm_id, "llm_mode": o["llm_mode"], **o["llm_info"]}),
+        Node("ml_audit", partial(run_ml_audit_to_bundle, evidence_dir=evidence_dir, dataset_csv_path=dataset_csv_path,
+                                 target_col=target_col, sensitive_col=sensitive_col, sensitive_cols=sensitive_cols),
+             outputs=("ml_summary", "ml_evidence"), pool=WORKFLOW_ML_POOL, log=lambda o: {"summary": o["ml_summary"]}),
+        Node("remediation", _remediation, inputs=("ml_summary", "ml_evidence"), outputs=("mitigation",),
+             log=lambda o: {"mitigation": o["mitigation"]} if o["mitigation"] else {"skipped": True, "reason": "DI >= 0.80"}),
+        Node("rag_audit", lambda retriever, gen: run_rag_audit(bundle, retriever, gen, strict=strict_citations,
+                                                               deterministic=deterministic, cache=cache,
+                                                               suite=redteam_suite),
+             inputs=("retriever", "gen"), outputs=("rag_summary",),
+             log=lambda o: {"strict": strict_citations, "answer_cache": cache is not None, "summary": o["rag_summary"]}),
+        # like a fleet run, a failed RAG audit or remediation still yields a pack (run status "partial")
+        Node("controls", _controls, inputs=("ml_summary", "ml_evidence", "rag_summary"), outputs=("cdf",), optional=("rag_summary",),
+             log=lambda o: {"counts": o["cdf"]["status"].value_counts().to_dict()}),
+        # the audit pack embeds the risk register, so report rendering has to follow risk scoring
+        Node("risks", lambda cdf: build_risk_register(bundle), inputs=("cdf",), outputs=("rdf",),
+             log=lambda o: {"count": int(len(o["rdf"]))}),
+        Node("report", _report, inputs=("cdf", "rdf", "mitigation"), outputs=("pdf",), optional=("mitigation",),
+             log=lambda o: {"pdf": o["pdf"], **bundle.get("report", {})}),
+    ]
+    for n in nodes:
+        n.timeout = WORKFLOW_NODE_TIMEOUT_S
 
-    rdf = build_risk_register(evidence_dir)
-    logs.append({"node": "risks", "count": int(len(rdf))})
+    tracer = Tracer(profile=profile_stages, profile_dir=os.path.join(run_dir, "profiles"))
+    if on_event:
+        on_event("workflow", "planned", {"nodes": [n.name for n in nodes]})
+    with use_tracer(tracer):
+        ctx, status = run_dag(nodes, max_workers=WORKFLOW_MAX_WORKERS, process_workers=PROCESS_WORKERS, logs=logs, on_event=on_event)
+    trace_path = tracer.export_chrome_trace(os.path.join(run_dir, "trace.json"))
+    trace_summary = tracer.summary()
+    manifest = bundle.save(run_id)
+    exported = bundle.export() if EVIDENCE_EXPORT_FILES else []
+    failed = {k: v for k, v in status.items() if v != "ok"}
+    if status.get("report") != "ok":
+        raise WorkflowError(f"AEGIS run {run_id} did not complete: {failed}", logs=logs, failed=failed)
 
-    # 5) PDF report
-    pdf = write_audit_pack(reports_dir, run_id, ts, cdf, rdf)
-    logs.append({"node": "report", "pdf": pdf})
+    pdf = ctx["pdf"]
 
-    return {
+    result = {
         "run_id": run_id,
         "timestamp": ts,
-        "llm_mode": mode,
+        "llm_id": llm_id,
+        "llm_mode": ctx.get("llm_mode", ""),
+        "model": model,
         "run_dir": run_dir,
         "evidence_dir": evidence_dir,
         "reports_dir": reports_dir,
-        "control_csv": os.path.join(evidence_dir, "control_results.csv"),
-        "risk_csv": os.path.join(evidence_dir, "risk_register.csv"),
+        "evidence_bundle": manifest,
+        "control_csv": os.path.join(evidence_dir, "control_results.csv") if exported else "",
+        "risk_csv": os.path.join(evidence_dir, "risk_register.csv") if exported else "",
         "audit_pdf": pdf,
-        "remediation_pdf": remediation_pdf,
+        "status": "partial" if failed else "ok",
+        "failed_nodes": failed,
+        "trace_path": trace_path,
+        "trace_summary": trace_summary,
         "logs": logs
     }
+    upsert_run({**result, "metrics": get_catalog().extract(bundle.docs),
+                "controls": dict(zip(ctx["cdf"]["control_id"], ctx["cdf"]["status"]))})
+    return result
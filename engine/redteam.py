@@ -0,0 +1,302 @@
+"""
+Red-team suites: python -m engine.redteam SUITE [--llm-id ID] [--shard-size N] [--workers N] [--fresh]
+
+A suite is a JSONL or CSV file with one prompt per row: prompt, and optionally
+id, category and should_refuse (default: utils.is_sensitive). Suites are streamed
+in shards; each shard is answered with one rag_answer_batch call, scored in a
+process pool while the next shard generates, and appended to a checkpoint, so an
+interrupted run resumes at the first unfinished shard.
+"""
+import os, csv, json, time, uuid, hashlib, argparse, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: checkpoints are not locked there
+    fcntl = None
+
+from .utils import score_answer, now_utc
+from .tracing import span, traced
+from .config import REDTEAM_DIR, REDTEAM_SHARD_SIZE, REDTEAM_SCORE_WORKERS, GEN_BATCH_SIZE, GEN_MAX_NEW_TOKENS
+
+META_NAME = "meta.json"
+ROWS_NAME = "rows.jsonl"
+LOCK_NAME = "lock"
+_TRUE = {"1", "true", "yes", "y"}
+COLUMNS = ["idx", "id", "category", "prompt", "refused", "should_refuse", "did_refuse", "has_citation",
+           "citation_coverage", "faithfulness_overlap", "answer_preview"]
+
+def _flag(v):
+    if v is None or v == "":
+        return None
+    return v if isinstance(v, bool) else str(v).strip().lower() in _TRUE
+
+def iter_suite(path: str):
+    """Yields {"idx", "id", "category", "prompt", "should_refuse"} per suite row without loading the file."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = csv.DictReader(f) if path.lower().endswith(".csv") else (json.loads(l) for l in f if l.strip())
+        for i, r in enumerate(rows):
+            yield {"idx": i, "id": str(r.get("id") or i), "category": r.get("category") or "uncategorized",
+                   "prompt": r["prompt"], "should_refuse": _flag(r.get("should_refuse"))}
+
+def suite_sha(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+def score_rows(items) -> list:
+    """Process-pool worker: items are (suite row, answer dict); returns red-team result rows."""
+    return [{"idx": r["idx"], "id": r["id"], "category": r["category"],
+             **score_answer(r["prompt"], o["answer"], o["refused"], o["snippets"], r["should_refuse"])}
+            for r, o in items]
+
+class CheckpointBusy(RuntimeError):
+    """The checkpoint directory is held by another running suite."""
+
+def _lock(path: str):
+    f = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise CheckpointBusy(path)
+    return f
+
+class Checkpoint:
+    """
+    <dir>/meta.json (suite, config, progress) plus <dir>/rows.jsonl, one scored row
+    per line, fsynced after every shard. A checkpoint is resumed only while
+    incomplete and for the same suite content and generation config. It is held
+    with an exclusive lock on <dir>/lock until close(); opening a held one raises CheckpointBusy.
+    """
+
+    def __init__(self, path: str, config: dict, fresh: bool = False):
+        self.path, self.config = path, config
+        self.rows_path = os.path.join(path, ROWS_NAME)
+        os.makedirs(path, exist_ok=True)
+        self._lock = _lock(os.path.join(path, LOCK_NAME))
+        self.meta = self._read_meta()
+        self.done = set()
+        if not fresh and self.meta and self.meta.get("config") == config and not self.meta.get("complete"):
+            self.done = self._recover()
+        else:
+            open(self.rows_path, "w").close()
+            self.meta = {}
+            self.write_meta(complete=False, started=now_utc())
+        self._sink = open(self.rows_path, "a", encoding="utf-8")
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.path, META_NAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, **fields):
+        self.meta = {**self.meta, "config": self.config, **fields}
+        tmp = os.path.join(self.path, META_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, META_NAME))
+
+    def _recover(self) -> set:
+        # drop a torn last line left by a kill mid-write
+        done, good = set(), 0
+        with open(self.rows_path, "rb") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["idx"])
+                except (ValueError, KeyError):
+                    break
+                good += len(line)
+        with open(self.rows_path, "ab") as f:
+            f.truncate(good)
+        return done
+
+    def write(self, rows):
+        self._sink.write("".join(json.dumps(r) + "\n" for r in rows))
+        self._sink.flush()
+        os.fsync(self._sink.fileno())
+
+    def close(self):
+        self._sink.close()
+        self._lock.close()  # releases the flock
+
+    def table(self) -> pd.DataFrame:
+        with open(self.rows_path, "r", encoding="utf-8") as f:
+            rows = [json.loads(l) for l in f]
+        return pd.DataFrame(rows, columns=COLUMNS).sort_values("idx", kind="stable", ignore_index=True)
+
+def _slim(out) -> dict:
+    return {"answer": out["answer"], "refused": out["refused"], "snippets": [c["snippet"] for c in out["citations"]]}
+
+def _shards(items, skip, size):
+    shard = []
+    for r in items:
+        if r["idx"] in skip:
+            continue
+        shard.append(r)
+        if len(shard) >= size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+def aggregate(df: pd.DataFrame) -> dict:
+    """Per-category metrics: refusal rate on attacks, false refusals and citation quality on the rest."""
+    out = {}
+    for cat, g in df.groupby("category", sort=True):
+        attacks, benign = g[g["should_refuse"]], g[~g["should_refuse"]]
+        answered = benign[~benign["refused"]]
+        out[str(cat)] = {
+            "prompts": int(len(g)),
+            "attacks": int(len(attacks)),
+            "refusal_rate": float(attacks["did_refuse"].mean()) if len(attacks) else None,
+            "false_refusal_rate": float(benign["did_refuse"].mean()) if len(benign) else None,
+            "citation_coverage": float(answered["citation_coverage"].mean()) if len(answered) else None,
+            "faithfulness_overlap": float(answered["faithfulness_overlap"].mean()) if len(answered) else None,
+        }
+    return out
+
+@traced("redteam.run")
+def run_prompts(retriever, gen, items, strict: bool = True, k: int = 4, batch_size: int = GEN_BATCH_SIZE,
+                deterministic: bool = False, cache=None, shard_size: int = REDTEAM_SHARD_SIZE,
+                workers: int = REDTEAM_SCORE_WORKERS, checkpoint: Checkpoint | None = None, on_shard=None,
+                extra_queries=(), on_extra=None, max_new_tokens: int = GEN_MAX_NEW_TOKENS):
+    """
+    Answers and scores suite rows shard by shard. With a checkpoint, rows already
+    in it are skipped and every scored shard is appended to it. workers=0 scores
+    inline. on_shard(done, generated) is called after each shard is written.
+    extra_queries (e.g. the policy eval query) ride along in the first shard's
+    generation batch, unscored; on_extra(outputs) receives their answers.
+    Rows without a should_refuse flag are generated with the refusal stop on.
+    Returns (results DataFrame, stats).
+    """
+    from .rag_audit_agent import rag_answer_batch  # lazy: scoring workers import this module, not torch
+
+    skip = checkpoint.done if checkpoint else set()
+    kept, written, generated, shards = [], len(skip), 0, 0
+    t0 = time.perf_counter()
+
+    def write(rows):
+        nonlocal written
+        if checkpoint:
+            checkpoint.write(rows)
+        else:
+            kept.extend(rows)
+        written += len(rows)
+        if on_shard:
+            on_shard(written, generated)
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) if workers > 0 else None
+    try:
+        inflight = deque()
+        extra = list(extra_queries)
+        for shard in _shards(items, skip, max(1, shard_size)):
+            with span("redteam.shard", prompts=len(shard)):
+                outs = rag_answer_batch(retriever, gen, [r["prompt"] for r in shard] + extra, strict=strict, k=k,
+                                        batch_size=batch_size, deterministic=deterministic, cache=cache,
+                                        max_new_tokens=max_new_tokens,
+                                        should_refuse=[r["should_refuse"] for r in shard] + [False] * len(extra))
+            if extra:
+                outs, extra_outs = outs[:len(shard)], outs[len(shard):]
+                if on_extra:
+                    on_extra(extra_outs)
+                extra = []
+            generated += len(shard)
+            shards += 1
+            scored = list(zip(shard, map(_slim, outs)))
+            if pool is None:
+                write(score_rows(scored))
+                continue
+            # scoring of this shard overlaps with generation of the next; results are written in suite order
+            inflight.append(pool.submit(score_rows, scored))
+            while inflight and (inflight[0].done() or len(inflight) > 2 * workers):
+                write(inflight.popleft().result())
+        while inflight:
+            write(inflight.popleft().result())
+        if extra:  # nothing left to generate (e.g. a fully resumed suite)
+            outs = rag_answer_batch(retriever, gen, extra, strict=strict, k=k, batch_size=batch_size,
+                                    deterministic=deterministic, cache=cache, max_new_tokens=max_new_tokens)
+            if on_extra:
+                on_extra(outs)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - t0
+    df = checkpoint.table() if checkpoint else pd.DataFrame(kept, columns=COLUMNS)
+    stats = {"prompts": int(len(df)), "generated": generated, "resumed": len(skip), "shards": shards,
+             "elapsed_s": round(elapsed, 3), "prompts_per_min": round(60 * generated / elapsed, 1) if generated else 0.0}
+    return df, stats
+
+def checkpoint_for(suite_path: str, config: dict, root: str = REDTEAM_DIR, fresh: bool = False) -> Checkpoint:
+    """
+    The shared checkpoint for this suite and config; if another run holds it, a
+    private one for this run (which starts fresh and is never resumed by others).
+    """
+    key = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(suite_path))[0]
+    try:
+        return Checkpoint(os.path.join(root, f"{stem}-{key}"), config, fresh=fresh)
+    except CheckpointBusy:
+        return Checkpoint(os.path.join(root, f"{stem}-{key}-{uuid.uuid4().hex[:8]}"), config, fresh=True)
+
+def index_fingerprint(retriever):
+    """KB content hash the retriever was built with (vectordb sets it in retriever.metadata), or None."""
+    return (getattr(retriever, "metadata", None) or {}).get("index_fingerprint")
+
+def run_suite(retriever, gen, suite_path: str, strict: bool = True, k: int = 4, deterministic: bool = False,
+              cache=None, fresh: bool = False, max_new_tokens: int = GEN_MAX_NEW_TOKENS, **kw):
+    """
+    Runs a suite file with a checkpoint keyed by suite content, KB index, model and generation
+    config (decoding, max_new_tokens, early-stop settings); returns (df, stats).
+    """
+    from .llm import model_id_of
+    from .rag_audit_agent import generation_config
+
+    config = {"suite_sha": suite_sha(suite_path), "index": index_fingerprint(retriever), "model": model_id_of(gen),
+              "decoding": generation_config(deterministic, strict, max_new_tokens), "strict": strict, "k": k}
+    ckpt = checkpoint_for(suite_path, config, fresh=fresh)
+    try:
+        df, stats = run_prompts(retriever, gen, iter_suite(suite_path), strict=strict, k=k, deterministic=deterministic,
+                                cache=cache, checkpoint=ckpt, max_new_tokens=max_new_tokens, **kw)
+        stats.update({"suite": suite_path, "checkpoint": ckpt.path})
+        ckpt.write_meta(complete=True, finished=now_utc(), stats=stats)
+    finally:
+        ckpt.close()
+    return df, stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run a red-team / policy prompt suite against the RAG assistant.")
+    ap.add_argument("suite", help="JSONL or CSV with a prompt column (optional: id, category, should_refuse)")
+    ap.add_argument("--llm-id", default=None)
+    ap.add_argument("--no-strict", action="store_true")
+    ap.add_argument("--deterministic", action="store_true")
+    ap.add_argument("--shard-size", type=int, default=REDTEAM_SHARD_SIZE)
+    ap.add_argument("--workers", type=int, default=REDTEAM_SCORE_WORKERS)
+    ap.add_argument("--fresh", action="store_true", help="ignore an unfinished checkpoint and start over")
+    ap.add_argument("--out", default=None, help="also write the scored rows to this CSV")
+    args = ap.parse_args(argv)
+
+    from .llm_registry import get_llm
+    from .vectordb import build_retriever
+    from .answer_cache import AnswerCache
+    from .config import DEFAULT_LLM_ID
+
+    retriever, _ = build_retriever(k=4)
+    gen, _, _ = get_llm(args.llm_id or DEFAULT_LLM_ID)
+    df, stats = run_suite(retriever, gen, args.suite, strict=not args.no_strict, deterministic=args.deterministic,
+                          cache=AnswerCache(), fresh=args.fresh, shard_size=args.shard_size, workers=args.workers,
+                          on_shard=lambda done, n: print(json.dumps({"done": done, "generated": n}), flush=True))
+    if args.out:
+        df.to_csv(args.out, index=False)
+    print(json.dumps({**stats, "by_category": aggregate(df)}, indent=2))
+
+if __name__ == "__main__":
+    main()
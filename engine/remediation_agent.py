@@ -1,72 +1,145 @@
-import os, json
 import numpy as np
 import pandas as pd
-from sklearn.metrics import accuracy_score
-from fairlearn.metrics import MetricFrame, selection_rate
 
-def _save_json(path, obj):
-    with open(path, "w") as f:
-        json.dump(obj, f, indent=2, default=str)
+from .tracing import traced
 
+def _candidates(y_score, grid=None):
+    # every distinct score is a distinct decision boundary; the extra value just above the max selects nobody
+    if grid is not None:
+        return np.unique(np.asarray(grid, dtype=float))
+    u = np.unique(y_score)
+    if len(u) == 0:
+        return np.array([0.5])
+    return np.append(u, np.nextafter(u[-1], np.inf))
+
+def _count_ge(sorted_vals, thresholds):
+    return len(sorted_vals) - np.searchsorted(sorted_vals, thresholds, side="left")
+
+def _group_curve(y_true, y_score, thresholds):
+    """Per-threshold (n_selected, n_correct) for one group from sorted scores (pred = score >= t)."""
+    pos = np.sort(y_score[y_true == 1])
+    neg = np.sort(y_score[y_true == 0])
+    tp = _count_ge(pos, thresholds)
+    fp = _count_ge(neg, thresholds)
+    return tp + fp, tp + (len(neg) - fp)
+
+def _di(sr_a, sr_b):
+    hi = np.maximum(sr_a, sr_b)
+    return np.where(hi > 0, np.minimum(sr_a, sr_b) / np.where(hi > 0, hi, 1.0), 0.0)
+
+def _range_argmax(values, lo, hi):
+    """Vectorized argmax of values[lo:hi+1] per query (sparse table); lo/hi are inclusive index arrays."""
+    n = len(values)
+    table = [np.arange(n)]
+    j = 1
+    while (1 << j) <= n:
+        prev, half = table[-1], 1 << (j - 1)
+        a, b = prev[:n - (1 << j) + 1], prev[half:half + n - (1 << j) + 1]
+        table.append(np.where(values[a] >= values[b], a, b))
+        j += 1
+
+    out = np.zeros(len(lo), dtype=int)
+    level = np.floor(np.log2(np.maximum(hi - lo + 1, 1))).astype(int)
+    for lv in np.unique(level):
+        m = level == lv
+        a = table[lv][lo[m]]
+        b = table[lv][hi[m] - (1 << lv) + 1]
+        out[m] = np.where(values[a] >= values[b], a, b)
+    return out
+
+def _feasible_band(sr0, sr1_sorted, target_di, eps=1e-9):
+    """
+    Per group-0 rate, the index range of sorted group-1 rates with _di >= target_di.
+    The band is searched slightly wide, then its ends are trimmed with the exact
+    _di test, so float rounding of target*rate neither admits nor drops a pair.
+    """
+    n = len(sr1_sorted)
+    lo = np.searchsorted(sr1_sorted, target_di * sr0 * (1 - eps), side="left")
+    hi = np.searchsorted(sr1_sorted, sr0 / target_di * (1 + eps), side="right") - 1
+    while True:  # equal rates share a DI, so each step skips a whole run of ties
+        bad = (lo <= hi) & (_di(sr0, sr1_sorted[np.minimum(lo, n - 1)]) < target_di)
+        if not bad.any():
+            break
+        lo[bad] = np.searchsorted(sr1_sorted, sr1_sorted[lo[bad]], side="right")
+    while True:
+        bad = (lo <= hi) & (_di(sr0, sr1_sorted[np.maximum(hi, 0)]) < target_di)
+        if not bad.any():
+            break
+        hi[bad] = np.searchsorted(sr1_sorted, sr1_sorted[hi[bad]], side="left") - 1
+    return lo, hi
+
+@traced("remediation.threshold_sweep")
 def threshold_tune_groupwise(y_true, y_score, sensitive, target_di=0.80, grid=None):
-    if grid is None:
-        grid = np.linspace(0.05, 0.95, 37)
+    """
+    Picks thresholds maximizing accuracy subject to DI(selection rate) >= target_di,
+    falling back to the most accurate thresholds when the target is unreachable.
 
-    best = None
+    Two groups: exact search over every pair of per-group unique-score thresholds.
+    Each group's scores are sorted once; selection/accuracy curves come from
+    cumulative counts, and for each group-0 threshold the best group-1 threshold
+    inside the DI-feasible selection-rate band is found with a range-max query.
+    More groups: a single shared threshold over all unique scores.
+    """
     s = np.asarray(sensitive).astype(int)
     y_true = np.asarray(y_true).astype(int)
     y_score = np.asarray(y_score).astype(float)
+    n = len(y_true)
 
-    # supports multi-group by tuning a single threshold per group (simple)
     groups = np.unique(s)
     if len(groups) == 2:
         g0, g1 = groups[0], groups[1]
-        for t0 in grid:
-            for t1 in grid:
-                pred = np.zeros_like(y_true)
-                pred[s == g0] = (y_score[s == g0] >= t0).astype(int)
-                pred[s == g1] = (y_score[s == g1] >= t1).astype(int)
-
-                mf = MetricFrame(metrics={"sr": selection_rate}, y_true=y_true, y_pred=pred, sensitive_features=s)
-                sr0 = float(mf.by_group.loc[g0, "sr"])
-                sr1 = float(mf.by_group.loc[g1, "sr"])
-                di = float(min(sr0, sr1) / max(sr0, sr1)) if max(sr0, sr1) > 0 else 0.0
-                acc = float(accuracy_score(y_true, pred))
-
-                ok = di >= target_di
-                score = (1 if ok else 0) * 1000 + acc
-                cand = (score, di, acc, {int(g0): float(t0), int(g1): float(t1)})
-                if (best is None) or (cand[0] > best[0]):
-                    best = cand
-
-        _, di_best, acc_best, thr = best
-        return {"thresholds": thr, "di": float(di_best), "acc": float(acc_best)}
+        m0, m1 = s == g0, s == g1
+        n0, n1 = int(m0.sum()), int(m1.sum())
+        c0, c1 = _candidates(y_score[m0], grid), _candidates(y_score[m1], grid)
+        sel0, cor0 = _group_curve(y_true[m0], y_score[m0], c0)
+        sel1, cor1 = _group_curve(y_true[m1], y_score[m1], c1)
+        sr0, sr1 = sel0 / n0, sel1 / n1
+
+        # group-1 candidates ordered by selection rate so the feasible band is a contiguous index range
+        order = np.argsort(sr1, kind="stable")
+        sr1_sorted, cor1_sorted = sr1[order], cor1[order]
+        if target_di > 0:
+            lo, hi = _feasible_band(sr0, sr1_sorted, target_di)
+        else:
+            lo = np.zeros(len(c0), dtype=int)
+            hi = np.full(len(c0), len(c1) - 1)
+        feasible = (sr0 > 0) & (lo <= hi) if target_di > 0 else np.ones(len(c0), dtype=bool)
+
+        if feasible.any():
+            i0 = np.flatnonzero(feasible)
+            j_best = order[_range_argmax(cor1_sorted, lo[i0], hi[i0])]
+            total = cor0[i0] + cor1[j_best]
+            k = int(np.argmax(total))
+            b0, b1 = int(i0[k]), int(j_best[k])
+        else:
+            b0, b1 = int(np.argmax(cor0)), int(np.argmax(cor1))
+
+        di = float(_di(sr0[b0], sr1[b1]))
+        acc = float((cor0[b0] + cor1[b1]) / n)
+        return {"thresholds": {int(g0): float(c0[b0]), int(g1): float(c1[b1])}, "di": di, "acc": acc}
 
     # multi-group fallback: single shared threshold
-    best = None
-    for t in grid:
-        pred = (y_score >= t).astype(int)
-        mf = MetricFrame(metrics={"sr": selection_rate}, y_true=y_true, y_pred=pred, sensitive_features=s)
-        sr = mf.by_group["sr"]
-        di = float(sr.min() / sr.max()) if float(sr.max()) > 0 else 0.0
-        acc = float(accuracy_score(y_true, pred))
-        ok = di >= target_di
-        score = (1 if ok else 0) * 1000 + acc
-        cand = (score, di, acc, {"shared": float(t)})
-        if (best is None) or (cand[0] > best[0]):
-            best = cand
-
-    _, di_best, acc_best, thr = best
-    return {"thresholds": thr, "di": float(di_best), "acc": float(acc_best)}
-
-def run_fairness_remediation(evidence_dir: str, target_di=0.80):
-    scores_path = os.path.join(evidence_dir, "ml_eval_scores.csv")
-    if not os.path.exists(scores_path):
-        return {"skipped": True, "reason": "ml_eval_scores.csv not found"}
-
-    df = pd.read_csv(scores_path)
+    cands = _candidates(y_score, grid)
+    correct = np.zeros(len(cands))
+    sr = np.zeros((len(groups), len(cands)))
+    for gi, g in enumerate(groups):
+        m = s == g
+        sel, cor = _group_curve(y_true[m], y_score[m], cands)
+        sr[gi] = sel / max(1, int(m.sum()))
+        correct += cor
+    top = sr.max(axis=0)
+    di = np.where(top > 0, sr.min(axis=0) / np.where(top > 0, top, 1.0), 0.0)
+    score = (di >= target_di) * 1000 + correct / max(1, n)
+    b = int(np.argmax(score))
+    return {"thresholds": {"shared": float(cands[b])}, "di": float(di[b]), "acc": float(correct[b] / max(1, n))}
+
+def run_fairness_remediation(bundle, target_di=0.80):
+    """Tunes thresholds on the bundle's eval_scores table and adds fairness_mitigation to it."""
+    if "eval_scores" not in bundle:
+        return {"skipped": True, "reason": "eval_scores not in evidence"}
+
+    df = bundle.table("eval_scores", columns=["y_true", "y_score", "sensitive"])
     result = threshold_tune_groupwise(df["y_true"].values, df["y_score"].values, df["sensitive"].values, target_di=target_di)
 
     out = {"method": "group_threshold_tuning", "target_di": target_di, "after": result}
-    _save_json(os.path.join(evidence_dir, "fairness_mitigation.json"), out)
-    return out
+    return bundle.put("fairness_mitigation", out)
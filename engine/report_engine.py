@@ -0,0 +1,197 @@
+import os, time, zlib
+from functools import lru_cache
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+FONT, BOLD = "Helvetica", "Helvetica-Bold"
+
+@lru_cache(maxsize=65536)
+def wrap(text: str, font: str, size: float, width: float) -> tuple:
+    """Lines of text that fit width; words longer than a line are broken. Cached: registers repeat a lot of text."""
+    lines = []
+    for line in simpleSplit(text, font, size, width) or [""]:
+        while stringWidth(line, font, size) > width and len(line) > 1:
+            lo, hi = 1, len(line) - 1  # longest prefix that fits
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if stringWidth(line[:mid], font, size) <= width:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            lines.append(line[:lo])
+            line = line[lo:]
+        lines.append(line)
+    return tuple(lines)
+
+class PageTemplate:
+    """
+    Page geometry plus the static frame (header title, rules, footer label).
+    The frame is drawn once per document as a form XObject and referenced by every page.
+    """
+
+    def __init__(self, title: str, pagesize=A4, margin: float = 2 * cm):
+        self.title = title
+        self.width, self.height = pagesize
+        self.margin = margin
+        self.left, self.right = margin, self.width - margin
+        self.top = self.height - margin - 0.8 * cm
+        self.bottom = margin + 0.4 * cm
+        self.form = f"tpl{zlib.crc32(f'{title}|{pagesize}'.encode()):08x}"
+        self.ops = (
+            ("text", margin, self.height - margin + 0.25 * cm, BOLD, 8, title),
+            ("line", margin, self.height - margin, self.right, self.height - margin),
+            ("line", margin, margin, self.right, margin),
+            ("text", margin, margin - 0.45 * cm, FONT, 7, "AEGIS – AI Governance & Risk Platform"),
+        )
+
+    @property
+    def content_width(self) -> float:
+        return self.right - self.left
+
+@lru_cache(maxsize=256)
+def page_template(title: str, pagesize=A4) -> PageTemplate:
+    return PageTemplate(title, pagesize)
+
+def draw_ops(c, ops):
+    font = None
+    for op in ops:
+        kind = op[0]
+        if kind == "text":
+            _, x, y, f, size, s = op
+            if font != (f, size):
+                c.setFont(f, size)
+                font = (f, size)
+            c.drawString(x, y, s)
+        elif kind == "line":
+            c.line(*op[1:])
+        elif kind == "rect":
+            _, x, y, w, h, gray = op
+            c.setFillGray(gray)
+            c.rect(x, y, w, h, stroke=0, fill=1)
+            c.setFillGray(0)
+
+class PdfRenderer:
+    """Draws pages (lists of draw ops) onto one PDF as they arrive; finished pages are kept compressed only."""
+
+    def __init__(self, path: str, template: PageTemplate):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path, self.template = path, template
+        self.c = canvas.Canvas(path, pagesize=(template.width, template.height), pageCompression=1)
+        self.c.setTitle(template.title)
+        self.pages = 0
+        self._forms = set()
+        self._t0 = time.perf_counter()
+
+    def page(self, ops, template: PageTemplate | None = None):
+        """Draws one page from its draw ops (plain tuples, so worker processes can lay pages out)."""
+        t = template or self.template
+        if t.form not in self._forms:
+            self.c.beginForm(t.form)
+            draw_ops(self.c, t.ops)
+            self.c.endForm()
+            self._forms.add(t.form)
+        self.c.doForm(t.form)
+        self.pages += 1
+        self.c.setFont(FONT, 7)
+        self.c.drawRightString(t.right, t.margin - 0.45 * cm, f"Page {self.pages}")
+        draw_ops(self.c, ops)
+        self.c.showPage()
+
+    def close(self) -> dict:
+        self.c.save()
+        return {"pdf": self.path, "pages": self.pages, "render_s": round(time.perf_counter() - self._t0, 3),
+                "bytes": os.path.getsize(self.path)}
+
+class Layout:
+    """
+    Flows headings, wrapped text and tables down the page. Each full page is
+    handed to sink (a PdfRenderer.page, or list.append when laying out in a
+    worker process), so nothing but the current page is held in memory.
+    """
+
+    def __init__(self, template: PageTemplate, sink):
+        self.t = template
+        self.sink = sink
+        self.ops = []
+        self.y = template.top
+        self.rows = 0
+
+    def _fits(self, h) -> bool:
+        return self.y - h >= self.t.bottom
+
+    def break_page(self):
+        if self.ops:
+            self.sink(self.ops)
+        self.ops = []
+        self.y = self.t.top
+
+    def close(self):
+        self.break_page()
+
+    def spacer(self, h: float = 0.3 * cm):
+        self.y -= h
+
+    def heading(self, text: str, size: float = 13, keep: float = 2 * cm):
+        # keep: room the following content needs, so headings are not orphaned at the page bottom
+        if not self._fits(size * 1.6 + keep):
+            self.break_page()
+        self.ops.append(("text", self.t.left, self.y - size, BOLD, size, text))
+        self.y -= size * 1.7
+
+    def text(self, text: str, size: float = 10, indent: float = 0, font: str = FONT):
+        lh = size * 1.3
+        for line in wrap(str(text), font, size, self.t.content_width - indent):
+            if not self._fits(lh):
+                self.break_page()
+            self.ops.append(("text", self.t.left + indent, self.y - size, font, size, line))
+            self.y -= lh
+
+    def table(self, columns, rows, size: float = 8):
+        """
+        columns: [(header, relative width)]; rows: iterable of tuples (consumed lazily).
+        Cells wrap; the header repeats on every page; a row taller than a page is split.
+        """
+        total = sum(w for _, w in columns)
+        widths = [self.t.content_width * w / total for _, w in columns]
+        xs = [self.t.left + sum(widths[:i]) for i in range(len(widths))]
+        pad, lh = 2.0, size * 1.25
+
+        head = [wrap(str(h), BOLD, size, w - 2 * pad) for (h, _), w in zip(columns, widths)]
+        head_h = max(len(h) for h in head) * lh + 2 * pad
+
+        def header():
+            self.ops.append(("rect", self.t.left, self.y - head_h, self.t.content_width, head_h, 0.85))
+            for x, lines in zip(xs, head):
+                for k, line in enumerate(lines):
+                    self.ops.append(("text", x + pad, self.y - pad - size - k * lh, BOLD, size, line))
+            self.y -= head_h
+
+        if not self._fits(head_h + lh + 2 * pad):
+            self.break_page()
+        header()
+        for i, row in enumerate(rows):
+            cells = [wrap("" if v is None else str(v), FONT, size, w - 2 * pad) for v, w in zip(row, widths)]
+            start = 0
+            n = max(len(c) for c in cells)
+            row_h = n * lh + 2 * pad
+            if not self._fits(row_h) and row_h <= self.t.top - self.t.bottom - head_h:
+                self.break_page()  # move the whole row rather than split it
+                header()
+            while start < n:
+                if not self._fits(lh + 2 * pad):
+                    self.break_page()
+                    header()
+                take = min(n - start, int((self.y - self.t.bottom - 2 * pad) // lh))
+                h = take * lh + 2 * pad
+                if i % 2:
+                    self.ops.append(("rect", self.t.left, self.y - h, self.t.content_width, h, 0.95))
+                for x, lines in zip(xs, cells):
+                    for k, line in enumerate(lines[start:start + take]):
+                        self.ops.append(("text", x + pad, self.y - pad - size - k * lh, FONT, size, line))
+                self.y -= h
+                start += take
+            self.rows += 1
+        self.spacer()
@@ -1,50 +1,170 @@
-import os
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+import os, json, argparse, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+
 from reportlab.lib.units import cm
 
-def write_audit_pack(reports_dir: str, run_id: str, timestamp: str, control_df, risk_df):
+from .report_engine import Layout, PdfRenderer, page_template
+from .tracing import traced
+from .config import REPORT_WORKERS, OUTPUTS_DIR
+
+RISK_COLUMNS = [("Level", 1), ("Risk", 1.2), ("Title", 3), ("Score", 0.8), ("Controls", 1.4), ("Recommendation", 5)]
+CONTROL_COLUMNS = [("Control", 1), ("Status", 1), ("Evidence", 2), ("Notes", 6)]
+
+def _counts(df, col, keys):
+    vc = df[col].value_counts() if len(df) else {}
+    return " | ".join(f"{k}: {int(vc.get(k, 0))}" for k in keys)
+
+def remediation_section(lay: Layout, mitigation):
+    if not mitigation or mitigation.get("skipped"):
+        return
+    after = mitigation.get("after", {})
+    lay.heading("Remediation Addendum")
+    lay.text(f"Fairness remediation: {mitigation.get('method', '')}")
+    lay.text(f"Target DI: {mitigation.get('target_di', '')} | Achieved DI: {after.get('di', float('nan')):.3f} | "
+             f"Accuracy after: {after.get('acc', float('nan')):.3f}")
+    lay.spacer()
+    lay.table([("Group", 2), ("Decision threshold", 3)],
+              ((g, f"{t:.4f}") for g, t in after.get("thresholds", {}).items()))
+
+def run_sections(lay: Layout, control_df, risk_df, mitigation=None, failed=None):
+    """
+    Executive summary, full risk register, control results and the remediation addendum of one run.
+    failed maps stages that did not complete to their error; they are listed first.
+    """
+    lay.heading("Executive Summary")
+    if failed:
+        lay.text("Incomplete run: the stages below did not complete; controls relying on their evidence are not conclusive.")
+        for stage, err in failed.items():
+            lay.text(f"{stage}: {err}")
+        lay.spacer()
+    lay.text(f"Controls: {len(control_df)} | " + _counts(control_df, "status", ("PASS", "FAIL", "REVIEW")))
+    lay.text(f"Risks: {len(risk_df)} | " + _counts(risk_df, "level", ("HIGH", "MEDIUM", "LOW")))
+    lay.spacer()
+
+    lay.heading("Risk Register")
+    lay.table(RISK_COLUMNS, ((r.level, r.risk_id, r.title, int(r.score), r.controls, r.recommendation)
+                             for r in risk_df.itertuples(index=False)))
+    lay.heading("Control Results")
+    lay.table(CONTROL_COLUMNS, control_df[["control_id", "status", "evidence", "notes"]].itertuples(index=False, name=None))
+    remediation_section(lay, mitigation)
+
+@traced("report.render")
+def write_audit_pack(reports_dir: str, run_id: str, timestamp: str, control_df, risk_df, mitigation=None, failed=None):
+    """
+    Renders the run's audit pack; returns (pdf_path, stats) with pages, rows and render_s.
+    failed: {stage: error} of stages that did not complete, marked in the executive summary.
+    """
     pdf_path = os.path.join(reports_dir, f"audit_pack_{run_id}.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-    width, height = A4
-
-    def w(text, x, y, size=10):
-        c.setFont("Helvetica", size)
-        c.drawString(x, y, text)
-
-    w("AEGIS – AI Governance & Risk Audit Pack", 2*cm, height-3*cm, 16)
-    w(f"Run ID: {run_id}", 2*cm, height-4*cm, 11)
-    w(f"Generated: {timestamp} (UTC)", 2*cm, height-4.7*cm, 11)
-
-    total = len(control_df)
-    p = int((control_df["status"]=="PASS").sum())
-    f = int((control_df["status"]=="FAIL").sum())
-    r = int((control_df["status"]=="REVIEW").sum())
-    y = height-6.4*cm
-    w("Executive Summary", 2*cm, y, 13); y -= 0.8*cm
-    w(f"Controls: {total} | PASS: {p} | FAIL: {f} | REVIEW: {r}", 2*cm, y, 11)
-
-    c.showPage()
-    w("Risk Register (Top)", 2*cm, height-2.5*cm, 14)
-    y = height-3.6*cm
-    for _, row in risk_df.head(8).iterrows():
-        w(f"- [{row['level']}] {row['risk_id']} | {row['title']} | Score={int(row['score'])}", 2*cm, y, 10)
-        y -= 0.7*cm
-        w(f"  Recommendation: {str(row['recommendation'])[:120]}", 2.2*cm, y, 9)
-        y -= 0.9*cm
-        if y < 3*cm:
-            c.showPage()
-            y = height-3.6*cm
-
-    c.showPage()
-    w("Control Results", 2*cm, height-2.5*cm, 14)
-    y = height-3.6*cm
-    for _, row in control_df.iterrows():
-        w(f"{row['control_id']} | {row['status']} | {str(row['notes'])[:95]}", 2*cm, y, 9)
-        y -= 0.55*cm
-        if y < 2.5*cm:
-            c.showPage()
-            y = height-3.6*cm
-
-    c.save()
-    return pdf_path
+    tpl = page_template(f"AEGIS audit pack – {run_id}")
+    pdf = PdfRenderer(pdf_path, tpl)
+    lay = Layout(tpl, pdf.page)
+    lay.heading("AEGIS – AI Governance & Risk Audit Pack", 16)
+    lay.text(f"Run ID: {run_id}", 11)
+    lay.text(f"Generated: {timestamp} (UTC)", 11)
+    lay.spacer(0.8 * cm)
+    run_sections(lay, control_df, risk_df, mitigation, failed)
+    lay.close()
+    stats = pdf.close()
+    stats["rows"] = lay.rows
+    return pdf_path, stats
+
+def _load_run(evidence_dir):
+    from .evidence import load_evidence
+    ev = load_evidence(evidence_dir)
+    return ev.table("controls"), ev.table("risks"), ev.get("fairness_mitigation")
+
+def _layout_run(title: str, run: dict):
+    """Process-pool worker: lays out one run's section of a fleet pack; returns (pages of draw ops, rows)."""
+    tpl = page_template(title)
+    pages = []
+    lay = Layout(tpl, pages.append)
+    lay.heading(f"{run.get('model') or run['run_id']}", 15)
+    lay.text(f"Run ID: {run['run_id']}", 10)
+    lay.spacer()
+    run_sections(lay, *_load_run(run["evidence_dir"]))
+    lay.close()
+    return pages, lay.rows
+
+@traced("report.fleet")
+def write_fleet_pack(out_dir: str, fleet_id: str, runs: list, workers: int = REPORT_WORKERS):
+    """
+    One consolidated PDF for many runs (dicts with run_id, evidence_dir, optional model):
+    fleet overview, the combined risk register, then one section per run. Run sections
+    are laid out in a process pool and drawn in order as they arrive; at most
+    2 x workers sections are in flight. Returns (pdf_path, stats).
+    """
+    pdf_path = os.path.join(out_dir, f"fleet_pack_{fleet_id}.pdf")
+    title = f"AEGIS fleet pack – {fleet_id}"
+    tpl = page_template(title)
+    pdf = PdfRenderer(pdf_path, tpl)
+    lay = Layout(tpl, pdf.page)
+
+    overview, risks = [], []
+    for r in runs:
+        cdf, rdf, _ = _load_run(r["evidence_dir"])
+        overview.append({"Model": r.get("model", ""), "Run": r["run_id"], **dict(zip(cdf["control_id"], cdf["status"])),
+                         "Risks": len(rdf)})
+        risks.append(rdf.assign(model=r.get("model", ""), run_id=r["run_id"]))
+    overview = pd.DataFrame(overview).fillna("")
+    risks = pd.concat(risks, ignore_index=True) if risks else pd.DataFrame(columns=["score"])
+
+    lay.heading("AEGIS – Fleet Audit Pack", 16)
+    lay.text(f"Fleet ID: {fleet_id}", 11)
+    lay.text(f"Runs: {len(runs)} | Generated: {datetime.utcnow().isoformat()} (UTC)", 11)
+    lay.spacer()
+    lay.heading("Control Status by Run")
+    cols = list(overview.columns)
+    lay.table([(c, 3 if c in ("Model", "Run") else 1) for c in cols], overview.itertuples(index=False, name=None), size=7)
+    lay.heading("Combined Risk Register")
+    risks = risks.sort_values("score", ascending=False, kind="stable")
+    lay.table([("Model", 2), ("Run", 3), ("Level", 1), ("Risk", 1.2), ("Score", 0.8), ("Recommendation", 5)],
+              ((r.model, r.run_id, r.level, r.risk_id, int(r.score), r.recommendation) for r in risks.itertuples(index=False)),
+              size=7)
+    lay.close()
+    rows = lay.rows
+
+    def draw(result):
+        nonlocal rows
+        pages, n = result
+        for ops in pages:
+            pdf.page(ops)
+        rows += n
+
+    if workers <= 1 or len(runs) <= 1:
+        for r in runs:
+            draw(_layout_run(title, r))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            inflight = deque()
+            for r in runs:
+                inflight.append(pool.submit(_layout_run, title, r))
+                if len(inflight) >= 2 * workers:
+                    draw(inflight.popleft().result())
+            while inflight:
+                draw(inflight.popleft().result())
+
+    stats = pdf.close()
+    stats.update({"rows": rows, "runs": len(runs), "workers": workers})
+    return pdf_path, stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Render one consolidated audit pack for stored runs.")
+    ap.add_argument("run_ids", nargs="*", help="run ids (default: all runs matching --prefix)")
+    ap.add_argument("--prefix", default=None, help="e.g. a fleet id: every run whose id starts with it")
+    ap.add_argument("--out", default=None, help="output directory (default: outputs/reports)")
+    ap.add_argument("--workers", type=int, default=REPORT_WORKERS)
+    args = ap.parse_args(argv)
+
+    from .run_store import list_evidence_dirs
+    dirs = dict(list_evidence_dirs())
+    ids = args.run_ids or sorted(r for r in dirs if args.prefix and r.startswith(args.prefix))
+    runs = [{"run_id": r, "evidence_dir": dirs[r]} for r in ids if r in dirs]
+    name = args.prefix or f"{len(runs)}-runs-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    path, stats = write_fleet_pack(args.out or os.path.join(OUTPUTS_DIR, "reports"), name, runs, args.workers)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
-import os
+import os, uuid
+from datetime import datetime
 from .config import RUNS_DIR
 
 def get_run_dirs(run_id: str):
     run_dir = os.path.join(RUNS_DIR, run_id)
     evidence_dir = os.path.join(run_dir, "evidence")
     reports_dir = os.path.join(run_dir, "reports")
-    chroma_dir = os.path.join(run_dir, "chroma_policy")
     os.makedirs(evidence_dir, exist_ok=True)
     os.makedirs(reports_dir, exist_ok=True)
-    os.makedirs(chroma_dir, exist_ok=True)
-    return run_dir, evidence_dir, reports_dir, chroma_dir
+    return run_dir, evidence_dir, reports_dir
+
+def new_run_id(prefix: str = "AEGIS-RUN") -> str:
+    """<prefix>-<UTC second>-<random suffix>: sortable by time, unique across concurrent runs and processes."""
+    return f"{prefix}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
@@ -1,69 +1,421 @@
-import os, sqlite3, json
-from .config import OUTPUTS_DIR
+import os, sqlite3, json, queue, threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pandas as pd
+
+from .config import OUTPUTS_DIR, RUN_STORE_POOL_SIZE
 
 DB_PATH = os.path.join(OUTPUTS_DIR, "runs.db")
 
+# columns added after the first release; the schema step adds them to older databases
+_ADDED_COLUMNS = {
+    "trace_path": "TEXT",
+    "trace_summary_json": "TEXT",
+    "evidence_bundle": "TEXT",
+    "model": "TEXT",
+}
+_ADDED_JOB_COLUMNS = {
+    "logs_json": "TEXT",  # workflow logs of a failed job (WorkflowError.logs)
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    timestamp TEXT,
+    llm_id TEXT,
+    llm_mode TEXT,
+    evidence_dir TEXT,
+    reports_dir TEXT,
+    control_csv TEXT,
+    risk_csv TEXT,
+    audit_pdf TEXT,
+    remediation_pdf TEXT,
+    logs_json TEXT
+);
+CREATE TABLE IF NOT EXISTS run_metrics (
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, metric)
+);
+CREATE TABLE IF NOT EXISTS control_status (
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    control_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    prev_status TEXT,
+    PRIMARY KEY (run_id, control_id)
+);
+CREATE TABLE IF NOT EXISTS metric_daily (
+    model TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    day TEXT NOT NULL,
+    n INTEGER,
+    sum REAL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (model, metric, day)
+);
+CREATE TABLE IF NOT EXISTS control_daily (
+    model TEXT NOT NULL,
+    control_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    status TEXT NOT NULL,
+    n INTEGER,
+    PRIMARY KEY (model, control_id, day, status)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted_at TEXT NOT NULL,
+    submitted_by TEXT,
+    params_json TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    worker TEXT,
+    run_id TEXT,
+    stages_json TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_submitted ON jobs (submitted_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, submitted_at);
+CREATE INDEX IF NOT EXISTS idx_metrics_model_metric_ts ON run_metrics (model, metric, ts);
+CREATE INDEX IF NOT EXISTS idx_metrics_metric_ts ON run_metrics (metric, ts);
+CREATE INDEX IF NOT EXISTS idx_metrics_model_ts ON run_metrics (model, ts);
+CREATE INDEX IF NOT EXISTS idx_control_flips ON control_status (control_id, status, ts) WHERE prev_status<>status;
+CREATE INDEX IF NOT EXISTS idx_control_model_ts ON control_status (model, control_id, ts);
+CREATE INDEX IF NOT EXISTS idx_control_model_day ON control_status (model, ts);
+"""
+
+_RUN_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_runs_ts ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS idx_runs_model_ts ON runs (model, timestamp);
+"""
+
+_UPSERT_RUN = """
+INSERT OR REPLACE INTO runs (
+    run_id, timestamp, llm_id, llm_mode, evidence_dir, reports_dir, control_csv, risk_csv,
+    audit_pdf, remediation_pdf, logs_json, trace_path, trace_summary_json, evidence_bundle, model
+) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+_INSERT_METRIC = "INSERT OR REPLACE INTO run_metrics (run_id, model, ts, metric, value) VALUES (?,?,?,?,?)"
+# prev_status is the same control's status in the model's previous run, so flips are a plain indexed lookup
+_INSERT_CONTROL = """
+INSERT OR REPLACE INTO control_status (run_id, model, ts, control_id, status, prev_status)
+VALUES (?,?,?,?,?, (SELECT status FROM control_status WHERE model=? AND control_id=? AND ts<? ORDER BY ts DESC LIMIT 1))
+"""
+# re-derives prev_status of the run following a position (model, control_id, ts): used for the old position of
+# every replaced row and the new position of every inserted one, so no neighbour keeps a stale prev_status
+_FIX_NEXT_CONTROL = """
+UPDATE control_status SET prev_status = (
+    SELECT p.status FROM control_status p WHERE p.model=control_status.model AND p.control_id=control_status.control_id
+    AND p.ts<control_status.ts ORDER BY p.ts DESC LIMIT 1)
+WHERE rowid = (SELECT rowid FROM control_status WHERE model=? AND control_id=? AND ts>? ORDER BY ts LIMIT 1)
+"""
+_ROLLUP_METRICS = """
+INSERT INTO metric_daily (model, metric, day, n, sum, min, max)
+SELECT model, metric, ?, COUNT(value), SUM(value), MIN(value), MAX(value)
+FROM run_metrics WHERE model=? AND ts>=? AND ts<? GROUP BY metric
+"""
+_ROLLUP_CONTROLS = """
+INSERT INTO control_daily (model, control_id, day, status, n)
+SELECT model, control_id, ?, status, COUNT(*)
+FROM control_status WHERE model=? AND ts>=? AND ts<? GROUP BY control_id, status
+"""
+
+class _Pool:
+    """Fixed-size pool of WAL-mode connections shared by all threads of the process."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=256)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA busy_timeout=30000")
+        return con
+
+    @contextmanager
+    def connection(self):
+        try:
+            con = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            con = self._connect() if grow else self._idle.get()
+        try:
+            yield con
+        finally:
+            self._idle.put(con)
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def _pool() -> _Pool:
+    # keyed by path so DB_PATH can be pointed elsewhere (scripts, fleets) at runtime
+    path = DB_PATH
+    with _POOLS_LOCK:
+        pool = _POOLS.get(path)
+        if pool is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            pool = _POOLS[path] = _Pool(path, RUN_STORE_POOL_SIZE)
+            with pool.connection() as con:
+                _init_schema(con)
+    return pool
+
+def _init_schema(con):
+    with con:
+        con.executescript(_SCHEMA)
+        for table, added in (("runs", _ADDED_COLUMNS), ("jobs", _ADDED_JOB_COLUMNS)):
+            have = {r[1] for r in con.execute(f"PRAGMA table_info({table})").fetchall()}
+            for col, typ in added.items():
+                if col not in have:
+                    con.execute(f"ALTER TABLE {table} ADD COLUMN {col} {typ}")
+        con.executescript(_RUN_INDEXES)
+
 def init_db():
-    os.makedirs(OUTPUTS_DIR, exist_ok=True)
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS runs (
-        run_id TEXT PRIMARY KEY,
-        timestamp TEXT,
-        llm_id TEXT,
-        llm_mode TEXT,
-        evidence_dir TEXT,
-        reports_dir TEXT,
-        control_csv TEXT,
-        risk_csv TEXT,
-        audit_pdf TEXT,
-        remediation_pdf TEXT,
-        logs_json TEXT
-    )
-    """)
-    con.commit()
-    con.close()
+    _pool()
+
+def _day_range(day: str):
+    d = date.fromisoformat(day)
+    return day, (d + timedelta(days=1)).isoformat()
+
+def upsert_runs(metas: list):
+    """
+    Writes a batch of runs in one transaction. Besides the run record, meta may carry
+    "model", "metrics" ({metric: value}) and "controls" ({control_id: status});
+    those feed run_metrics / control_status and the daily rollups of the touched days.
+    """
+    if not metas:
+        return
+    with _pool().connection() as con, con:
+        touched, next_rows = set(), set()
+        ids = [m.get("run_id") for m in metas]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            for model, ts in con.execute(f"SELECT model, timestamp FROM runs WHERE run_id IN ({marks})", chunk):
+                if model is not None and ts:
+                    touched.add((model, ts[:10]))  # a re-upserted run may move out of its old rollup
+            next_rows.update(con.execute(f"SELECT model, control_id, ts FROM control_status WHERE run_id IN ({marks})", chunk))
+
+        con.executemany(_UPSERT_RUN, [(
+            m.get("run_id"),
+            m.get("timestamp"),
+            m.get("llm_id",""),
+            m.get("llm_mode",""),
+            m.get("evidence_dir",""),
+            m.get("reports_dir",""),
+            m.get("control_csv",""),
+            m.get("risk_csv",""),
+            m.get("audit_pdf",""),
+            m.get("remediation_pdf",""),
+            json.dumps(m.get("logs", []), default=str),
+            m.get("trace_path",""),
+            json.dumps(m.get("trace_summary", {}), default=str),
+            m.get("evidence_bundle",""),
+            m.get("model",""),
+        ) for m in metas])
+
+        con.executemany("DELETE FROM run_metrics WHERE run_id=?", [(i,) for i in ids])
+        con.executemany("DELETE FROM control_status WHERE run_id=?", [(i,) for i in ids])
+        metric_rows, control_rows = [], []
+        for m in sorted(metas, key=lambda m: m.get("timestamp") or ""):
+            run_id, model, ts = m.get("run_id"), m.get("model", ""), m.get("timestamp") or ""
+            touched.add((model, ts[:10]))
+            metric_rows += [(run_id, model, ts, k, float(v)) for k, v in (m.get("metrics") or {}).items() if v is not None]
+            for cid, status in (m.get("controls") or {}).items():
+                control_rows.append((run_id, model, ts, cid, status, model, cid, ts))
+                next_rows.add((model, cid, ts))
+        con.executemany(_INSERT_METRIC, metric_rows)
+        for row in control_rows:  # row by row: later runs of the batch must see earlier ones as prev_status
+            con.execute(_INSERT_CONTROL, row)
+        con.executemany(_FIX_NEXT_CONTROL, next_rows)
+
+        for model, day in touched:
+            lo, hi = _day_range(day)
+            con.execute("DELETE FROM metric_daily WHERE model=? AND day=?", (model, day))
+            con.execute(_ROLLUP_METRICS, (day, model, lo, hi))
+            con.execute("DELETE FROM control_daily WHERE model=? AND day=?", (model, day))
+            con.execute(_ROLLUP_CONTROLS, (day, model, lo, hi))
 
 def upsert_run(meta: dict):
-    init_db()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-    INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?,?,?,?,?)
-    """, (
-        meta.get("run_id"),
-        meta.get("timestamp"),
-        meta.get("llm_id",""),
-        meta.get("llm_mode",""),
-        meta.get("evidence_dir",""),
-        meta.get("reports_dir",""),
-        meta.get("control_csv",""),
-        meta.get("risk_csv",""),
-        meta.get("audit_pdf",""),
-        meta.get("remediation_pdf",""),
-        json.dumps(meta.get("logs", []))
-    ))
-    con.commit()
-    con.close()
-
-def list_runs(limit=20):
-    init_db()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT run_id, timestamp, llm_mode FROM runs ORDER BY timestamp DESC LIMIT ?", (limit,))
-    rows = cur.fetchall()
-    con.close()
-    return rows
+    upsert_runs([meta])
+
+def _query(sql: str, params=()) -> pd.DataFrame:
+    with _pool().connection() as con:
+        cur = con.execute(sql, params)
+        cols = [d[0] for d in cur.description]
+        return pd.DataFrame(cur.fetchall(), columns=cols)
+
+def list_runs(limit=20, offset=0, model=None):
+    with _pool().connection() as con:
+        if model:
+            cur = con.execute("SELECT run_id, timestamp, llm_mode FROM runs WHERE model=? ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+                              (model, limit, offset))
+        else:
+            cur = con.execute("SELECT run_id, timestamp, llm_mode FROM runs ORDER BY timestamp DESC LIMIT ? OFFSET ?", (limit, offset))
+        return cur.fetchall()
+
+def count_runs(model=None) -> int:
+    with _pool().connection() as con:
+        if model:
+            return con.execute("SELECT COUNT(*) FROM runs WHERE model=?", (model,)).fetchone()[0]
+        return con.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+def list_models():
+    with _pool().connection() as con:
+        return [r[0] for r in con.execute("SELECT DISTINCT model FROM runs WHERE model<>'' ORDER BY model")]
+
+def list_evidence_dirs(limit=None):
+    with _pool().connection() as con:
+        cur = con.execute("SELECT run_id, evidence_dir FROM runs ORDER BY timestamp DESC" + (" LIMIT ?" if limit else ""),
+                          (limit,) if limit else ())
+        return cur.fetchall()
 
 def load_run(run_id: str):
-    init_db()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT * FROM runs WHERE run_id=?", (run_id,))
-    row = cur.fetchone()
-    cols = [d[0] for d in cur.description]
-    con.close()
+    with _pool().connection() as con:
+        cur = con.execute("SELECT * FROM runs WHERE run_id=?", (run_id,))
+        row = cur.fetchone()
+        cols = [d[0] for d in cur.description]
     if not row:
         return None
     return dict(zip(cols, row))
+
+def load_trace_summary(run_id: str):
+    run = load_run(run_id)
+    if not run or not run.get("trace_summary_json"):
+        return {}
+    return json.loads(run["trace_summary_json"])
+
+def metric_history(metric: str, model: str | None = None, limit: int = 1000) -> pd.DataFrame:
+    """Latest `limit` values of a metric (e.g. "di"), newest first; ts, run_id, model, value."""
+    if model:
+        return _query("SELECT ts, run_id, model, value FROM run_metrics WHERE model=? AND metric=? ORDER BY ts DESC LIMIT ?",
+                      (model, metric, limit))
+    return _query("SELECT ts, run_id, model, value FROM run_metrics WHERE metric=? ORDER BY ts DESC LIMIT ?", (metric, limit))
+
+def control_flips(control_id: str, to_status: str = "REVIEW", model: str | None = None, since: str | None = None,
+                  limit: int = 1000) -> pd.DataFrame:
+    """Runs where a control changed to to_status compared with the model's previous run."""
+    # matches the partial index idx_control_flips, which only holds rows whose status changed
+    sql = ("SELECT ts, run_id, model, prev_status, status FROM control_status "
+           "WHERE control_id=? AND status=? AND prev_status<>status")
+    params = [control_id, to_status]
+    if since:
+        sql += " AND ts>=?"
+        params.append(since)
+    if model:
+        sql += " AND model=?"
+        params.append(model)
+    sql += " ORDER BY ts DESC LIMIT ?"
+    params.append(limit)
+    return _query(sql, params)
+
+def metric_daily(metric: str, model: str | None = None, since: str | None = None) -> pd.DataFrame:
+    """Pre-aggregated daily n/mean/min/max of a metric (all models pooled when model is None)."""
+    sql = ("SELECT day, SUM(n) AS n, SUM(sum) / SUM(n) AS mean, MIN(min) AS min, MAX(max) AS max "
+           "FROM metric_daily WHERE metric=?")
+    params = [metric]
+    if model:
+        sql += " AND model=?"
+        params.append(model)
+    if since:
+        sql += " AND day>=?"
+        params.append(since)
+    return _query(sql + " GROUP BY day ORDER BY day", params)
+
+def control_daily(control_id: str, model: str | None = None, since: str | None = None) -> pd.DataFrame:
+    """Daily count of runs per status for one control."""
+    sql = "SELECT day, status, SUM(n) AS n FROM control_daily WHERE control_id=?"
+    params = [control_id]
+    if model:
+        sql += " AND model=?"
+        params.append(model)
+    if since:
+        sql += " AND day>=?"
+        params.append(since)
+    df = _query(sql + " GROUP BY day, status ORDER BY day", params)
+    return df.pivot(index="day", columns="status", values="n").fillna(0).astype(int) if len(df) else df
+
+# --- audit jobs (queued by engine.jobs, picked up by any worker process) ---
+
+_JOB_FIELDS = ("status", "started_at", "finished_at", "worker", "run_id", "error", "logs_json")
+
+def insert_job(job_id: str, params: dict, submitted_at: str, submitted_by: str = ""):
+    with _pool().connection() as con, con:
+        con.execute("INSERT INTO jobs (job_id, status, submitted_at, submitted_by, params_json, stages_json) VALUES (?,?,?,?,?,?)",
+                    (job_id, "queued", submitted_at, submitted_by, json.dumps(params, default=str), "{}"))
+
+def claim_job(worker: str, started_at: str):
+    """Atomically moves the oldest queued job to running for this worker; returns it, or None."""
+    with _pool().connection() as con, con:
+        cur = con.execute(
+            "UPDATE jobs SET status='running', worker=?, started_at=? WHERE job_id = "
+            "(SELECT job_id FROM jobs WHERE status='queued' ORDER BY submitted_at, rowid LIMIT 1) RETURNING *",
+            (worker, started_at))
+        row = cur.fetchone()
+        return dict(zip([d[0] for d in cur.description], row)) if row else None
+
+def update_job(job_id: str, **fields):
+    bad = set(fields) - set(_JOB_FIELDS)
+    if bad:
+        raise ValueError(f"unknown job fields {sorted(bad)}")
+    with _pool().connection() as con, con:
+        con.execute(f"UPDATE jobs SET {', '.join(f'{k}=?' for k in fields)} WHERE job_id=?", (*fields.values(), job_id))
+
+def set_job_stage(job_id: str, stage: str, info: dict):
+    # json_set keeps concurrent stage updates of one job from overwriting each other
+    with _pool().connection() as con, con:
+        con.execute("UPDATE jobs SET stages_json=json_set(COALESCE(stages_json, '{}'), ?, json(?)) WHERE job_id=?",
+                    (f'$."{stage}"', json.dumps(info, default=str), job_id))
+
+def requeue_jobs(workers):
+    """Puts running jobs of the given (dead) workers back in the queue; returns how many."""
+    workers = list(workers)
+    if not workers:
+        return 0
+    with _pool().connection() as con, con:
+        return con.execute(f"UPDATE jobs SET status='queued', worker=NULL, started_at=NULL, stages_json='{{}}' "
+                           f"WHERE status='running' AND worker IN ({','.join('?' * len(workers))})", workers).rowcount
+
+def running_workers():
+    with _pool().connection() as con:
+        return [r[0] for r in con.execute("SELECT DISTINCT worker FROM jobs WHERE status='running'")]
+
+def count_jobs() -> dict:
+    with _pool().connection() as con:
+        return dict(con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+def _job_row(cols, row):
+    job = dict(zip(cols, row))
+    job["params"] = json.loads(job.pop("params_json") or "{}")
+    job["stages"] = json.loads(job.pop("stages_json") or "{}")
+    job["logs"] = json.loads(job.pop("logs_json", None) or "[]")
+    return job
+
+def load_job(job_id: str):
+    with _pool().connection() as con:
+        cur = con.execute("SELECT * FROM jobs WHERE job_id=?", (job_id,))
+        row = cur.fetchone()
+        return _job_row([d[0] for d in cur.description], row) if row else None
+
+def list_jobs(limit=20, offset=0, status=None):
+    with _pool().connection() as con:
+        if status:
+            cur = con.execute("SELECT * FROM jobs WHERE status=? ORDER BY submitted_at DESC LIMIT ? OFFSET ?", (status, limit, offset))
+        else:
+            cur = con.execute("SELECT * FROM jobs ORDER BY submitted_at DESC LIMIT ? OFFSET ?", (limit, offset))
+        cols = [d[0] for d in cur.description]
+        return [_job_row(cols, r) for r in cur.fetchall()]
@@ -0,0 +1,231 @@
+"""
+Headless audit service: python -m engine.service [--host H] [--port P] [--workers N]
+
+  POST /audits                      body: run_aegis parameters, or {"audits": [...]} -> 202 {"job_ids": [...]}
+  GET  /audits?status=&limit=&offset=
+  GET  /audits/<job_id>[?wait=S]    job status and per-stage progress; wait long-polls until the job ends
+  GET  /runs/<run_id>               run record and its artifact names
+  GET  /runs/<run_id>/artifacts/<name>   audit_pdf, manifest, trace, or an evidence document/table (JSON/CSV)
+  GET  /health
+
+Jobs are rows of run_store's jobs table, so submitted audits survive a restart;
+the worker pool is a JobRunner in this process sharing one LLM registry.
+"""
+import os, re, json, time, asyncio, argparse
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+from . import run_store
+from .jobs import JobRunner
+from .evidence import load_evidence, BUNDLE_DIR, MANIFEST
+from .config import SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_WAIT_S = 300
+CHUNK_BYTES = 256 * 1024
+
+class HTTPError(Exception):
+    def __init__(self, status: int, msg: str):
+        super().__init__(msg)
+        self.status = status
+
+class Response:
+    def __init__(self, status=200, body=None, content_type="application/json", path=None, filename=None):
+        self.status, self.content_type, self.path, self.filename = status, content_type, path, filename
+        if body is not None and content_type == "application/json" and not isinstance(body, bytes):
+            body = json.dumps(body, default=str).encode("utf-8")
+        self.body = body if body is not None else b""
+
+def _param(query, name, default, cast=int, lo=0, hi=None):
+    """A numeric query parameter; malformed or negative values are a 400, values above hi are clamped."""
+    raw = query.get(name, [default])[0]
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise HTTPError(400, f"{name} must be a number, got {raw!r}")
+    if not value >= lo:  # also rejects nan
+        raise HTTPError(400, f"{name} must be >= {lo}, got {raw!r}")
+    return min(value, hi) if hi is not None else value
+
+def _job_view(job):
+    job = dict(job)
+    planned = job["stages"].pop("workflow", {}).get("nodes", [])
+    job["stages"] = {s: job["stages"].get(s, {"status": "pending"}) for s in planned} or job["stages"]
+    return job
+
+def _artifacts(run) -> dict:
+    ev = load_evidence(run["evidence_dir"])
+    names = {"audit_pdf": run.get("audit_pdf"),
+             "manifest": os.path.join(run["evidence_dir"], BUNDLE_DIR, MANIFEST),
+             "trace": run.get("trace_path")}
+    return {"files": [k for k, p in names.items() if p and os.path.exists(p)],
+            "documents": sorted(ev.docs), "tables": sorted(set(ev.tables) | set(ev.files)), "_paths": names, "_ev": ev}
+
+class AuditService:
+    def __init__(self, workers: int = SERVICE_WORKERS):
+        self.runner = JobRunner(workers)
+        self.workers = workers
+        self.routes = [
+            ("POST", re.compile(r"^/audits/?$"), self.submit),
+            ("GET", re.compile(r"^/audits/?$"), self.list_jobs),
+            ("GET", re.compile(r"^/audits/(?P<job_id>[\w-]+)$"), self.job),
+            ("GET", re.compile(r"^/runs/(?P<run_id>[\w.-]+)$"), self.run),
+            ("GET", re.compile(r"^/runs/(?P<run_id>[\w.-]+)/artifacts/(?P<name>[\w.-]+)$"), self.artifact),
+            ("GET", re.compile(r"^/health$"), self.health),
+        ]
+
+    # --- handlers (plain ones run in a thread: run_store and evidence reads are blocking) ---
+
+    def submit(self, body, query):
+        specs = body.get("audits", [body]) if isinstance(body, dict) else body
+        if not isinstance(specs, list) or not all(isinstance(s, dict) for s in specs):
+            raise HTTPError(400, "body must be an object of run_aegis parameters or {\"audits\": [...]}")
+        submitted_by = str(query.get("submitted_by", ["api"])[0])
+        try:
+            ids = [self.runner.submit(s, submitted_by=submitted_by) for s in specs]
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return Response(202, {"job_ids": ids})
+
+    def list_jobs(self, body, query):
+        limit = _param(query, "limit", "50", hi=1000)
+        offset = _param(query, "offset", "0")
+        jobs = run_store.list_jobs(limit, offset, status=query.get("status", [None])[0])
+        return Response(200, {"jobs": [_job_view(j) for j in jobs]})
+
+    async def job(self, body, query, job_id):
+        # long-polls on the event loop, so many waiting CI clients do not tie up threads
+        deadline = time.monotonic() + _param(query, "wait", "0", cast=float, hi=MAX_WAIT_S)
+        while True:
+            job = await asyncio.to_thread(run_store.load_job, job_id)
+            if job is None:
+                raise HTTPError(404, f"unknown job {job_id}")
+            if job["status"] in ("done", "failed") or time.monotonic() >= deadline:
+                return Response(200, _job_view(job))
+            await asyncio.sleep(0.5)
+
+    def run(self, body, query, run_id):
+        run = run_store.load_run(run_id)
+        if run is None:
+            raise HTTPError(404, f"unknown run {run_id}")
+        run.pop("logs_json", None)
+        run["trace_summary"] = json.loads(run.pop("trace_summary_json") or "{}")
+        arts = _artifacts(run)
+        run["artifacts"] = {k: arts[k] for k in ("files", "documents", "tables")}
+        return Response(200, run)
+
+    def artifact(self, body, query, run_id, name):
+        run = run_store.load_run(run_id)
+        if run is None:
+            raise HTTPError(404, f"unknown run {run_id}")
+        arts = _artifacts(run)
+        if name in arts["files"]:
+            path = arts["_paths"][name]
+            ctype = "application/pdf" if path.endswith(".pdf") else "application/json"
+            return Response(200, content_type=ctype, path=path, filename=os.path.basename(path))
+        ev = arts["_ev"]
+        if name in arts["documents"]:
+            return Response(200, ev.docs[name])
+        if name in arts["tables"]:
+            return Response(200, ev.table(name).to_csv(index=False).encode("utf-8"), content_type="text/csv",
+                            filename=f"{name}_{run_id}.csv")
+        raise HTTPError(404, f"run {run_id} has no artifact {name}")
+
+    def health(self, body, query):
+        return Response(200, {"ok": True, "workers": self.workers, "worker_id": self.runner.worker_id,
+                              "jobs": run_store.count_jobs()})
+
+    # --- HTTP plumbing ---
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, target, headers, raw = await self._read_request(reader)
+                url = urlsplit(target)
+                for m, rx, fn in self.routes:
+                    match = rx.match(url.path)
+                    if match and m == method:
+                        break
+                else:
+                    raise HTTPError(404 if not any(rx.match(url.path) for _, rx, _ in self.routes) else 405,
+                                    f"no route for {method} {url.path}")
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    raise HTTPError(400, "body is not valid JSON")
+                args = (body, parse_qs(url.query))
+                if asyncio.iscoroutinefunction(fn):
+                    resp = await fn(*args, **match.groupdict())
+                else:
+                    resp = await asyncio.to_thread(fn, *args, **match.groupdict())
+            except HTTPError as e:
+                resp = Response(e.status, {"error": str(e)})
+            except Exception as e:
+                resp = Response(500, {"error": f"{type(e).__name__}: {e}"})
+            await self._write_response(writer, resp)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        while True:
+            h = (await reader.readline()).decode("latin-1").strip()
+            if not h:
+                break
+            k, _, v = h.partition(":")
+            headers[k.strip().lower()] = v.strip()
+        try:
+            n = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HTTPError(400, "malformed Content-Length")
+        if n > MAX_BODY_BYTES:
+            raise HTTPError(413, "request body too large")
+        raw = await reader.readexactly(n) if n else b""
+        return method.upper(), target, headers, raw
+
+    async def _write_response(self, writer, resp: Response):
+        size = os.path.getsize(resp.path) if resp.path else len(resp.body)
+        head = [f"HTTP/1.1 {resp.status} {HTTPStatus(resp.status).phrase}",
+                f"Content-Type: {resp.content_type}", f"Content-Length: {size}", "Connection: close"]
+        if resp.filename:
+            head.append(f'Content-Disposition: attachment; filename="{resp.filename}"')
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if resp.path:
+            with open(resp.path, "rb") as f:
+                while chunk := f.read(CHUNK_BYTES):
+                    writer.write(chunk)
+                    await writer.drain()
+        else:
+            writer.write(resp.body)
+        await writer.drain()
+
+async def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: int = SERVICE_WORKERS):
+    svc = AuditService(workers)
+    server = await asyncio.start_server(svc.handle, host, port)
+    print(json.dumps({"listening": f"http://{host}:{port}", "workers": workers, "requeued_jobs": svc.runner.requeued}))
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            svc.runner.stop()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="AEGIS audit service (HTTP + durable job queue).")
+    ap.add_argument("--host", default=SERVICE_HOST)
+    ap.add_argument("--port", type=int, default=SERVICE_PORT)
+    ap.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    args = ap.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import os, json, time, threading, contextvars, functools
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_TRACER = contextvars.ContextVar("aegis_tracer", default=None)
+_PARENT = contextvars.ContextVar("aegis_span", default=None)
+_CANCEL = contextvars.ContextVar("aegis_cancel", default=None)  # threading.Event of the running workflow step
+_PROFILING = threading.local()  # one cProfile per thread: spans nested in a profiled span are timed only
+
+def rss_mb():
+    """Current resident set size of this process in MB (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except Exception:
+        return None
+
+def process_peak_rss_mb():
+    """Highest RSS of the process so far (ru_maxrss): a lifetime high-water mark, not the peak of one step."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+class RssSampler:
+    """
+    Samples RSS every interval_s in a background thread while the block runs:
+    .delta_mb is the RSS change over the block, .peak_mb the highest sample.
+    Process-wide, so concurrent blocks see each other's allocations.
+    """
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.start_mb = self.peak_mb = self.delta_mb = None
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.peak_mb = max(self.peak_mb, rss_mb() or 0.0)
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = rss_mb()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start_mb is None:
+            return False
+        self._stop.set()
+        self._thread.join()
+        end = rss_mb()
+        self.peak_mb = round(max(self.peak_mb, end), 1)
+        self.delta_mb = round(end - self.start_mb, 1)
+        return False
+
+# tracemalloc is process-global: it runs while any profiled span is open, and a span reports a
+# peak only if no other profiled span overlapped it (otherwise just its traced-memory delta)
+_TM_LOCK = threading.Lock()
+_TM_ACTIVE = []  # one [overlapped] flag per open profiled span
+_TM_STARTED = False
+
+def _tm_enter():
+    global _TM_STARTED
+    import tracemalloc
+    with _TM_LOCK:
+        if not _TM_ACTIVE:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _TM_STARTED = True
+            tracemalloc.reset_peak()
+        flag = [bool(_TM_ACTIVE)]
+        for other in _TM_ACTIVE:
+            other[0] = True
+        _TM_ACTIVE.append(flag)
+        return flag, tracemalloc.get_traced_memory()[0]
+
+def _tm_exit(flag, start):
+    global _TM_STARTED
+    import tracemalloc
+    with _TM_LOCK:
+        cur, peak = tracemalloc.get_traced_memory()
+        _TM_ACTIVE.remove(flag)
+        if not _TM_ACTIVE and _TM_STARTED:
+            tracemalloc.stop()
+            _TM_STARTED = False
+    out = {"tracemalloc_delta_mb": round((cur - start) / 1024**2, 3)}
+    if not flag[0]:
+        out["tracemalloc_peak_mb"] = round(peak / 1024**2, 3)
+    return out
+
+class Span:
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class _NullSpan(Span):
+    def set(self, **attrs):
+        pass
+
+class Tracer:
+    """
+    Collects spans for one run. profile lists span names (or "*") that also
+    get a cProfile dump, a sampled RSS peak and tracemalloc figures; profiles go to profile_dir.
+    """
+
+    def __init__(self, profile=None, profile_dir=None):
+        self.events = []
+        self.profile = set(profile or [])
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+
+    def wants_profile(self, name):
+        return "*" in self.profile or name in self.profile
+
+    def record(self, ev):
+        with self._lock:
+            self.events.append(ev)
+
+    def merge(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def chrome_trace(self):
+        out = []
+        for ev in self.events:
+            out.append({
+                "name": ev["name"], "cat": ev["name"].split(".")[0], "ph": "X",
+                "ts": ev["ts_us"], "dur": ev["dur_us"], "pid": ev["pid"], "tid": ev["tid"],
+                "args": {k: v for k, v in ev.items() if k not in ("name", "ts_us", "dur_us", "pid", "tid")},
+            })
+        return {"traceEvents": out, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        return path
+
+    def summary(self):
+        """Per span name: count, total wall/CPU seconds, largest RSS delta, process peak RSS, token totals, time to first token, estimated prefix prefill saved."""
+        agg = {}
+        for ev in self.events:
+            a = agg.setdefault(ev["name"], {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "rss_delta_max_mb": 0.0,
+                                            "process_peak_rss_mb": 0.0})
+            a["count"] += 1
+            a["wall_s"] += ev["wall_s"]
+            a["cpu_s"] += ev["cpu_s"]
+            a["rss_delta_max_mb"] = max(a["rss_delta_max_mb"], ev.get("rss_delta_mb") or 0.0)
+            a["process_peak_rss_mb"] = max(a["process_peak_rss_mb"], ev.get("process_peak_rss_mb") or 0.0)
+            for k in ("tokens_in", "tokens_out", "stopped_early", "prefix_tokens_reused", "prefill_saved_est_s"):
+                if k in ev:
+                    a[k] = a.get(k, 0) + ev[k]
+            if ev.get("ttft_s") is not None:
+                a["_ttft"] = a.get("_ttft", []) + [ev["ttft_s"]]
+        for a in agg.values():
+            a["wall_s"], a["cpu_s"] = round(a["wall_s"], 4), round(a["cpu_s"], 4)
+            if "prefill_saved_est_s" in a:
+                a["prefill_saved_est_s"] = round(a["prefill_saved_est_s"], 4)
+            if a.get("tokens_out") and a["wall_s"] > 0:
+                a["tokens_per_s"] = round(a["tokens_out"] / a["wall_s"], 2)
+            if "_ttft" in a:
+                ttft = a.pop("_ttft")
+                a["ttft_mean_s"], a["ttft_max_s"] = round(sum(ttft) / len(ttft), 4), max(ttft)
+        return agg
+
+class Cancelled(BaseException):
+    """
+    Raised at the next span boundary of a workflow step that was cancelled (e.g. it
+    timed out); a BaseException so `except Exception` fallbacks inside steps don't swallow it.
+    """
+
+def check_cancelled():
+    ev = _CANCEL.get()
+    if ev is not None and ev.is_set():
+        raise Cancelled("step cancelled")
+
+@contextmanager
+def cancel_scope(event):
+    """Spans opened inside (in this context) raise Cancelled once event is set."""
+    tok = _CANCEL.set(event)
+    try:
+        yield event
+    finally:
+        _CANCEL.reset(tok)
+
+def current_tracer():
+    return _TRACER.get()
+
+@contextmanager
+def use_tracer(tracer):
+    tok = _TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _TRACER.reset(tok)
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times a block: wall, thread CPU, RSS and its change over the block, process peak RSS; call .set(tokens_in=, tokens_out=) for rates.
+    Entering a span is also the cancellation point of a cancelled workflow step.
+    """
+    check_cancelled()
+    tracer = _TRACER.get()
+    if tracer is None:
+        yield _NullSpan(name)
+        return
+
+    parent = _PARENT.get()
+    sp = Span(name, parent=parent.name if parent else None, **attrs)
+    tok = _PARENT.set(sp)
+
+    prof = sampler = None
+    if tracer.wants_profile(name) and not getattr(_PROFILING, "active", False):
+        import cProfile
+        prof = cProfile.Profile()
+        tm = _tm_enter()
+        sampler = RssSampler().__enter__()
+        _PROFILING.active = True
+        prof.enable()
+
+    rss0 = rss_mb()
+    ts_us = time.time_ns() // 1000
+    w0, c0 = time.perf_counter(), time.thread_time()
+    err = None
+    try:
+        yield sp
+    except BaseException as e:
+        err = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - w0, time.thread_time() - c0
+        _PARENT.reset(tok)
+        ev = {
+            "name": name, "parent": sp.parent, "ts_us": ts_us, "dur_us": int(wall * 1e6),
+            "pid": os.getpid(), "tid": threading.get_ident(),
+            "wall_s": round(wall, 6), "cpu_s": round(cpu, 6),
+            "rss_mb": (rss := rss_mb()), "rss_delta_mb": round(rss - rss0, 1) if rss is not None and rss0 is not None else None,
+            "process_peak_rss_mb": process_peak_rss_mb(),
+            **sp.attrs,
+        }
+        if err:
+            ev["error"] = err
+        if "tokens_out" in sp.attrs and wall > 0:
+            ev["tokens_per_s"] = round(sp.attrs["tokens_out"] / wall, 2)
+        if prof is not None:
+            prof.disable()
+            _PROFILING.active = False
+            sampler.__exit__(None, None, None)
+            ev["sampled_peak_rss_mb"] = sampler.peak_mb
+            ev.update(_tm_exit(*tm))
+            if tracer.profile_dir:
+                os.makedirs(tracer.profile_dir, exist_ok=True)
+                path = os.path.join(tracer.profile_dir, f"{name.replace(':', '_')}-{ts_us}.prof")
+                prof.dump_stats(path)
+                ev["profile"] = path
+        tracer.record(ev)
+
+def traced(name=None):
+    """Decorator form of span(); defaults to module.function as the span name."""
+    def deco(fn):
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def run_traced(fn, span_name, profile=None, profile_dir=None, **kwargs):
+    """Runs fn under a fresh tracer (e.g. in a worker process); returns (result, span events)."""
+    tracer = Tracer(profile=profile, profile_dir=profile_dir)
+    with use_tracer(tracer), span(span_name):
+        res = fn(**kwargs)
+    return res, tracer.events
@@ -1,6 +1,8 @@
-import os, glob, textwrap
+import os, glob, json, time, hashlib, textwrap, threading, argparse
+import numpy as np
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
 
 # If you are using langchain_huggingface, switch import accordingly.
 try:
@@ -8,8 +10,21 @@ try:
 except Exception:
     from langchain_community.embeddings import HuggingFaceEmbeddings
 
+from .config import POLICY_INDEX_DIR, FLAT_INDEX_DIR, VECTOR_BACKEND, DEFAULT_EMBED_MODEL
+from .tracing import span, traced
+
 KB_DIR = "/content/aegis/aegis_streamlit_full/data/kb"
 
+COLLECTION_NAME = "aegis_policy"
+MANIFEST_NAME = "index_manifest.json"
+VECTORS_NAME = "embeddings.npy"
+CHUNKS_NAME = "chunks.json"
+CHUNK_SIZE = 600
+CHUNK_OVERLAP = 80
+
+_INDEX_LOCK = threading.Lock()
+_EMBEDDINGS = {}
+
 def _seed_kb_if_empty():
     os.makedirs(KB_DIR, exist_ok=True)
     files = glob.glob(os.path.join(KB_DIR, "*.txt"))
@@ -39,39 +54,292 @@ F-01 Fairness (DI>=0.80), O-02 Drift, E-04 RAG citations, G-01 Prompt injection
         with open(os.path.join(KB_DIR, fn), "w", encoding="utf-8") as f:
             f.write(textwrap.dedent(content).strip())
 
-def build_retriever(chroma_dir: str, rebuild: bool, k: int = 4):
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _load_manifest(index_dir: str):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _save_manifest(index_dir: str, manifest: dict):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def _get_embeddings(model_name: str):
+    if model_name not in _EMBEDDINGS:
+        _EMBEDDINGS[model_name] = HuggingFaceEmbeddings(model_name=model_name)
+    return _EMBEDDINGS[model_name]
+
+def _split_file(splitter, source: str, text: str):
+    # chunk id = hash(source + chunk text); identical chunks within a file collapse to one
+    out = {}
+    for ch in splitter.split_text(text):
+        out.setdefault(_sha(f"{source}\x00{ch}"), ch)
+    return out
+
+def _plan(index_dir: str, rebuild: bool, params: dict):
+    """Diffs the KB against the index manifest: (manifest or None, new_files, to_add, add_ids, del_ids, new_ids)."""
     _seed_kb_if_empty()
 
     kb_files = sorted(glob.glob(os.path.join(KB_DIR, "*.txt")))
     if not kb_files:
         raise ValueError(f"No KB .txt files found in {KB_DIR}")
 
-    docs = []
+    manifest = None if rebuild else _load_manifest(index_dir)
+    if manifest is not None and manifest.get("params") != params:
+        manifest = None  # embedding model or splitter changed -> vectors are stale
+    os.makedirs(index_dir, exist_ok=True)
+
+    old_files = (manifest or {}).get("files", {})
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    new_files, to_add = {}, {}
     for path in kb_files:
+        source = os.path.basename(path)
         with open(path, "r", encoding="utf-8") as f:
-            docs.append({"text": f.read(), "source": os.path.basename(path)})
+            text = f.read()
+        file_sha = _sha(text)
+        prev = old_files.get(source)
+        if prev and prev.get("sha") == file_sha:
+            new_files[source] = prev
+            continue
+        chunks = _split_file(splitter, source, text)
+        new_files[source] = {"sha": file_sha, "ids": list(chunks.keys())}
+        for cid, ch in chunks.items():
+            to_add[cid] = (ch, source)
+
+    old_ids = {cid for f in old_files.values() for cid in f.get("ids", [])}
+    new_ids = {cid for f in new_files.values() for cid in f["ids"]}
+    add_ids = [cid for cid in to_add if cid not in old_ids]
+    del_ids = sorted(old_ids - new_ids)
+    return manifest, new_files, to_add, add_ids, del_ids, new_ids
+
+def _fingerprint(params: dict, new_files: dict) -> str:
+    """Content hash of the indexed KB (file hashes + embedding/splitter params): same value, same retrieval results."""
+    doc = {"params": params, "files": {src: f["sha"] for src, f in sorted(new_files.items())}}
+    return _sha(json.dumps(doc, sort_keys=True))[:16]
+
+def _stats(index_dir, manifest, new_files, add_ids, del_ids, new_ids, backend):
+    return {
+        "backend": backend,
+        "index_dir": index_dir,
+        "rebuilt": manifest is None,
+        "files": len(new_files),
+        "chunks": len(new_ids),
+        "chunks_reused": len(new_ids) - len(add_ids),
+        "chunks_embedded": len(add_ids),
+        "chunks_deleted": len(del_ids),
+    }
+
+@traced("vectordb.index")
+def build_retriever(index_dir: str | None = None, rebuild: bool = False, k: int = 4, backend: str | None = None):
+    """
+    Incremental policy index shared across runs. Files and chunks are keyed by
+    content hash, so only added/changed chunks are embedded and chunks of
+    deleted files are dropped. rebuild=True wipes the index and re-embeds all.
+    backend: "chroma" or "npy" (default VECTOR_BACKEND).
+
+    Returns (retriever, stats).
+    """
+    backend = backend or VECTOR_BACKEND
+    if backend == "npy":
+        return build_flat_retriever(index_dir or FLAT_INDEX_DIR, rebuild=rebuild, k=k)
+    if backend != "chroma":
+        raise ValueError(f"unknown vector backend {backend!r} (chroma or npy)")
+    index_dir = index_dir or POLICY_INDEX_DIR
+
+    params = {"embed_model": DEFAULT_EMBED_MODEL, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+    with _INDEX_LOCK:
+        manifest, new_files, to_add, add_ids, del_ids, new_ids = _plan(index_dir, rebuild, params)
+
+        emb = _get_embeddings(DEFAULT_EMBED_MODEL)
+        vectordb = Chroma(collection_name=COLLECTION_NAME, embedding_function=emb, persist_directory=index_dir)
+        if manifest is None:
+            # full rebuild: drop whatever the collection holds (the chroma client may be cached, so no rmtree)
+            vectordb.delete_collection()
+            vectordb = Chroma(collection_name=COLLECTION_NAME, embedding_function=emb, persist_directory=index_dir)
+
+        if del_ids:
+            vectordb.delete(ids=del_ids)
+        if add_ids:
+            with span("vectordb.embed", chunks=len(add_ids)):
+                vectordb.add_texts(
+                    texts=[to_add[cid][0] for cid in add_ids],
+                    metadatas=[{"source": to_add[cid][1], "chunk_id": cid} for cid in add_ids],
+                    ids=add_ids,
+                )
+        if del_ids or add_ids:
+            vectordb.persist()
+
+        _save_manifest(index_dir, {"params": params, "files": new_files})
+
+    stats = _stats(index_dir, manifest, new_files, add_ids, del_ids, new_ids, "chroma")
+    fp = _fingerprint(params, new_files)
+    return vectordb.as_retriever(search_kwargs={"k": k}, metadata={"index_fingerprint": fp}), {**stats, "fingerprint": fp}
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+class FlatIndex:
+    """Unit-norm chunk embeddings (embeddings.npy, memory-mapped) plus chunks.json with ids/sources/texts in row order."""
+
+    def __init__(self, vectors: np.ndarray, ids: list, sources: list, texts: list):
+        self.vectors, self.ids, self.sources, self.texts = vectors, ids, sources, texts
+
+    @classmethod
+    def load(cls, index_dir: str) -> "FlatIndex":
+        with open(os.path.join(index_dir, CHUNKS_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(index_dir, VECTORS_NAME), mmap_mode="r")
+        return cls(vectors, meta["ids"], meta["sources"], meta["texts"])
+
+    def save(self, index_dir: str):
+        # write-then-rename: a crash mid-save leaves the previous index files intact
+        vec_tmp = os.path.join(index_dir, VECTORS_NAME + ".tmp.npy")
+        meta_tmp = os.path.join(index_dir, CHUNKS_NAME + ".tmp")
+        np.save(vec_tmp, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "sources": self.sources, "texts": self.texts}, f)
+        os.replace(vec_tmp, os.path.join(index_dir, VECTORS_NAME))
+        os.replace(meta_tmp, os.path.join(index_dir, CHUNKS_NAME))
+
+class FlatRetriever:
+    """
+    Exact cosine top-k over a FlatIndex. search_batch embeds each distinct query
+    with embed_query (the query-side path, e.g. instruction-prefixed models) and
+    scores them all with one matrix multiply; get_relevant_documents/invoke keep
+    the single-query retriever interface.
+    """
+
+    def __init__(self, index: FlatIndex, embeddings, k: int = 4, metadata: dict | None = None):
+        self.index, self.embeddings, self.k = index, embeddings, k
+        self.metadata = metadata or {}  # as on langchain retrievers: index_fingerprint
+
+    def search_batch(self, queries, k: int | None = None):
+        k = min(k or self.k, len(self.index.ids))
+        if not queries or k == 0:
+            return [[] for _ in queries]
+        uniq = list(dict.fromkeys(queries))
+        with span("vectordb.embed_queries", queries=len(queries), distinct=len(uniq)):
+            vecs = dict(zip(uniq, _normalize([self.embeddings.embed_query(t) for t in uniq])))
+            q = np.stack([vecs[t] for t in queries])
+        with span("vectordb.flat_search", queries=len(queries), chunks=len(self.index.ids)):
+            scores = q @ self.index.vectors.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        ix = self.index
+        return [[Document(page_content=ix.texts[j], metadata={"source": ix.sources[j], "chunk_id": ix.ids[j], "score": float(scores[r, j])})
+                 for j in row] for r, row in enumerate(top)]
+
+    def get_relevant_documents(self, query: str):
+        return self.search_batch([query])[0]
+
+    invoke = get_relevant_documents
+
+def build_flat_retriever(index_dir: str = FLAT_INDEX_DIR, rebuild: bool = False, k: int = 4):
+    """Same incremental KB index as build_retriever, stored as a flat .npy matrix; returns (FlatRetriever, stats)."""
+    params = {"embed_model": DEFAULT_EMBED_MODEL, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "normalized": True}
+
+    with _INDEX_LOCK:
+        manifest, new_files, to_add, add_ids, del_ids, new_ids = _plan(index_dir, rebuild, params)
+        old = None
+        if manifest is not None and os.path.exists(os.path.join(index_dir, CHUNKS_NAME)):
+            old = FlatIndex.load(index_dir)
+            if not set(new_ids) - set(add_ids) <= set(old.ids):
+                old = None  # matrix lost rows the manifest says it has: re-embed everything
+        if manifest is not None and old is None:
+            manifest, new_files, to_add, add_ids, del_ids, new_ids = _plan(index_dir, True, params)
+
+        emb = _get_embeddings(DEFAULT_EMBED_MODEL)
+        if old is None or add_ids or del_ids:
+            order = [cid for src in sorted(new_files) for cid in new_files[src]["ids"]]
+            pos = {cid: i for i, cid in enumerate(old.ids)} if old is not None else {}
+            fresh = {}
+            if add_ids:
+                with span("vectordb.embed", chunks=len(add_ids)):
+                    vecs = _normalize(emb.embed_documents([to_add[cid][0] for cid in add_ids]))
+                fresh = dict(zip(add_ids, vecs))
+            if fresh:
+                dim = next(iter(fresh.values())).shape[0]
+            else:  # nothing new to embed: keep the old width, or 0 for an empty KB
+                dim = old.vectors.shape[1] if old is not None else 0
+            vectors = np.empty((len(order), dim), dtype=np.float32)
+            sources, texts = [], []
+            for i, cid in enumerate(order):
+                if cid in fresh:
+                    vectors[i] = fresh[cid]
+                    sources.append(to_add[cid][1])
+                    texts.append(to_add[cid][0])
+                else:
+                    j = pos[cid]
+                    vectors[i] = old.vectors[j]
+                    sources.append(old.sources[j])
+                    texts.append(old.texts[j])
+            FlatIndex(vectors, order, sources, texts).save(index_dir)
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=600, chunk_overlap=80)
-    chunks = []
-    for d in docs:
-        for ch in splitter.split_text(d["text"]):
-            chunks.append((ch, d["source"]))
+        _save_manifest(index_dir, {"params": params, "files": new_files})
+        index = FlatIndex.load(index_dir)
 
-    emb = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    stats = _stats(index_dir, manifest, new_files, add_ids, del_ids, new_ids, "npy")
+    fp = _fingerprint(params, new_files)
+    return FlatRetriever(index, emb, k=k, metadata={"index_fingerprint": fp}), {**stats, "fingerprint": fp}
 
-    os.makedirs(chroma_dir, exist_ok=True)
-    if rebuild:
-        # wipe old
-        for fn in os.listdir(chroma_dir):
-            try:
-                os.remove(os.path.join(chroma_dir, fn))
-            except Exception:
-                pass
+BENCH_QUERIES = [
+    "What does the standard say about prompt injection and data exfiltration?",
+    "Which fairness threshold applies to disparate impact?",
+    "How must RAG answers cite their sources?",
+    "What monitoring is required for model drift?",
+    "Which explainability artifacts must be stored?",
+    "What belongs in a model card?",
+    "How are secrets and system prompts protected?",
+    "Who approves a model before release?",
+]
 
-    texts = [c[0] for c in chunks]
-    metas = [{"source": c[1]} for c in chunks]
+def benchmark(n_queries: int = 64, k: int = 4, repeats: int = 3) -> dict:
+    """Latency of the Chroma path (one retriever call per query) vs the .npy path (one batched search)."""
+    queries = (BENCH_QUERIES * (n_queries // len(BENCH_QUERIES) + 1))[:n_queries]
+    out = {"queries": n_queries, "k": k}
+    for backend in ("chroma", "npy"):
+        t0 = time.perf_counter()
+        retriever, stats = build_retriever(k=k, backend=backend)
+        startup = time.perf_counter() - t0
+        runs = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            if backend == "npy":
+                retriever.search_batch(queries, k)
+            else:
+                for q in queries:
+                    retriever.get_relevant_documents(q)
+            runs.append(time.perf_counter() - t0)
+        best = min(runs)
+        out[backend] = {"startup_s": round(startup, 3), "batch_s": round(best, 4),
+                        "per_query_ms": round(1000 * best / n_queries, 3), "chunks": stats["chunks"]}
+    out["speedup"] = round(out["chroma"]["batch_s"] / max(out["npy"]["batch_s"], 1e-9), 1)
+    return out
 
-    vectordb = Chroma.from_texts(texts=texts, embedding=emb, metadatas=metas, persist_directory=chroma_dir)
-    vectordb.persist()
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the policy index or compare retriever backends.")
+    ap.add_argument("--backend", default=None, help="chroma or npy (default: AEGIS_VECTOR_BACKEND)")
+    ap.add_argument("--rebuild", action="store_true")
+    ap.add_argument("--bench", action="store_true", help="time Chroma vs .npy retrieval")
+    ap.add_argument("--queries", type=int, default=64)
+    args = ap.parse_args(argv)
+    if args.bench:
+        print(json.dumps(benchmark(args.queries), indent=2))
+    else:
+        print(json.dumps(build_retriever(rebuild=args.rebuild, backend=args.backend)[1], indent=2))
 
-    return vectordb.as_retriever(search_kwargs={"k": k})
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import time, threading, contextvars, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .tracing import span, current_tracer, run_traced, cancel_scope
+from .utils import now_utc
+from .config import PROCESS_WORKERS
+
+class WorkflowError(RuntimeError):
+    def __init__(self, msg, logs=None, failed=None):
+        super().__init__(msg)
+        self.logs = logs or []
+        self.failed = failed or {}
+
+@dataclass
+class Node:
+    """
+    One workflow step. fn is called with the declared inputs as keyword
+    arguments and returns the declared outputs (a tuple when there are several).
+    pool="process" runs fn in a spawned worker process, so fn and its inputs
+    must be picklable (module-level functions / functools.partial).
+    log maps the outputs dict to extra fields for this node's log entry.
+    optional lists inputs the node can do without: if their producer does not
+    complete, the node still runs and receives None for them.
+    """
+    name: str
+    fn: Callable
+    inputs: tuple = ()
+    outputs: tuple = ()
+    pool: str = "thread"
+    timeout: Optional[float] = None
+    log: Optional[Callable] = None
+    meta: dict = field(default_factory=dict)
+    optional: tuple = ()
+
+def _run_node(node, kwargs, cancel):
+    with cancel_scope(cancel), span(f"node:{node.name}"):
+        return node.fn(**kwargs)
+
+_PROCS = (None, 0)  # (spawn pool, size) shared by every run_dag call in this process; workers stay warm
+_PROCS_LOCK = threading.Lock()
+
+def _process_pool(workers: int):
+    global _PROCS
+    workers = max(1, workers)
+    with _PROCS_LOCK:
+        pool, size = _PROCS
+        if pool is None or size < workers or getattr(pool, "_broken", False):
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _PROCS = (pool, workers)
+        return pool
+
+def _call(fn, *args, **kwargs):
+    # log/on_event callbacks report on a step; an error in one must not fail the run
+    try:
+        return fn(*args, **kwargs), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def run_dag(nodes, ctx=None, max_workers: int = 4, process_workers: int = PROCESS_WORKERS, logs=None, on_event=None):
+    """
+    Runs nodes as soon as the producers of their inputs have finished.
+    Independent nodes run concurrently; a failed or timed-out node only skips
+    its dependents (or, for an optional input, passes None). Returns (ctx, status) where ctx holds every produced output
+    and status maps node name -> ok | failed | timeout | skipped.
+    on_event(name, status, entry) is called as nodes start and finish.
+    A timed-out thread node is cancelled at its next span boundary (tracing.Cancelled);
+    a process node cannot be interrupted and finishes in the shared pool.
+    """
+    ctx = dict(ctx or {})
+    logs = logs if logs is not None else []
+    producers = {out: n.name for n in nodes for out in n.outputs}
+    pending = {n.name: n for n in nodes}
+    status, running = {}, {}
+    tracer = current_tracer()
+
+    threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aegis-node")
+
+    def event(name, st, entry):
+        if on_event:
+            _, err = _call(on_event, name, st, entry)
+            if err:
+                entry.setdefault("on_event_error", err)
+
+    def finish(node, entry, st, extra=None):
+        status[node.name] = st
+        entry.update({"status": st, **(extra or {})})
+        logs.append(entry)
+        event(node.name, st, entry)
+
+    try:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for name, n in list(pending.items()):
+                    deps = {producers[i] for i in n.inputs if i in producers and i not in n.optional}
+                    opt_deps = {producers[i] for i in n.optional if i in producers}
+                    missing = [i for i in n.inputs if i not in producers and i not in ctx and i not in n.optional]
+                    bad = [d for d in deps if status.get(d) in ("failed", "timeout", "skipped")]
+                    if bad or missing:
+                        del pending[name]
+                        reason = f"upstream {','.join(sorted(bad))} did not complete" if bad else f"missing inputs {missing}"
+                        finish(n, {"node": name}, "skipped", {"reason": reason})
+                        changed = True
+                    elif all(status.get(d) == "ok" for d in deps) and all(d in status for d in opt_deps):
+                        del pending[name]
+                        kwargs = {i: ctx.get(i) if i in n.optional else ctx[i] for i in n.inputs}
+                        cancel = None
+                        if n.pool == "process":
+                            procs = _process_pool(process_workers)
+                            if tracer is not None:
+                                # spans recorded in the worker come back with the result and are merged here
+                                fut = procs.submit(run_traced, n.fn, f"node:{name}", profile=sorted(tracer.profile),
+                                                   profile_dir=tracer.profile_dir, **kwargs)
+                            else:
+                                fut = procs.submit(n.fn, **kwargs)
+                        else:
+                            cancel = threading.Event()
+                            fut = threads.submit(contextvars.copy_context().run, _run_node, n, kwargs, cancel)
+                        t0 = time.perf_counter()
+                        running[fut] = (n, {"node": name, "start": now_utc()}, t0, cancel)
+                        event(name, "running", {"node": name})
+                        changed = True
+
+            if not running:
+                break
+
+            deadlines = [t0 + n.timeout - time.perf_counter() for n, _, t0, _ in running.values() if n.timeout]
+            done, _ = wait(list(running), timeout=max(0.0, min(deadlines)) if deadlines else None, return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                n, entry, t0, _ = running.pop(fut)
+                timing = {"end": now_utc(), "duration_s": round(time.perf_counter() - t0, 3)}
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    finish(n, entry, "failed", {**timing, "error": f"{type(e).__name__}: {e}"})
+                    continue
+                if n.pool == "process" and tracer is not None:
+                    res, events = res
+                    tracer.merge(events)
+                vals = res if len(n.outputs) > 1 else (res,)
+                out = dict(zip(n.outputs, vals)) if n.outputs else {}
+                ctx.update(out)
+                extra, err = _call(n.log, out) if n.log else ({}, None)
+                finish(n, entry, "ok", {**timing, **(extra or {}), **({"log_error": err} if err else {})})
+
+            for fut, (n, entry, t0, cancel) in list(running.items()):
+                if n.timeout and time.perf_counter() - t0 >= n.timeout:
+                    running.pop(fut)
+                    fut.cancel()
+                    if cancel is not None:
+                        cancel.set()  # a started thread stops at its next span; its result is discarded
+                    finish(n, entry, "timeout", {"end": now_utc(), "duration_s": round(time.perf_counter() - t0, 3), "timeout_s": n.timeout})
+    finally:
+        for fut, (*_, cancel) in running.items():
+            fut.cancel()
+            if cancel is not None:
+                cancel.set()
+        threads.shutdown(wait=False, cancel_futures=True)
+
+    return ctx, status
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from engine import config
+from engine.controls_risks import get_catalog, eval_controls, build_risk_register
+from engine.evidence import EvidenceBundle
+
+def test_default_catalog_ships_with_the_package():
+    assert os.path.exists(config.PACKAGED_CONTROLS_CATALOG)
+    assert get_catalog(config.PACKAGED_CONTROLS_CATALOG).controls
+
+def test_eval_controls_with_default_catalog(tmp_path):
+    b = EvidenceBundle(str(tmp_path))
+    b.put("fairness", {"disparate_impact_selection_rate": 0.5})
+    status = eval_controls(b).set_index("control_id")["status"]
+    assert status["F-01"] == "FAIL"
+
+def test_missing_catalog_names_the_path(tmp_path):
+    with pytest.raises(FileNotFoundError, match="AEGIS_CONTROLS_CATALOG"):
+        get_catalog(str(tmp_path / "nope.json"))
+
+def _bundle(tmp_path, di=0.9, dscore=0.1, psi=None, cov=0.8, faith=0.2, refusal=1.0, shap_rows=100):
+    b = EvidenceBundle(str(tmp_path))
+    b.put("fairness", {"disparate_impact_selection_rate": di})
+    b.put("drift", {"drift_score_mean_top10": dscore, **({"psi_max": psi, "ks_max": 0.1} if psi is not None else {})})
+    b.put("rag_quality", {"citation_coverage": cov, "faithfulness_overlap": faith, "refusal_rate": refusal})
+    b.put("ml_metrics", {"explainability": {"rows_explained": shap_rows}})
+    return b
+
+def _status(b):
+    cdf = eval_controls(b)
+    return dict(zip(cdf["control_id"], cdf["status"]))
+
+@pytest.mark.parametrize("di,cov,faith", [(0.9, 0.8, 0.2), (0.5, 0.1, 0.05), (0.8, 0.7, 0.12)])
+def test_original_rules_hold_for_unchanged_controls(tmp_path, di, cov, faith):
+    st = _status(_bundle(tmp_path, di=di, cov=cov, faith=faith))
+    assert st["F-01"] == ("PASS" if di >= 0.8 else "FAIL")
+    assert st["E-04"] == ("PASS" if cov >= 0.7 else "REVIEW")
+    assert st["E-05"] == ("PASS" if faith >= 0.12 else "REVIEW")
+
+def test_drift_uses_psi_and_falls_back_to_the_drift_score(tmp_path):
+    assert _status(_bundle(tmp_path, psi=0.3, dscore=0.0))["O-02"] == "REVIEW"
+    assert _status(_bundle(tmp_path, psi=0.1, dscore=0.9))["O-02"] == "PASS"
+    assert _status(_bundle(tmp_path, psi=None, dscore=0.5))["O-02"] == "REVIEW"
+
+def test_refusal_and_explainability_rules(tmp_path):
+    b = _bundle(tmp_path, refusal=0.5, shap_rows=0)
+    st = _status(b)
+    assert st["G-01"] == "FAIL" and st["E-01"] == "REVIEW"
+    assert "R-SEC-01" in set(build_risk_register(b)["risk_id"])
+
+def test_fleet_manifest_threshold_columns_follow_the_catalog(tmp_path):
+    from engine.fleet import load_manifest
+    path = tmp_path / "fleet.csv"
+    path.write_text("dataset_path,target_col,sensitive_col,di_min,psi_max,other\nd.csv,y,s,0.9,0.1,3\n")
+    assert load_manifest(str(path))[0]["thresholds"] == {"di_min": 0.9, "psi_max": 0.1}
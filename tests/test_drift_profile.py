@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from engine.drift_profile import build_reference_profile, dataset_fingerprint, reference_profile
+
+def test_reference_profile_built_once_per_key(tmp_path):
+    X = pd.DataFrame({"x": np.arange(100.0), "c": ["a", "b"] * 50})
+    calls = []
+
+    def build():
+        calls.append(1)
+        return build_reference_profile(X, ["x"], ["c"])
+
+    key = {"dataset": "abc", "num": ["x"], "cat": ["c"]}
+    first, reused_first = reference_profile(key, build, root=str(tmp_path))
+    second, reused_second = reference_profile(key, build, root=str(tmp_path))
+    assert (reused_first, reused_second) == (False, True)
+    assert first == second and len(calls) == 1
+    reference_profile({**key, "dataset": "other"}, build, root=str(tmp_path))
+    assert len(calls) == 2
+
+def test_dataset_fingerprint_follows_content(tmp_path):
+    path = tmp_path / "d.csv"
+    path.write_text("a,b\n1,2\n")
+    before = dataset_fingerprint(str(path))
+    assert dataset_fingerprint(str(path)) == before
+    path.write_text("a,b\n1,3\n")
+    assert dataset_fingerprint(str(path)) != before
+
+def _profiled_run(tmp_path, n=2000, seed=0):
+    from engine.drift_profile import PROFILE_NAME, save_profile
+    from engine.evidence import EvidenceBundle
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({"x": rng.normal(10, 1, n), "y": rng.normal(5, 1, n), "c": rng.choice(["a", "b"], n)})
+    ev = tmp_path / "ev"
+    ev.mkdir()
+    save_profile(str(ev / PROFILE_NAME), build_reference_profile(X, ["x", "y"], ["c"]))
+    b = EvidenceBundle(str(ev))
+    b.put("fairness", {"disparate_impact_selection_rate": 0.9})
+    b.save("run-1")
+    return str(ev), X
+
+def test_check_drift_writes_through_the_bundle_with_control_fields(tmp_path):
+    from engine.drift_profile import check_drift
+    from engine.evidence import load_evidence
+    from engine.controls_risks import eval_controls
+    ev, X = _profiled_run(tmp_path)
+    shifted = X.assign(x=X["x"] * 1.5)
+    out = check_drift(ev, shifted)
+    assert abs(out["drift_score_mean_top10"] - np.mean([0.5, 0.0])) < 0.02
+    assert list(out["top"]) == ["x", "y"] and out["psi_max"] > 0.25
+    b = load_evidence(ev)
+    assert b.run_id == "run-1" and b.get("drift") == out
+    assert b.get("fairness") == {"disparate_impact_selection_rate": 0.9}  # the rest of the bundle is kept
+    status = dict(zip(*eval_controls(b)[["control_id", "status"]].to_numpy().T))
+    assert status["O-02"] == "REVIEW"
+
+def test_check_drift_updates_a_passed_bundle_only(tmp_path):
+    from engine.drift_profile import check_drift
+    from engine.evidence import load_evidence
+    ev, X = _profiled_run(tmp_path)
+    b = load_evidence(ev)
+    out = check_drift(ev, X, bundle=b)
+    assert b.get("drift") is out and out["drift_score_mean_top10"] < 0.01
+    assert "drift" not in load_evidence(ev)
+
+def test_sketch_ks_is_within_one_sketch_step_of_exact(tmp_path):
+    from engine.drift_profile import score_batch
+    rng = np.random.default_rng(1)
+    ref, cur = rng.normal(0, 1, 5000), rng.normal(0.3, 1.2, 3000)
+    prof = build_reference_profile(pd.DataFrame({"x": ref}), ["x"], [])
+    sketch = score_batch(prof, pd.DataFrame({"x": cur}))["ks_max"]
+    grid = np.sort(np.concatenate([ref, cur]))
+    exact = np.max(np.abs(np.searchsorted(np.sort(ref), grid, side="right") / len(ref)
+                          - np.searchsorted(np.sort(cur), grid, side="right") / len(cur)))
+    assert sketch <= exact <= sketch + 1.5 / 100
@@ -0,0 +1,54 @@
+import functools, pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from engine import drift_profile, ml_stream_audit
+from engine.evidence import EvidenceBundle, load_evidence
+
+def _chunk(i, n=50):
+    return pd.DataFrame({"y_true": np.arange(n) % 2, "y_score": np.linspace(0, 1, n) + i, "sensitive": np.full(n, i)})
+
+def test_multi_chunk_append_round_trip(tmp_path):
+    b = EvidenceBundle(str(tmp_path))
+    for i in range(4):
+        b.append("eval_scores", _chunk(i))
+    b.put("ml_metrics", {"accuracy": 0.5})
+    b.save("run-1")
+
+    got = load_evidence(str(tmp_path)).table("eval_scores")
+    pd.testing.assert_frame_equal(got, pd.concat([_chunk(i) for i in range(4)], ignore_index=True))
+    assert load_evidence(str(tmp_path)).get("ml_metrics") == {"accuracy": 0.5}
+
+def test_append_after_pickle_round_trip(tmp_path):
+    b = EvidenceBundle(str(tmp_path))
+    b.append("eval_scores", _chunk(0))
+    b = pickle.loads(pickle.dumps(b))
+    assert len(b.table("eval_scores")) == 50
+
+def test_concurrent_put_and_update(tmp_path):
+    b = EvidenceBundle(str(tmp_path))
+
+    def stage(i):
+        other = EvidenceBundle(str(tmp_path))
+        other.put(f"t{i}", _chunk(i, 5))
+        b.update(other)
+        b.put(f"doc{i}", {"i": i})
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(stage, range(64)))
+    assert all(f"t{i}" in b and b.get(f"doc{i}") == {"i": i} for i in range(64))
+
+def test_streaming_audit_writes_every_chunk(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({"a": rng.normal(size=n), "c": rng.choice(list("xyz"), n),
+                       "s": rng.integers(0, 2, n), "y": rng.integers(0, 2, n)})
+    df.to_csv(tmp_path / "d.csv", index=False)
+    monkeypatch.setattr(ml_stream_audit, "reference_profile",
+                        functools.partial(drift_profile.reference_profile, root=str(tmp_path / "profiles")))
+
+    ml_stream_audit.run_ml_audit_streaming(str(tmp_path / "ev"), str(tmp_path / "d.csv"), "y", "s", chunksize=400)
+    scores = load_evidence(str(tmp_path / "ev")).table("eval_scores")
+    assert len(scores) == load_evidence(str(tmp_path / "ev")).get("ml_metrics")["n_test"] > 400
@@ -0,0 +1,79 @@
+from itertools import combinations
+from math import factorial
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from engine import explain
+from engine.explain import KernelShapFallback, LinearShap, get_explainer
+
+def _frame(n=120, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({"x": rng.normal(size=n), "z": rng.normal(size=n), "c": rng.choice(["a", "b", "c"], n)})
+    y = ((X["x"] + (X["c"] == "a") + rng.normal(scale=0.5, size=n)) > 0.5).astype(int)
+    return X, y
+
+def _pipeline(clf, sparse_threshold):
+    pre = ColumnTransformer([("num", StandardScaler(), ["x", "z"]),
+                             ("cat", OneHotEncoder(handle_unknown="ignore"), ["c"])], sparse_threshold=sparse_threshold)
+    return Pipeline([("pre", pre), ("clf", clf)])
+
+def _brute_force(model, X_bg, X):
+    """Exact interventional Shapley values of the logit, enumerating every feature subset."""
+    pre, clf = model.named_steps["pre"], model.named_steps["clf"]
+    bg, Z = explain._dense(pre.transform(X_bg)), explain._dense(pre.transform(X))
+    m = Z.shape[1]
+
+    def v(z, S):
+        mixed = bg.copy()
+        mixed[:, list(S)] = z[list(S)]
+        return clf.decision_function(mixed).mean()
+
+    out = np.zeros_like(Z)
+    for r, z in enumerate(Z):
+        for j in range(m):
+            rest = [k for k in range(m) if k != j]
+            for size in range(m):
+                w = factorial(size) * factorial(m - size - 1) / factorial(m)
+                for S in combinations(rest, size):
+                    out[r, j] += w * (v(z, S + (j,)) - v(z, S))
+    return out
+
+@pytest.mark.parametrize("sparse_threshold", [0.0, 1.0])
+def test_linear_shap_matches_brute_force(sparse_threshold):
+    X, y = _frame()
+    model = _pipeline(LogisticRegression(), sparse_threshold).fit(X, y)
+    assert sparse.issparse(model.named_steps["pre"].transform(X)) == (sparse_threshold == 1.0)
+    exp = LinearShap(model, X)
+    phi = exp.values(X.iloc[:8])
+    np.testing.assert_allclose(phi, _brute_force(model, X, X.iloc[:8]), atol=1e-9)
+    # attributions sum to the logit minus the base value
+    np.testing.assert_allclose(phi.sum(axis=1) + exp.base_value, model.decision_function(X.iloc[:8]), atol=1e-9)
+
+@pytest.mark.parametrize("sparse_threshold", [0.0, 1.0])
+def test_abs_sums_match_per_row_values(sparse_threshold, monkeypatch):
+    monkeypatch.setattr(explain, "BLOCK_ROWS", 32)  # several blocks
+    X, y = _frame()
+    model = _pipeline(LogisticRegression(), sparse_threshold).fit(X, y)
+    exp = LinearShap(model, X)
+    codes = (np.arange(len(X)) % 3).astype(np.int64)
+    sums, counts = exp.abs_sums(X, codes, 3)
+    expected = pd.DataFrame(np.abs(exp.values(X))).groupby(codes).sum().to_numpy()
+    np.testing.assert_allclose(sums, expected, atol=1e-9)
+    assert counts.tolist() == np.bincount(codes).tolist()
+
+def test_non_linear_models_fall_back_to_sampled_shap():
+    pytest.importorskip("shap")
+    X, y = _frame()
+    linear = _pipeline(LogisticRegression(), 0.0).fit(X, y)
+    forest = _pipeline(RandomForestClassifier(n_estimators=5, random_state=0), 0.0).fit(X, y)
+    assert isinstance(get_explainer(linear, X), LinearShap)
+    assert isinstance(get_explainer(forest, X), KernelShapFallback)
+    assert get_explainer(forest, X) is get_explainer(forest, X)
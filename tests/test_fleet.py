@@ -0,0 +1,23 @@
+import os
+
+from engine.fleet import _submit_ml, _collect_ml, _retry_isolated
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+def _worker(spec, evidence_dir):
+    if spec["model"] == "crash":
+        os._exit(1)  # takes the whole pool down
+    if spec["model"] == "raise":
+        raise ValueError("bad dataset")
+    return {"di": 1.0}, None, spec["model"]
+
+def test_crashing_worker_only_fails_its_own_model():
+    runs = [{"spec": {"model": m}, "evidence_dir": ""} for m in ("a", "crash", "raise", "b")]
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futs, lost = _submit_ml(pool, runs, _worker)
+        lost += _collect_ml(futs)
+    _retry_isolated(lost, _worker)
+    by = {r["spec"]["model"]: r for r in runs}
+    assert by["a"]["bundle"] == "a" and by["b"]["bundle"] == "b"
+    assert "BrokenProcessPool" in by["crash"]["error"]
+    assert "ValueError" in by["raise"]["error"]
@@ -0,0 +1,33 @@
+import sqlite3, sys, types
+
+import pytest
+
+from engine import jobs, run_store
+from engine.workflow import WorkflowError
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_store, "DB_PATH", str(tmp_path / "runs.db"))
+    return run_store
+
+def test_failed_workflow_keeps_its_logs(store, monkeypatch):
+    def run_aegis(run_id, on_event, **params):
+        raise WorkflowError("ml_audit failed", logs=[{"step": "ml_audit", "status": "failed"}])
+
+    monkeypatch.setitem(sys.modules, "engine.orchestrator", types.SimpleNamespace(run_aegis=run_aegis))
+    store.insert_job("j1", {}, jobs.now_utc())
+    jobs.JobRunner._execute(None, store.claim_job("w", jobs.now_utc()))
+
+    job = store.load_job("j1")
+    assert job["status"] == "failed" and job["error"] == "ml_audit failed"
+    assert job["logs"] == [{"step": "ml_audit", "status": "failed"}]
+
+def test_jobs_table_of_older_db_gains_logs_column(store):
+    con = sqlite3.connect(store.DB_PATH)
+    con.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, submitted_at TEXT NOT NULL, "
+                "submitted_by TEXT, params_json TEXT, started_at TEXT, finished_at TEXT, worker TEXT, run_id TEXT, "
+                "stages_json TEXT, error TEXT)")
+    con.execute("INSERT INTO jobs (job_id, status, submitted_at) VALUES ('old', 'done', '2024-01-01')")
+    con.commit()
+    con.close()
+    assert store.load_job("old")["logs"] == []
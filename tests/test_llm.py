@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from engine.llm import stop_on_refusal
+from engine.rag_audit_agent import _stop_checks, _cache_decoding, generation_config
+
+def test_refusal_stop_waits_for_the_opening_sentence():
+    check = stop_on_refusal()
+    assert check("I cannot share") is None
+    assert check("I cannot share that. ") == "refusal"
+    assert check("The system must refuse prompt-injection attempts [1]. More") is None
+
+def test_refusal_stop_only_for_should_refuse_prompts(monkeypatch):
+    import engine.rag_audit_agent as ra
+    monkeypatch.setattr(ra, "GEN_EARLY_STOP", True)
+    text = "I cannot find this in the context. Please provide the retention policy."
+    assert not any(c(text) for c in _stop_checks(strict=False, policy_like=False))
+    assert any(c(text) == "refusal" for c in _stop_checks(strict=False, policy_like=False, should_refuse=True))
+    assert _cache_decoding(True, True, 64, False) != _cache_decoding(True, True, 64, True)
+
+def test_generation_config_covers_length_and_early_stop(monkeypatch):
+    import engine.rag_audit_agent as ra
+    monkeypatch.setattr(ra, "GEN_EARLY_STOP", True)
+    base = generation_config(True, True, 64)
+    assert base != generation_config(True, True, 128)
+    monkeypatch.setattr(ra, "GEN_STOP_CHECK_EVERY", base["early_stop"]["check_every"] + 1)
+    assert base != generation_config(True, True, 64)
+    monkeypatch.setattr(ra, "GEN_EARLY_STOP", False)
+    assert "early_stop" not in generation_config(True, True, 64)
+
+def test_unknown_should_refuse_gets_the_refusal_stop(monkeypatch):
+    import types
+    import engine.rag_audit_agent as ra
+    monkeypatch.setattr(ra, "GEN_EARLY_STOP", True)
+    doc = types.SimpleNamespace(page_content="Retention is 7 years.", metadata={"source": "kb.txt"})
+    monkeypatch.setattr(ra, "_retrieve_many", lambda retriever, queries, k: [[doc] for _ in queries])
+    seen = {}
+
+    def generate_batch(gen, prompts, checks, **kw):
+        seen["checks"] = checks
+        return ["I cannot share that. Sorry." for _ in prompts]
+
+    monkeypatch.setattr(ra, "generate_batch", generate_batch)
+    monkeypatch.setattr(ra, "model_id_of", lambda gen: "m")
+    ra.rag_answer_batch(None, None, ["q one", "q two", "q three"], strict=False, should_refuse=[None, False, True])
+    refusal = [any(c("I cannot share that. ") == "refusal" for c in checks) for checks in seen["checks"]]
+    assert refusal == [True, False, True]
@@ -0,0 +1,96 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import engine.llm_registry as reg
+
+def _gen(device, footprint_bytes):
+    model = SimpleNamespace(device=SimpleNamespace(type=device), get_memory_footprint=lambda: footprint_bytes)
+    return SimpleNamespace(model=model)
+
+def test_cpu_footprint_is_the_rss_delta():
+    # a dynamically quantized model reports far less than it occupies
+    assert reg._footprint_gb(_gen("cpu", 100 * 1024**2), rss_delta_mb=2048) == 2.0
+    assert reg._footprint_gb(_gen("cpu", 0), rss_delta_mb=-5) == 0.0
+
+def test_gpu_or_unmeasured_footprint_falls_back_to_the_model():
+    assert reg._footprint_gb(_gen("cuda", 1024**3), rss_delta_mb=300) == 1.0
+    assert reg._footprint_gb(_gen("cpu", 1024**3)) == 1.0
+
+def test_registry_budgets_on_the_load_rss(monkeypatch):
+    loads = iter([1536, 1536])
+    class FakeSampler:
+        def __enter__(self):
+            self.delta_mb = next(loads)
+            return self
+        def __exit__(self, *exc):
+            return False
+    monkeypatch.setattr(reg, "RssSampler", FakeSampler)
+    monkeypatch.setattr(reg, "load_local_llm", lambda m, quant, device: (_gen("cpu", 1), "int8"))
+    monkeypatch.setattr(reg, "resolve_mode", lambda quant, device: ("cpu", "int8"))
+    r = reg.LLMRegistry(budget_gb=2.0)
+    assert r.get("a")[2]["mem_gb"] == 1.5
+    assert r.get("b")[2]["evicted"] == ["a"]
+
+class _Sampler:
+    delta_mb = 100
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+def _fake_modes(quant, device):
+    return ("cpu", "int8" if quant in ("auto", "int8") else quant)
+
+def test_auto_and_explicit_mode_share_one_load(monkeypatch):
+    calls = []
+    monkeypatch.setattr(reg, "RssSampler", _Sampler)
+    monkeypatch.setattr(reg, "resolve_mode", _fake_modes)
+    monkeypatch.setattr(reg, "load_local_llm", lambda m, quant, device: calls.append(m) or (_gen("cpu", 1), "cpu-int8"))
+    r = reg.LLMRegistry(budget_gb=10)
+    r.get("a")
+    assert r.get("a", quant="int8", device="cpu")[2]["warm"]
+    assert calls == ["a"]
+    assert r.loaded()[0]["quant"] == "int8"
+
+def test_warm_hit_does_not_wait_for_a_cold_load(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def load(m, quant, device):
+        calls.append(m)
+        if m == "b":
+            started.set()
+            assert release.wait(5)
+        return _gen("cpu", 1), "cpu-int8"
+    monkeypatch.setattr(reg, "RssSampler", _Sampler)
+    monkeypatch.setattr(reg, "resolve_mode", _fake_modes)
+    monkeypatch.setattr(reg, "load_local_llm", load)
+    r = reg.LLMRegistry(budget_gb=10)
+    r.get("a")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(r.get("b")[2])) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+    assert r.get("a")[2]["warm"]  # returns while b is still loading
+    assert r.total_gb() < 10
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert calls == ["a", "b"]
+    assert sorted(i["warm"] for i in results) == [False, True]
+
+def test_failed_load_is_not_cached(monkeypatch):
+    def load(m, quant, device):
+        raise OSError("no weights")
+    monkeypatch.setattr(reg, "RssSampler", _Sampler)
+    monkeypatch.setattr(reg, "resolve_mode", _fake_modes)
+    monkeypatch.setattr(reg, "load_local_llm", load)
+    r = reg.LLMRegistry(budget_gb=10)
+    with pytest.raises(OSError):
+        r.get("a")
+    assert r.loaded() == [] and r._loading == {}
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from engine import ml_audit_agent as ma
+
+def _frame(n=200):
+    rng = np.random.default_rng(0)
+    cat = np.where(np.arange(n) < 3, "rare", rng.choice(["a", "b"], n))
+    return pd.DataFrame({"x": rng.normal(size=n), "c": cat}), (rng.random(n) > 0.5).astype(int)
+
+def test_rare_levels_kept_by_default(monkeypatch):
+    monkeypatch.setattr(ma, "ML_RARE_MIN_COUNT", 0)
+    X, y = _frame()
+    stats = ma._fit_model(ma._build_model(["x"], ["c"]), X, y)
+    assert stats["n_features"] == 4 and stats["rare_levels_bucketed"] == 0
+
+def test_rare_levels_bucketed_when_enabled(monkeypatch):
+    monkeypatch.setattr(ma, "ML_RARE_MIN_COUNT", 10)
+    X, y = _frame()
+    stats = ma._fit_model(ma._build_model(["x"], ["c"]), X, y)
+    assert stats["n_features"] == 4 and stats["rare_levels_bucketed"] == 1
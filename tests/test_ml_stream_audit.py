@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.ml_stream_audit import Reservoir, _iter_chunks, _probe, infer_dtypes
+
+def _csv(tmp_path):
+    # the target is int in the first chunk and has a missing value in the second
+    path = tmp_path / "data.csv"
+    rows = [f"{i},{i % 2},{'a' if i % 3 else 'b'}" for i in range(8)] + ["8,,a", "9,1.0,b"]
+    path.write_text("x,y,g\n" + "\n".join(rows) + "\n")
+    return str(path)
+
+def test_infer_dtypes_pins_every_column():
+    probe = pd.DataFrame({"x": [1, 2], "y": [0, 1], "g": ["a", "b"]})
+    assert infer_dtypes(probe, "y") == {"x": "float32", "y": "float64", "g": "object"}
+
+def test_reservoir_keeps_nan_target_from_a_later_chunk(tmp_path):
+    path = _csv(tmp_path)
+    dtypes = infer_dtypes(_probe(path, rows=4), "y")
+    res = Reservoir(20)
+    for chunk in _iter_chunks(path, 4, dtypes):
+        res.add(chunk)
+    df = res.frame()
+    assert df["y"].dtype == np.float64 and df["y"].isna().sum() == 1 and df["y"].sum() == 5
+
+def test_reservoir_rejects_incompatible_chunk(tmp_path):
+    res = Reservoir(20)
+    res.add(pd.DataFrame({"y": np.array([0, 1], dtype=np.int64)}))
+    with pytest.raises(ValueError, match="column 'y'"):
+        res.add(pd.DataFrame({"y": [1.0, np.nan]}))
@@ -0,0 +1,41 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from engine.remediation_agent import threshold_tune_groupwise, _candidates, _group_curve, _di
+
+def _brute_force(y_true, y_score, s, target_di):
+    """Best accuracy over every threshold pair with DI >= target (None when no pair qualifies)."""
+    m0, m1 = s == 0, s == 1
+    c0, c1 = _candidates(y_score[m0]), _candidates(y_score[m1])
+    sel0, cor0 = _group_curve(y_true[m0], y_score[m0], c0)
+    sel1, cor1 = _group_curve(y_true[m1], y_score[m1], c1)
+    best = None
+    for i, j in itertools.product(range(len(c0)), range(len(c1))):
+        if _di(sel0[i] / m0.sum(), sel1[j] / m1.sum()) >= target_di:
+            acc = (cor0[i] + cor1[j]) / len(y_true)
+            best = acc if best is None else max(best, acc)
+    return best
+
+@pytest.mark.parametrize("seed", range(200))
+@pytest.mark.parametrize("target_di", [0.8, 0.9])
+def test_groupwise_matches_brute_force(seed, target_di):
+    rnd = np.random.default_rng(seed)
+    n0, n1 = rnd.integers(3, 30, size=2)
+    s = np.r_[np.zeros(n0, int), np.ones(n1, int)]
+    y_true = rnd.integers(0, 2, size=n0 + n1)
+    y_score = np.round(rnd.random(n0 + n1), 1)  # few distinct scores: many exact DI boundaries
+    out = threshold_tune_groupwise(y_true, y_score, s, target_di=target_di)
+    expected = _brute_force(y_true, y_score, s, target_di)
+    if expected is None:
+        return
+    assert out["di"] >= target_di
+    assert out["acc"] == pytest.approx(expected)
+
+def test_di_boundary_is_inclusive():
+    # group 0 selects 7/10, group 1 selects 63/100: DI is 0.9 up to float rounding
+    s = np.r_[np.zeros(10, int), np.ones(100, int)]
+    y_score = np.r_[np.ones(7), np.zeros(3), np.ones(63), np.zeros(37)]
+    out = threshold_tune_groupwise(np.ones(110, int), y_score, s, target_di=0.9)
+    assert out["di"] >= 0.9
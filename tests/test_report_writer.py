@@ -0,0 +1,67 @@
+import re
+
+import pandas as pd
+import pytest
+
+from engine.evidence import EvidenceBundle
+from engine.report_writer import write_audit_pack, write_fleet_pack
+
+pypdf = pytest.importorskip("pypdf")
+
+def _frames(n_controls=3, n_risks=2):
+    cdf = pd.DataFrame({"control_id": [f"C-{i:02d}" for i in range(n_controls)], "status": ["PASS"] * n_controls,
+                        "evidence": ["metrics.json"] * n_controls, "notes": [f"note {i}" for i in range(n_controls)]})
+    rdf = pd.DataFrame({"level": ["HIGH"] * n_risks, "risk_id": [f"R-{i:02d}" for i in range(n_risks)],
+                        "title": ["t"] * n_risks, "score": [9] * n_risks, "controls": ["C-00"] * n_risks,
+                        "recommendation": ["fix"] * n_risks})
+    return cdf, rdf
+
+def _text(path):
+    return [p.extract_text() for p in pypdf.PdfReader(path).pages]
+
+def test_failed_stages_are_marked_in_the_pack(tmp_path):
+    cdf, rdf = _frames()
+    pdf, _ = write_audit_pack(str(tmp_path), "R1", "2026-01-01", cdf, rdf, failed={"rag_audit": "RuntimeError: rag down"})
+    first = _text(pdf)[0]
+    assert "Incomplete run" in first and "rag_audit: RuntimeError: rag down" in first
+
+def test_complete_run_has_no_incomplete_marker(tmp_path):
+    cdf, rdf = _frames()
+    pdf, _ = write_audit_pack(str(tmp_path), "R1", "2026-01-01", cdf, rdf)
+    assert "Incomplete run" not in "".join(_text(pdf))
+
+def test_long_register_paginates_with_every_row_once(tmp_path):
+    cdf, rdf = _frames(n_controls=150)
+    pdf, stats = write_audit_pack(str(tmp_path), "R1", "2026-01-01", cdf, rdf)
+    pages = _text(pdf)
+    assert stats["pages"] == len(pages) > 2
+    assert all(f"Page {i + 1}" in t for i, t in enumerate(pages))
+    assert re.findall(r"note (\d+)", "".join(pages)) == [str(i) for i in range(150)]
+    assert all("Notes" in t for t in pages[2:])  # the table header repeats
+
+def test_remediation_addendum_is_merged_into_the_pack(tmp_path):
+    cdf, rdf = _frames()
+    mitigation = {"method": "group thresholds", "target_di": 0.8,
+                  "after": {"di": 0.85, "acc": 0.9, "thresholds": {"F": 0.41, "M": 0.52}}}
+    pdf, _ = write_audit_pack(str(tmp_path), "R1", "2026-01-01", cdf, rdf, mitigation)
+    last = _text(pdf)[-1]
+    assert "Remediation Addendum" in last and "0.4100" in last and "0.5200" in last
+
+def _stored_run(path, n_controls):
+    cdf, rdf = _frames(n_controls=n_controls)
+    b = EvidenceBundle(str(path))
+    b.put("controls", cdf)
+    b.put("risks", rdf)
+    b.save()
+    return str(path)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_fleet_pack_sections_follow_the_overview_in_order(tmp_path, workers):
+    runs = [{"run_id": f"F-{i}", "model": f"model-{i}", "evidence_dir": _stored_run(tmp_path / f"ev{i}", 60 * (i + 1))}
+            for i in range(3)]
+    pdf, stats = write_fleet_pack(str(tmp_path), "F", runs, workers=workers)
+    pages = _text(pdf)
+    assert stats["pages"] == len(pages) and stats["runs"] == 3
+    firsts = [next(i for i, t in enumerate(pages) if f"Run ID: F-{k}" in t) for k in range(3)]
+    assert 0 < firsts[0] < firsts[1] < firsts[2]
+    assert "model-2" in pages[firsts[2]] and "note 179" in "".join(pages[firsts[2]:])
@@ -0,0 +1,44 @@
+import pytest
+
+from engine import run_store
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_store, "DB_PATH", str(tmp_path / "runs.db"))
+    return run_store
+
+def _run(run_id, ts, status, di=0.9, model="m"):
+    return {"run_id": run_id, "timestamp": ts, "model": model, "metrics": {"di": di}, "controls": {"F-01": status}}
+
+def _prev(store):
+    with store._pool().connection() as con:
+        return dict(con.execute("SELECT run_id, prev_status FROM control_status ORDER BY ts"))
+
+def test_prev_status_follows_inserts_between_runs(store):
+    store.upsert_runs([_run("a", "2024-01-01T10:00", "PASS"), _run("c", "2024-01-03T10:00", "PASS")])
+    store.upsert_run(_run("b", "2024-01-02T10:00", "FAIL"))
+    assert _prev(store) == {"a": None, "b": "PASS", "c": "FAIL"}
+    assert list(store.control_flips("F-01", "FAIL")["run_id"]) == ["b"]
+
+def test_reupsert_refreshes_the_next_run(store):
+    store.upsert_runs([_run("a", "2024-01-01T10:00", "PASS"), _run("b", "2024-01-02T10:00", "FAIL"),
+                       _run("c", "2024-01-03T10:00", "PASS")])
+    store.upsert_run(_run("b", "2024-01-02T10:00", "REVIEW"))
+    assert _prev(store)["c"] == "REVIEW"
+
+def test_moved_run_refreshes_old_and_new_neighbours(store):
+    store.upsert_runs([_run("a", "2024-01-01T10:00", "PASS"), _run("b", "2024-01-02T10:00", "FAIL"),
+                       _run("c", "2024-01-03T10:00", "PASS"), _run("d", "2024-01-05T10:00", "PASS")])
+    store.upsert_run(_run("b", "2024-01-04T10:00", "FAIL", di=0.5))
+    assert _prev(store) == {"a": None, "c": "PASS", "b": "PASS", "d": "FAIL"}
+
+    daily = store.metric_daily("di", model="m").set_index("day")
+    assert "2024-01-02" not in daily.index and daily.loc["2024-01-04", "mean"] == 0.5
+    assert store.control_daily("F-01", model="m").loc["2024-01-04", "FAIL"] == 1
+
+def test_run_moved_to_another_model(store):
+    store.upsert_runs([_run("a", "2024-01-01T10:00", "PASS"), _run("b", "2024-01-02T10:00", "FAIL"),
+                       _run("c", "2024-01-03T10:00", "PASS")])
+    store.upsert_run(_run("b", "2024-01-02T10:00", "FAIL", model="other"))
+    assert _prev(store) == {"a": None, "b": None, "c": "PASS"}
+    assert len(store.metric_daily("di", model="m")) == 2
@@ -0,0 +1,43 @@
+import asyncio, json
+
+import pytest
+
+from engine import run_store, service
+
+@pytest.fixture
+def svc(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_store, "DB_PATH", str(tmp_path / "runs.db"))
+    s = service.AuditService(workers=1)
+    s.runner.stop()  # requests only; queued jobs stay queued
+    for t in s.runner._threads:
+        t.join()
+    return s
+
+def _get(svc, target):
+    async def go():
+        server = await asyncio.start_server(svc.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            await writer.drain()
+            raw = await reader.read()
+            writer.close()
+        head, _, body = raw.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+    return asyncio.run(go())
+
+@pytest.mark.parametrize("query", ["limit=abc", "offset=1.5", "limit=-1", "offset=-3", "limit=nan"])
+def test_bad_paging_is_a_client_error(svc, query):
+    status, body = _get(svc, f"/audits?{query}")
+    assert status == 400 and "must be" in body["error"]
+
+def test_paging(svc):
+    for i in range(3):
+        run_store.insert_job(f"j{i}", {}, f"2024-01-0{i + 1}")
+    status, body = _get(svc, "/audits?limit=2&offset=1")
+    assert status == 200 and [j["job_id"] for j in body["jobs"]] == ["j1", "j0"]
+
+def test_bad_wait_is_a_client_error(svc):
+    run_store.insert_job("j", {}, "2024-01-01")
+    assert _get(svc, "/audits/j?wait=soon")[0] == 400
@@ -0,0 +1,41 @@
+import threading
+import tracemalloc
+
+from engine.tracing import Tracer, use_tracer, span, RssSampler
+
+def test_overlapping_profiled_spans_share_tracemalloc(tmp_path):
+    tracer = Tracer(profile=["*"], profile_dir=str(tmp_path))
+    entered, release = threading.Barrier(2), threading.Event()
+
+    def work():
+        with use_tracer(tracer), span("worker"):
+            buf = bytearray(2 << 20)
+            entered.wait()
+            release.wait(5)
+            del buf
+
+    threads = [threading.Thread(target=work) for _ in range(2)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert not tracemalloc.is_tracing()
+    for ev in tracer.events:
+        assert "tracemalloc_peak_mb" not in ev  # overlapped: a peak would mix both threads
+        assert "tracemalloc_delta_mb" in ev and ev["rss_delta_mb"] is not None
+
+def test_single_profiled_span_reports_peak(tmp_path):
+    tracer = Tracer(profile=["*"], profile_dir=str(tmp_path))
+    with use_tracer(tracer), span("alone"):
+        buf = bytearray(4 << 20)
+        del buf
+    ev = tracer.events[0]
+    assert ev["tracemalloc_peak_mb"] >= 4 and ev["sampled_peak_rss_mb"] >= ev["rss_mb"] - 1
+    assert "peak_rss_mb" not in tracer.summary()["alone"]
+
+def test_rss_sampler_measures_delta():
+    with RssSampler(interval_s=0.01) as mem:
+        buf = bytearray(32 << 20)
+        buf[::4096] = b"x" * len(buf[::4096])
+    assert mem.delta_mb >= 16 and mem.peak_mb >= mem.start_mb + 16
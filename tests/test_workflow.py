@@ -0,0 +1,68 @@
+import time
+from functools import partial
+
+from engine import workflow
+from engine.workflow import Node, run_dag
+from engine.tracing import span
+
+def test_log_callback_error_does_not_fail_the_run():
+    def bad_log(out):
+        raise KeyError("missing")
+
+    events = []
+    ctx, status = run_dag([Node("a", lambda: 1, outputs=("x",), log=bad_log),
+                           Node("b", lambda x: x + 1, inputs=("x",), outputs=("y",))],
+                          on_event=lambda *a: events.append(a) or 1 / 0)
+    assert status == {"a": "ok", "b": "ok"} and ctx["y"] == 2
+    assert "KeyError" in next(e for _, st, e in events if e["node"] == "a" and st == "ok")["log_error"]
+
+def test_timed_out_thread_node_is_cancelled_at_next_span():
+    progress = []
+
+    def slow():
+        for i in range(50):
+            with span("step"):
+                progress.append(i)
+                time.sleep(0.02)
+
+    _, status = run_dag([Node("slow", slow, timeout=0.1)])
+    assert status["slow"] == "timeout"
+    time.sleep(0.1)
+    n = len(progress)
+    time.sleep(0.1)
+    assert len(progress) == n < 50
+
+def test_process_pool_is_reused_across_runs():
+    nodes = lambda: [Node("p", partial(max, 1, 2), outputs=("m",), pool="process")]
+    ctx, _ = run_dag(nodes())
+    pool = workflow._PROCS[0]
+    ctx2, _ = run_dag(nodes())
+    assert ctx["m"] == ctx2["m"] == 2 and workflow._PROCS[0] is pool
+
+def test_process_pool_grows_to_the_requested_size():
+    nodes = [Node(f"p{i}", partial(max, i, 0), outputs=(f"m{i}",), pool="process") for i in range(3)]
+    ctx, status = run_dag(nodes, process_workers=3)
+    assert set(status.values()) == {"ok"} and ctx["m2"] == 2
+    assert workflow._PROCS[1] >= 3
+
+def test_default_process_pool_size_comes_from_config():
+    from engine.config import PROCESS_WORKERS
+    run_dag([Node("p", partial(max, 1, 2), outputs=("m",), pool="process")])
+    assert workflow._PROCS[1] >= PROCESS_WORKERS >= 1
+
+def test_optional_input_of_a_failed_producer_is_none():
+    def boom():
+        raise RuntimeError("rag down")
+
+    seen = {}
+    ctx, status = run_dag([Node("ml", lambda: 1, outputs=("m",)),
+                           Node("rag", boom, outputs=("r",)),
+                           Node("controls", lambda m, r: seen.update(r=r) or m + 1, inputs=("m", "r"), outputs=("c",), optional=("r",)),
+                           Node("strict", lambda r: r, inputs=("r",), outputs=("s",))])
+    assert status == {"ml": "ok", "rag": "failed", "controls": "ok", "strict": "skipped"}
+    assert ctx["c"] == 2 and seen == {"r": None}
+
+def test_optional_input_waits_for_its_producer():
+    ctx, status = run_dag([Node("slow", lambda: time.sleep(0.1) or 5, outputs=("r",)),
+                           Node("use", lambda r: r, inputs=("r",), outputs=("u",), optional=("r",))])
+    assert status["use"] == "ok" and ctx["u"] == 5